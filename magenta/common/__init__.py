@@ -16,6 +16,7 @@
 
 from __future__ import absolute_import
 
+from .beam_search import batched_beam_search
 from .beam_search import beam_search
 from .nade import Nade
 from .sequence_example_lib import count_records
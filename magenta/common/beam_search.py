@@ -18,6 +18,10 @@ import collections
 import copy
 import heapq
 
+from magenta.common import state_util
+import numpy as np
+import tensorflow.compat.v1 as tf
+
 # A beam entry containing a) the current sequence, b) a "state" containing any
 # information needed to extend the sequence, and c) a score for the current
 # sequence e.g. log-likelihood.
@@ -141,3 +145,172 @@ def beam_search(initial_sequence, initial_state, generate_step_fn, num_steps,
   beam_entry = _prune_branches(beam_entries, k=1)[0]
 
   return beam_entry.sequence, beam_entry.state, beam_entry.score
+
+
+class BeamHistory(object):
+  """Event histories for the hypotheses in a batched beam search.
+
+  Rather than keeping a separate copy of each hypothesis' event sequence, the
+  events generated at each step are stored once in an append-only buffer along
+  with the index of each hypothesis' parent at the previous step. Branching and
+  pruning only gather the small array of row indices that identifies each
+  hypothesis' latest event; no events are ever copied. Full sequences are
+  reconstructed on demand by following the parent indices back to the start.
+  """
+
+  def __init__(self, initial_sequence, num_hypotheses):
+    """Constructs a `BeamHistory`.
+
+    Args:
+      initial_sequence: The initial sequence shared by every hypothesis, a
+          Python list-like object.
+      num_hypotheses: The initial number of hypotheses.
+    """
+    self._initial_sequence = list(initial_sequence)
+    self._events = []
+    self._parents = []
+    self._rows = np.zeros(num_hypotheses, dtype=np.int64)
+
+  def __len__(self):
+    """The current number of hypotheses."""
+    return len(self._rows)
+
+  @property
+  def num_steps(self):
+    """The number of events generated after the initial sequence."""
+    return len(self._events)
+
+  @property
+  def sequence_length(self):
+    """The length of every hypothesis' sequence, including the initial one."""
+    return len(self._initial_sequence) + len(self._events)
+
+  def append(self, events):
+    """Appends one event to each hypothesis.
+
+    Args:
+      events: A 1-D array-like with one event per hypothesis.
+    """
+    events = np.asarray(events)
+    if events.shape != self._rows.shape:
+      raise ValueError('Expected %d events, got shape %s' %
+                       (len(self._rows), events.shape))
+    self._events.append(events)
+    self._parents.append(self._rows)
+    self._rows = np.arange(len(events))
+
+  def gather(self, indices):
+    """Replaces the hypotheses with those at `indices`, which may repeat."""
+    self._rows = self._rows[indices]
+
+  def last_events(self):
+    """Returns an array of the latest event of each hypothesis.
+
+    Returns:
+      A 1-D numpy array with one event per hypothesis.
+
+    Raises:
+      ValueError: If no events have been generated yet.
+    """
+    if not self._events:
+      raise ValueError('No events have been generated.')
+    return self._events[-1][self._rows]
+
+  def generated_events(self):
+    """Returns the generated events of every hypothesis as a 2-D array.
+
+    Returns:
+      A numpy array of shape [num_hypotheses, num_steps] containing the events
+      generated after the initial sequence.
+    """
+    if not self._events:
+      return np.zeros([len(self._rows), 0], dtype=np.int64)
+    events = np.empty([len(self._rows), len(self._events)],
+                      dtype=self._events[0].dtype)
+    rows = self._rows
+    for step in range(len(self._events) - 1, -1, -1):
+      events[:, step] = self._events[step][rows]
+      rows = self._parents[step][rows]
+    return events
+
+  def sequence(self, i):
+    """Returns the full sequence of hypothesis `i` as a list."""
+    events = []
+    row = self._rows[i]
+    for step in range(len(self._events) - 1, -1, -1):
+      event = self._events[step][row]
+      # Events in object arrays are already Python objects.
+      events.append(event.item() if isinstance(event, np.generic) else event)
+      row = self._parents[step][row]
+    return self._initial_sequence + events[::-1]
+
+
+def batched_beam_search(initial_sequence, initial_state, generate_step_fn,
+                        num_steps, beam_size, branch_factor,
+                        steps_per_iteration):
+  """Generates a sequence using beam search over batched numpy state.
+
+  This follows the same algorithm as `beam_search`, and returns the same result
+  for an equivalent `generate_step_fn`, but never copies sequences or states.
+  Event sequences are kept in a shared `BeamHistory`, states are nested
+  structures of numpy arrays whose first dimension indexes the hypotheses, and
+  scores are a numpy array. Branching and pruning are done by gathering rows.
+
+  Args:
+    initial_sequence: The initial sequence, a Python list-like object.
+    initial_state: The state corresponding to the initial sequence, a nested
+        structure of numpy arrays (or values convertible to numpy arrays)
+        without a batch dimension.
+    generate_step_fn: A function that takes three parameters: a `BeamHistory`
+        holding the current hypotheses, a batched state structure, and a 1-D
+        numpy array of scores, all with the same number of hypotheses. The
+        function should generate a single step for each hypothesis and return
+        a 1-D array with the new event for each hypothesis, the updated batched
+        state, and the updated (total) scores. It must not modify the
+        `BeamHistory`.
+    num_steps: The integer length in steps of the final sequence, after
+        generation.
+    beam_size: The integer beam size to use.
+    branch_factor: The integer branch factor to use.
+    steps_per_iteration: The integer number of steps to take per iteration.
+
+  Returns:
+    A tuple containing a) the highest-scoring sequence as computed by the beam
+    search, as a list, b) the state corresponding to this sequence, without a
+    batch dimension, and c) the score of this sequence.
+  """
+  history = BeamHistory(initial_sequence, beam_size)
+  states = tf.nest.map_structure(
+      lambda x: np.repeat(np.asarray(x)[np.newaxis], beam_size, axis=0),
+      initial_state)
+  scores = np.zeros(beam_size)
+
+  def generate_branches(states, scores, num_steps):
+    if branch_factor > 1:
+      indices = np.tile(np.arange(len(scores)), branch_factor)
+      history.gather(indices)
+      states = state_util.gather(states, indices)
+      scores = scores[indices]
+    for _ in range(num_steps):
+      events, states, scores = generate_step_fn(history, states, scores)
+      history.append(events)
+    return states, np.asarray(scores)
+
+  def prune_branches(states, scores, k):
+    # A stable sort keeps ties in beam order, matching `_prune_branches`.
+    indices = np.argsort(-scores, kind='stable')[:k]
+    history.gather(indices)
+    return state_util.gather(states, indices), scores[indices]
+
+  first_iteration_num_steps = (num_steps - 1) % steps_per_iteration + 1
+  states, scores = generate_branches(states, scores, first_iteration_num_steps)
+
+  num_iterations = (num_steps -
+                    first_iteration_num_steps) // steps_per_iteration
+  for _ in range(num_iterations):
+    states, scores = prune_branches(states, scores, beam_size)
+    states, scores = generate_branches(states, scores, steps_per_iteration)
+
+  states, scores = prune_branches(states, scores, 1)
+  return (history.sequence(0), state_util.extract_state(states, 0),
+          scores[0].item())
@@ -14,7 +14,9 @@
 
 """Tests for beam search."""
 
+from magenta.common import batched_beam_search
 from magenta.common import beam_search
+import numpy as np
 import tensorflow.compat.v1 as tf
 
 tf.disable_v2_behavior()
@@ -85,6 +87,75 @@ class BeamSearchTest(tf.test.TestCase):
     self.assertEqual(state, 1)
     self.assertEqual(score, 16)
 
+  def _generate_batched_step_fn(self, history, states, scores):
+    # The same binary counter as `_generate_step_fn`, on batched numpy state.
+    value = 0
+    events = np.zeros(len(history), dtype=np.int64)
+    states = states.copy()
+    scores = scores.copy()
+    sequence_length = history.sequence_length + 1
+    for i in range(len(history)):
+      events[i] = value
+      if value == 0:
+        states[i] *= 2
+      else:
+        scores[i] += states[i]
+        states[i] = 1
+      if (i - 1) % (2 ** sequence_length) == 0:
+        value = 1 - value
+    return events, states, scores
+
+  def testBatchedMatchesUnbatched(self):
+    for beam_size, branch_factor, steps_per_iteration in [
+        (1, 1, 1), (1, 1, 2), (1, 32, 1), (32, 1, 1), (4, 3, 2), (3, 4, 3)]:
+      expected = beam_search(
+          initial_sequence=[], initial_state=1,
+          generate_step_fn=self._generate_step_fn, num_steps=7,
+          beam_size=beam_size, branch_factor=branch_factor,
+          steps_per_iteration=steps_per_iteration)
+      sequence, state, score = batched_beam_search(
+          initial_sequence=[], initial_state=1,
+          generate_step_fn=self._generate_batched_step_fn, num_steps=7,
+          beam_size=beam_size, branch_factor=branch_factor,
+          steps_per_iteration=steps_per_iteration)
+      self.assertEqual(expected, (sequence, state, score))
+
+  def testBatchedInitialSequenceAndNestedState(self):
+    def generate_step_fn(history, states, scores):
+      # Each hypothesis emits its index, and the state counts steps.
+      if history.num_steps:
+        self.assertEqual(history.generated_events().shape,
+                         (len(history), history.num_steps))
+      events = np.arange(len(history))
+      states = (states[0] + 1, {'sum': states[1]['sum'] + events})
+      return events, states, scores + events
+
+    sequence, state, score = batched_beam_search(
+        initial_sequence=[7, 8], initial_state=(0, {'sum': 0.0}),
+        generate_step_fn=generate_step_fn, num_steps=3, beam_size=2,
+        branch_factor=2, steps_per_iteration=1)
+
+    # Branches are ordered [beam 0, beam 1, beam 0, beam 1] and the beam is
+    # sorted by score, so after the first step the best branch extends the
+    # second best hypothesis.
+    self.assertEqual([7, 8, 2, 3, 3], sequence)
+    self.assertEqual(3, state[0])
+    self.assertEqual(8.0, state[1]['sum'])
+    self.assertEqual(8.0, score)
+
+  def testBatchedObjectEvents(self):
+    def generate_step_fn(history, states, scores):
+      events = np.empty(len(history), dtype=object)
+      for i in range(len(history)):
+        events[i] = ('event', history.num_steps)
+      return events, states, scores
+
+    sequence, _, _ = batched_beam_search(
+        initial_sequence=[], initial_state=0,
+        generate_step_fn=generate_step_fn, num_steps=2, beam_size=2,
+        branch_factor=1, steps_per_iteration=1)
+    self.assertEqual([('event', 0), ('event', 1)], sequence)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -15,6 +15,7 @@
 """Utility functions for concurrency."""
 
 import functools
+import itertools
 import threading
 import time
 
@@ -118,3 +119,82 @@ class Sleeper(object):
 
     while time.time() < wake_time:
       pass
+
+
+class LatencyRecorder(object):
+  """A lock-free ring buffer of scheduled versus actual event times.
+
+  Keeps the most recent `capacity` pairs of times recorded by the threads it
+  instruments. Slots are claimed from an atomic counter, so writers never block
+  each other or the thread computing a report; a report may only miss the
+  events being written while it is computed.
+
+  Args:
+    capacity: The number of most recent events to keep.
+  Raises:
+    ValueError: When `capacity` is not positive.
+  """
+
+  def __init__(self, capacity=1024):
+    if capacity <= 0:
+      raise ValueError('`capacity` must be positive. Got %d.' % capacity)
+    self._capacity = capacity
+    self._scheduled = [0.0] * capacity
+    self._actual = [0.0] * capacity
+    self._counter = itertools.count()
+    self._num_recorded = 0
+
+  def record(self, scheduled_time, actual_time=None):
+    """Records an event that was scheduled for `scheduled_time`.
+
+    Args:
+      scheduled_time: The float time in seconds the event was scheduled for.
+      actual_time: The float time in seconds the event actually happened, or
+          None to use the current wall time.
+    """
+    if actual_time is None:
+      actual_time = time.time()
+    index = next(self._counter)
+    slot = index % self._capacity
+    self._scheduled[slot] = scheduled_time
+    self._actual[slot] = actual_time
+    self._num_recorded = max(self._num_recorded, index + 1)
+
+  @property
+  def num_recorded(self):
+    """The total number of events recorded."""
+    return self._num_recorded
+
+  def merge(self, other):
+    """Records the recent events of another LatencyRecorder, oldest first.
+
+    Args:
+      other: The LatencyRecorder to copy events from. It should no longer be
+          recorded to.
+    """
+    # pylint:disable=protected-access
+    for index in range(max(0, other._num_recorded - other._capacity),
+                       other._num_recorded):
+      slot = index % other._capacity
+      self.record(other._scheduled[slot], other._actual[slot])
+
+  def report(self):
+    """Returns statistics of how late the recent events were.
+
+    Returns:
+      A dictionary with the number of recent events `count`, and the `p50`,
+      `p99` and `max` float lateness in seconds of the actual times relative
+      to the scheduled times, or None if no events have been recorded.
+    """
+    count = min(self._num_recorded, self._capacity)
+    if not count:
+      return None
+    lateness = sorted(
+        actual - scheduled for scheduled, actual in
+        zip(self._scheduled[:count], self._actual[:count]))
+    return {
+        'count': count,
+        'p50': lateness[count // 2],
+        'p99': lateness[min(count - 1, count * 99 // 100)],
+        'max': lateness[-1],
+    }
@@ -49,6 +49,53 @@ class ConcurrencyTest(tf.test.TestCase):
     for t in threads:
       t.join()
 
+  def testLatencyRecorder(self):
+    recorder = concurrency.LatencyRecorder(capacity=100)
+    self.assertIsNone(recorder.report())
+
+    for i in range(150):
+      recorder.record(i, i + i % 100 / 1000.)
+    self.assertEqual(150, recorder.num_recorded)
+    report = recorder.report()
+    self.assertEqual(100, report['count'])
+    # Only the 100 most recent events, late by 0 to 99 ms, are kept.
+    self.assertAlmostEqual(0.050, report['p50'])
+    self.assertAlmostEqual(0.099, report['p99'])
+    self.assertAlmostEqual(0.099, report['max'])
+
+  def testLatencyRecorder_Merge(self):
+    recorder = concurrency.LatencyRecorder(capacity=100)
+    other = concurrency.LatencyRecorder(capacity=100)
+    for i in range(60):
+      recorder.record(i, i)
+    for i in range(150):
+      other.record(i, i + 0.5)
+    recorder.merge(other)
+    self.assertEqual(160, recorder.num_recorded)
+    report = recorder.report()
+    # Only the 100 most recent events of `other` are merged, and they replace
+    # the older events of `recorder`.
+    self.assertEqual(100, report['count'])
+    self.assertAlmostEqual(0.5, report['p50'])
+    self.assertAlmostEqual(0.5, report['max'])
+
+  def testLatencyRecorder_Threads(self):
+    recorder = concurrency.LatencyRecorder(capacity=1000)
+
+    def record_thread():
+      for _ in range(100):
+        now = time.time()
+        recorder.record(now, now)
+
+    threads = [threading.Thread(target=record_thread) for _ in range(5)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(500, recorder.num_recorded)
+    self.assertEqual(500, recorder.report()['count'])
+    self.assertEqual(0, recorder.report()['max'])
+
 
 if __name__ == '__main__':
   tf.test.main()
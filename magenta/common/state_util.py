@@ -48,6 +48,22 @@ def extract_state(batched_states, i):
   return tf.nest.map_structure(lambda x: x[i], batched_states)
 
 
+def gather(batched_states, indices):
+  """Selects states from a batch of states by index.
+
+  Args:
+    batched_states: A nested structure with numpy array entries whose first
+      dimensions all equal N.
+    indices: A 1-D integer array of indices into the first dimension. Indices
+      may repeat.
+
+  Returns:
+    A nested structure of the same form as `batched_states` whose entries have
+    first dimension `len(indices)`.
+  """
+  return tf.nest.map_structure(lambda x: x[indices], batched_states)
+
+
 def batch(states, batch_size=None):
   """Combines a collection of state structures into a batch, padding if needed.
 
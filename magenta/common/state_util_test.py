@@ -74,6 +74,14 @@ class StateUtilTest(tf.test.TestCase):
 
     self._assert_sructures_equal(self._unbatched_states[1], extracted_state)
 
+  def test_Gather(self):
+    gathered_states = state_util.gather(self._batched_states, [1, 0, 1])
+    expected_gathered_states = state_util.batch(
+        [self._unbatched_states[1], self._unbatched_states[0],
+         self._unbatched_states[1]])
+
+    self._assert_sructures_equal(expected_gathered_states, gathered_states)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -103,6 +103,12 @@ tf.app.flags.DEFINE_boolean(
     'allow_overlap',
     False,
     'Whether to allow the call to overlap with the response.')
+tf.app.flags.DEFINE_boolean(
+    'speculative_generation',
+    False,
+    'Whether to generate responses in the background while the call is being '
+    'played, so a call ending with a silent tick is answered without waiting '
+    'for generation.')
 tf.app.flags.DEFINE_boolean(
     'enable_metronome',
     True,
@@ -372,7 +378,8 @@ def main(unused_argv):
       tempo_control_number=control_map['tempo'],
       temperature_control_number=control_map['temperature'],
       loop_control_number=control_map['loop'],
-      state_control_number=control_map['state'])
+      state_control_number=control_map['state'],
+      speculative_generation=FLAGS.speculative_generation)
 
   _print_instructions()
 
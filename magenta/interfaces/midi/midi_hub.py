@@ -18,8 +18,10 @@
 
 import abc
 import collections
+from concurrent import futures
+import heapq
+import itertools
 import queue
-import re
 import threading
 import time
 
@@ -41,6 +43,25 @@ _DEFAULT_METRONOME_CHANNEL = 1
 # 0-indexed.
 _DRUM_CHANNEL = 9
 
+# The message attribute that MidiSignals are indexed by, for each supported
+# message type.
+_DISPATCH_NUMBER_ARG = {
+    'note_on': 'note',
+    'note_off': 'note',
+    'control_change': 'control',
+}
+
+# The number of recent messages to keep handling latencies for.
+_NUM_HANDLING_LATENCIES = 1024
+
+# The order of MidiPlayer messages for the same note at the same time: notes
+# ending there are closed, then zero-length notes are opened and closed, and
+# then notes starting there are opened.
+_NOTE_OFF_RANK = 0
+_ZERO_LENGTH_NOTE_ON_RANK = 1
+_ZERO_LENGTH_NOTE_OFF_RANK = 2
+_NOTE_ON_RANK = 3
+
 try:
   # The RtMidi backend is easier to install and has support for virtual ports.
   import rtmidi  # pylint: disable=unused-import,g-import-not-at-top
@@ -150,6 +171,42 @@ class MidiSignal(object):
     self._type = type_
     self._inferred_types = inferred_types
 
+  def matches(self, msg):
+    """Returns whether a mido.Message matches the signal.
+
+    Equivalent to matching `str(msg)` against the `str` pattern of the signal,
+    without formatting the message.
+
+    Args:
+      msg: The mido.Message to match.
+
+    Returns:
+      True if the message matches the signal, ignoring its time.
+    """
+    if self._msg is not None:
+      return msg.type == self._msg.type and msg.bytes() == self._msg.bytes()
+    if msg.type not in self._inferred_types:
+      return False
+    value_names = mido.messages.SPEC_BY_TYPE[msg.type]['value_names']
+    return all(getattr(msg, name) == value
+               for name, value in self._kwargs.items()
+               if name in value_names)
+
+  def dispatch_keys(self):
+    """Returns the keys of the messages that may match the signal.
+
+    Each key is a message type with a note or control number, or with None if
+    the signal matches any number.
+
+    Returns:
+      A list of (type, number) tuples.
+    """
+    if self._msg is not None:
+      return [(self._msg.type,
+               getattr(self._msg, _DISPATCH_NUMBER_ARG[self._msg.type]))]
+    return [(type_, self._kwargs.get(_DISPATCH_NUMBER_ARG[type_]))
+            for type_ in self._inferred_types]
+
   def to_message(self):
     """Returns a message using the signal's specifications, if possible."""
     if self._msg:
@@ -176,6 +233,72 @@ class MidiSignal(object):
     return regex_pattern
 
 
+class _SignalIndex(object):
+  """Values keyed by MidiSignal, removed when a matching message arrives.
+
+  Signals with the same pattern share a value. Signals are indexed by the
+  message type and note or control number they match, so that a message is
+  only compared against the few signals that may match it.
+  """
+
+  def __init__(self):
+    # A dictionary mapping signal patterns to (signal, value) tuples.
+    self._entries = {}
+    # A dictionary mapping (type, number) dispatch keys to a dictionary of
+    # signal patterns, used as an ordered set.
+    self._index = collections.defaultdict(dict)
+
+  def setdefault(self, signal, default):
+    """Returns the value for `signal`, setting it to `default` if missing."""
+    pattern = str(signal)
+    if pattern not in self._entries:
+      self._entries[pattern] = (signal, default)
+      for key in signal.dispatch_keys():
+        self._index[key][pattern] = None
+    return self._entries[pattern][1]
+
+  def patterns(self):
+    """Returns the patterns of all signals, in insertion order."""
+    return list(self._entries)
+
+  def pop(self, pattern):
+    """Removes the signal with the given pattern and returns its value."""
+    signal, value = self._entries.pop(pattern)
+    for key in signal.dispatch_keys():
+      del self._index[key][pattern]
+      if not self._index[key]:
+        del self._index[key]
+    return value
+
+  def pop_matches(self, msg):
+    """Removes the signals matching a mido.Message and returns their values.
+
+    Args:
+      msg: The mido.Message to match.
+
+    Returns:
+      The values of the matching signals, in insertion order.
+    """
+    number_arg = _DISPATCH_NUMBER_ARG.get(msg.type)
+    if number_arg is None or not self._entries:
+      return []
+    candidates = set(self._index.get((msg.type, None), ()))
+    candidates.update(self._index.get((msg.type, getattr(msg, number_arg)), ()))
+    if not candidates:
+      return []
+    return [self.pop(pattern) for pattern in list(self._entries)
+            if pattern in candidates and
+            self._entries[pattern][0].matches(msg)]
+
+
+def _log_callback_error(future):
+  """Logs the exception raised by a callback run on a worker pool."""
+  error = future.exception()
+  if error is not None:
+    tf.logging.error('MIDI callback raised an exception: %s', error,
+                     exc_info=(type(error), error, error.__traceback__))
+
+
 class Metronome(threading.Thread):
   """A thread implementing a MIDI metronome.
 
@@ -193,6 +316,8 @@ class Metronome(threading.Thread):
         used in place of a MidiSignal to output nothing on a given tick.
     duration: The duration of the metronome's tick.
     channel: The MIDI channel to output on.
+    latency_recorder: An optional concurrency.LatencyRecorder to record the
+        scheduled and actual send times of ticks with.
   """
   daemon = True
 
@@ -204,8 +329,10 @@ class Metronome(threading.Thread):
                program=_DEFAULT_METRONOME_PROGRAM,
                signals=None,
                duration=_DEFAULT_METRONOME_TICK_DURATION,
-               channel=None):
+               channel=None,
+               latency_recorder=None):
     self._outport = outport
+    self._latency_recorder = latency_recorder
     self.update(
         qpm, start_time, stop_time, program, signals, duration, channel)
     super(Metronome, self).__init__()
@@ -257,6 +384,8 @@ class Metronome(threading.Thread):
 
       tick_message.channel = self._channel
       self._outport.send(tick_message)
+      if self._latency_recorder is not None:
+        self._latency_recorder.record(tick_time)
 
       if tick_message.type == 'note_on':
         sleeper.sleep(self._duration)
@@ -282,7 +411,8 @@ class MidiPlayer(threading.Thread):
 
   The NoteSequence times must be based on the wall time. The playhead matches
   the wall clock. The playback sequence may be updated at any time if
-  `allow_updates` is set to True.
+  `allow_updates` is set to True. Updates only schedule and unschedule the
+  messages that differ from those already scheduled.
 
   Args:
     outport: The Mido port for sending messages.
@@ -296,11 +426,15 @@ class MidiPlayer(threading.Thread):
         called, allowing for additional updates via `update_sequence`.
     channel: The MIDI channel to send playback events.
     offset: The float time in seconds to adjust the playback event times by.
+    latency_recorder: An optional concurrency.LatencyRecorder to record the
+        scheduled and actual send times of playback events with.
   """
 
   def __init__(self, outport, sequence, start_time=time.time(),
-               allow_updates=False, channel=0, offset=0.0):
+               allow_updates=False, channel=0, offset=0.0,
+               latency_recorder=None):
     self._outport = outport
+    self._latency_recorder = latency_recorder
     self._channel = channel
     self._offset = offset
 
@@ -310,8 +444,16 @@ class MidiPlayer(threading.Thread):
     self._lock = threading.RLock()
     # A control variable to signal when the sequence has been updated.
     self._update_cv = threading.Condition(self._lock)
-    # The queue of mido.Message objects to send, sorted by ascending time.
-    self._message_queue = collections.deque()
+    # A heap of [time, note, rank, count, key, mido.Message] entries for the
+    # messages to send, in order of time, note and then rank. Entries of
+    # unscheduled messages have their message set to None and are skipped.
+    self._message_heap = []
+    # The number of unscheduled entries in the heap.
+    self._num_unscheduled = 0
+    # The scheduled heap entries keyed by (time, rank, note, velocity).
+    self._scheduled_entries = collections.defaultdict(list)
+    # A counter to order entries that would otherwise be equal by insertion.
+    self._entry_count = itertools.count()
     # An event that is set when `stop` has been called.
     self._stop_signal = threading.Event()
 
@@ -346,20 +488,26 @@ class MidiPlayer(threading.Thread):
       raise MidiHubError(
           'Attempted to update a MidiPlayer sequence with updates disabled.')
 
-    new_message_list = []
+    # The number of messages to schedule for the new sequence, keyed by
+    # (time, rank, note, velocity). note_off messages have a None velocity.
+    new_messages = collections.Counter()
     # The set of pitches that are already playing and will be closed without
     # first being reopened in in the new sequence.
     closed_notes = set()
     for note in sequence.notes:
       if note.start_time >= start_time:
-        new_message_list.append(
-            mido.Message(type='note_on', note=note.pitch,
-                         velocity=note.velocity, time=note.start_time))
-        new_message_list.append(
-            mido.Message(type='note_off', note=note.pitch, time=note.end_time))
+        if note.end_time == note.start_time:
+          on_rank, off_rank = (
+              _ZERO_LENGTH_NOTE_ON_RANK, _ZERO_LENGTH_NOTE_OFF_RANK)
+        else:
+          on_rank, off_rank = _NOTE_ON_RANK, _NOTE_OFF_RANK
+        new_messages[(note.start_time + self._offset, on_rank, note.pitch,
+                      note.velocity)] += 1
+        new_messages[
+            (note.end_time + self._offset, off_rank, note.pitch, None)] += 1
       elif note.end_time >= start_time and note.pitch in self._open_notes:
-        new_message_list.append(
-            mido.Message(type='note_off', note=note.pitch, time=note.end_time))
+        new_messages[(note.end_time + self._offset, _NOTE_OFF_RANK,
+                      note.pitch, None)] += 1
         closed_notes.add(note.pitch)
 
     # Close remaining open notes at the next event time to avoid abruptly ending
@@ -367,44 +515,96 @@ class MidiPlayer(threading.Thread):
     notes_to_close = self._open_notes - closed_notes
     if notes_to_close:
       next_event_time = (
-          min(msg.time for msg in new_message_list) if new_message_list else 0)
+          min(key[0] for key in new_messages) if new_messages
+          else self._offset)
       for note in notes_to_close:
-        new_message_list.append(
-            mido.Message(type='note_off', note=note, time=next_event_time))
-
-    for msg in new_message_list:
-      msg.channel = self._channel
-      msg.time += self._offset
-
-    self._message_queue = collections.deque(
-        sorted(new_message_list, key=lambda msg: (msg.time, msg.note)))
+        new_messages[(next_event_time, _NOTE_OFF_RANK, note, None)] += 1
+
+    # Unschedule the messages that are no longer in the sequence, and schedule
+    # the ones that are new to it.
+    for key in list(self._scheduled_entries):
+      for _ in range(len(self._scheduled_entries[key]) - new_messages[key]):
+        self._unschedule(key)
+    for key, count in new_messages.items():
+      for _ in range(count - len(self._scheduled_entries.get(key, ()))):
+        self._schedule(key)
     self._update_cv.notify()
 
+  def _schedule(self, key):
+    """Adds a message with the (time, rank, note, velocity) key to the heap."""
+    msg_time, rank, note, velocity = key
+    msg_type = ('note_on' if rank in (_NOTE_ON_RANK, _ZERO_LENGTH_NOTE_ON_RANK)
+                else 'note_off')
+    msg = mido.Message(
+        type=msg_type, note=note, time=msg_time, channel=self._channel)
+    if velocity is not None:
+      msg.velocity = velocity
+    entry = [msg_time, note, rank, next(self._entry_count), key, msg]
+    heapq.heappush(self._message_heap, entry)
+    self._scheduled_entries[key].append(entry)
+
+  def _unschedule(self, key):
+    """Removes a scheduled message with the given key from the heap."""
+    entries = self._scheduled_entries[key]
+    entries.pop()[-1] = None
+    if not entries:
+      del self._scheduled_entries[key]
+    self._num_unscheduled += 1
+    # Drop unscheduled entries once they make up most of the heap.
+    if self._num_unscheduled > len(self._message_heap) // 2:
+      self._message_heap = [
+          entry for entry in self._message_heap if entry[-1] is not None]
+      heapq.heapify(self._message_heap)
+      self._num_unscheduled = 0
+
+  def _next_entry(self):
+    """Returns the heap entry of the next message to send, or None."""
+    while self._message_heap and self._message_heap[0][-1] is None:
+      heapq.heappop(self._message_heap)
+      self._num_unscheduled -= 1
+    return self._message_heap[0] if self._message_heap else None
+
+  def _pop_message(self):
+    """Removes and returns the next message to send."""
+    self._next_entry()
+    entry = heapq.heappop(self._message_heap)
+    entries = self._scheduled_entries[entry[-2]]
+    entries.remove(entry)
+    if not entries:
+      del self._scheduled_entries[entry[-2]]
+    return entry[-1]
+
   @concurrency.serialized
   def run(self):
     """Plays messages in the queue until empty and _allow_updates is False."""
     # Assumes model where NoteSequence is time-stamped with wall time.
     # TODO(hanzorama): Argument to allow initial start not at sequence start?
 
-    while self._message_queue and self._message_queue[0].time < time.time():
-      self._message_queue.popleft()
+    entry = self._next_entry()
+    while entry is not None and entry[0] < time.time():
+      self._pop_message()
+      entry = self._next_entry()
 
     while True:
-      while self._message_queue:
-        delta = self._message_queue[0].time - time.time()
+      while entry is not None:
+        delta = entry[0] - time.time()
         if delta > 0:
           self._update_cv.wait(timeout=delta)
         else:
-          msg = self._message_queue.popleft()
+          msg = self._pop_message()
           if msg.type == 'note_on':
             self._open_notes.add(msg.note)
           elif msg.type == 'note_off':
             self._open_notes.discard(msg.note)
           self._outport.send(msg)
+          if self._latency_recorder is not None:
+            self._latency_recorder.record(msg.time)
+        entry = self._next_entry()
 
       # Either keep player alive and wait for sequence update, or return.
       if self._allow_updates:
         self._update_cv.wait()
+        entry = self._next_entry()
       else:
         break
 
@@ -419,11 +619,13 @@ class MidiPlayer(threading.Thread):
         self._stop_signal.set()
         self._allow_updates = False
 
-        # Replace message queue with immediate end of open notes.
-        self._message_queue.clear()
+        # Replace scheduled messages with immediate end of open notes.
+        self._message_heap = []
+        self._num_unscheduled = 0
+        self._scheduled_entries.clear()
+        stop_time = time.time()
         for note in self._open_notes:
-          self._message_queue.append(
-              mido.Message(type='note_off', note=note, time=time.time()))
+          self._schedule((stop_time, _NOTE_OFF_RANK, note, None))
         self._update_cv.notify()
     if block:
       self.join()
@@ -442,13 +644,16 @@ class MidiCaptor(threading.Thread):
     stop_time: The float wall time in seconds when the capture is to be stopped
         or None.
     stop_signal: A MidiSignal to use as a signal to stop capture.
+    latency_recorder: An optional concurrency.LatencyRecorder to record the
+        receive and capture times of incoming messages with.
   """
   _metaclass__ = abc.ABCMeta
 
   # A message that is used to wake the consumer thread.
   _WAKE_MESSAGE = None
 
-  def __init__(self, qpm, start_time=0, stop_time=None, stop_signal=None):
+  def __init__(self, qpm, start_time=0, stop_time=None, stop_signal=None,
+               latency_recorder=None):
     # A lock for synchronization.
     self._lock = threading.RLock()
     self._receive_queue = queue.Queue()
@@ -456,7 +661,8 @@ class MidiCaptor(threading.Thread):
     self._captured_sequence.tempos.add(qpm=qpm)
     self._start_time = start_time
     self._stop_time = stop_time
-    self._stop_regex = re.compile(str(stop_signal))
+    self._stop_midi_signal = stop_signal
+    self._latency_recorder = latency_recorder
     # A set of active MidiSignals being used by iterators.
     self._iter_signals = []
     # An event that is set when `stop` has been called.
@@ -546,16 +752,19 @@ class MidiCaptor(threading.Thread):
       if msg is MidiCaptor._WAKE_MESSAGE:
         continue
 
+      if self._latency_recorder is not None:
+        self._latency_recorder.record(msg.time)
+
       if msg.time <= self._start_time:
         continue
 
-      if self._stop_regex.match(str(msg)) is not None:
+      if (self._stop_midi_signal is not None and
+          self._stop_midi_signal.matches(msg)):
         break
 
       with self._lock:
-        msg_str = str(msg)
-        for regex, queue_ in self._iter_signals:
-          if regex.match(msg_str) is not None:
+        for signal, queue_ in self._iter_signals:
+          if signal.matches(msg):
             queue_.put(msg.copy())
 
       self._capture_message(msg)
@@ -568,7 +777,7 @@ class MidiCaptor(threading.Thread):
       # Set final captured sequence.
       self._captured_sequence = self.captured_sequence(end_time)
       # Wake up all generators.
-      for regex, queue_ in self._iter_signals:
+      for _, queue_ in self._iter_signals:
         queue_.put(MidiCaptor._WAKE_MESSAGE)
 
   def stop(self, stop_time=None, block=True):
@@ -668,10 +877,9 @@ class MidiCaptor(threading.Thread):
       sleeper = concurrency.Sleeper()
       next_yield_time = time.time() + period
     else:
-      regex = re.compile(str(signal))
       capture_queue = queue.Queue()
       with self._lock:
-        self._iter_signals.append((regex, capture_queue))
+        self._iter_signals.append((signal, capture_queue))
 
     while self.is_alive():
       if signal is None:
@@ -871,10 +1079,19 @@ class MidiHub(object):
     playback_channel: The MIDI channel to send playback events.
     playback_offset: The float time in seconds to adjust the playback event
         times by.
+    callback_workers: The number of worker threads to run callbacks on, or
+        None to run each callback on a new thread. A pool avoids starting a
+        thread per call, but at most `callback_workers` callbacks run at once:
+        callbacks that block, e.g. waiting on another signal or capture, hold a
+        worker and delay all other callbacks until they return.
+    record_timing: A boolean specifying whether or not to record the scheduled
+        and actual send and receive times of the metronome, player and captor
+        threads for `timing_report`.
   """
 
   def __init__(self, input_midi_ports, output_midi_ports, texture_type,
-               passthrough=True, playback_channel=0, playback_offset=0.0):
+               passthrough=True, playback_channel=0, playback_offset=0.0,
+               callback_workers=None, record_timing=False):
     self._texture_type = texture_type
     self._passthrough = passthrough
     self._playback_channel = playback_channel
@@ -883,13 +1100,30 @@ class MidiHub(object):
     self._open_notes = set()
     # This lock is used by the serialized decorator.
     self._lock = threading.RLock()
-    # A dictionary mapping a compiled MidiSignal regex to a condition variable
-    # that will be notified when a matching messsage is received.
-    self._signals = {}
-    # A dictionary mapping a compiled MidiSignal regex to a list of functions
-    # that will be called with the triggering message in individual threads when
-    # a matching message is received.
-    self._callbacks = collections.defaultdict(list)
+    # An index of MidiSignals to condition variables that will be notified when
+    # a matching messsage is received.
+    self._signals = _SignalIndex()
+    # An index of MidiSignals to lists of functions that will be called with
+    # the triggering message when a matching message is received.
+    self._callbacks = _SignalIndex()
+    # The pool to run callbacks on, or None to run each on a new thread.
+    self._callback_pool = (
+        futures.ThreadPoolExecutor(
+            max_workers=callback_workers, thread_name_prefix='MidiHubCallback')
+        if callback_workers else None)
+    # The start and end times of handling the most recent incoming messages.
+    self._handling_latencies = concurrency.LatencyRecorder(
+        _NUM_HANDLING_LATENCIES)
+    # When `record_timing` is True, a dictionary mapping a name for each
+    # started metronome, player and captor thread to its LatencyRecorder. The
+    # recorders of stopped threads are merged into a single recorder per kind
+    # of thread, e.g. 'player-stopped', when a new thread of that kind starts.
+    self._latency_recorders = (
+        collections.OrderedDict() if record_timing else None)
+    # The thread each LatencyRecorder in `_latency_recorders` is recording.
+    self._latency_threads = {}
+    # The number of threads of each kind that have been given a recorder.
+    self._num_latency_threads = collections.Counter()
     # A dictionary mapping integer control numbers to most recently-received
     # integer value.
     self._control_values = {}
@@ -944,6 +1178,8 @@ class MidiHub(object):
       captor.join()
     for player in self._players:
       player.join()
+    if self._callback_pool is not None:
+      self._callback_pool.shutdown(wait=False)
 
   @property
   @concurrency.serialized
@@ -967,7 +1203,76 @@ class MidiHub(object):
       return
     if not msg.time:
       msg.time = time.time()
+    start_time = time.perf_counter()
     self._handle_message(msg)
+    self._handling_latencies.record(start_time, time.perf_counter())
+
+  def message_handling_latency(self):
+    """Returns statistics of the time spent handling recent messages.
+
+    Returns:
+      A dictionary with the number of recent messages `count`, and the `p50`,
+      `p99` and `max` float handling times in seconds, or None if no messages
+      have been handled.
+    """
+    return self._handling_latencies.report()
+
+  @concurrency.serialized
+  def _new_latency_recorder(self, kind):
+    """Returns a LatencyRecorder for a new thread, or None if not recording."""
+    if self._latency_recorders is None:
+      return None
+    self._merge_stopped_latency_recorders(kind)
+    recorder = concurrency.LatencyRecorder()
+    self._latency_recorders[
+        '%s-%d' % (kind, self._num_latency_threads[kind])] = recorder
+    self._num_latency_threads[kind] += 1
+    return recorder
+
+  @concurrency.serialized
+  def _watch_latency_recorder(self, recorder, thread):
+    """Associates a recorder from `_new_latency_recorder` with its thread."""
+    if recorder is not None:
+      self._latency_threads[recorder] = thread
+
+  def _merge_stopped_latency_recorders(self, kind):
+    """Merges the recorders of stopped threads of a kind into a single one."""
+    stopped_name = '%s-stopped' % kind
+    for name, recorder in list(self._latency_recorders.items()):
+      thread = self._latency_threads.get(recorder)
+      if (not name.startswith(kind + '-') or thread is None or
+          thread.ident is None or thread.is_alive()):
+        continue
+      if stopped_name not in self._latency_recorders:
+        self._latency_recorders[stopped_name] = concurrency.LatencyRecorder()
+      self._latency_recorders[stopped_name].merge(recorder)
+      del self._latency_recorders[name]
+      del self._latency_threads[recorder]
+
+  @concurrency.serialized
+  def timing_report(self):
+    """Returns the send and receive jitter of each thread started by the hub.
+
+    Requires the hub to be constructed with `record_timing` set. Metronome and
+    player threads report how late messages were sent relative to their
+    scheduled times, and captor threads how late received messages were
+    captured relative to their arrival.
+
+    Returns:
+      A dictionary mapping thread names, e.g. 'player-0', to dictionaries with
+      the number of recent messages `count` and the `p50`, `p99` and `max`
+      float lateness in seconds, or None for threads that have not sent or
+      received any messages. Threads that stopped before another thread of the
+      same kind was started are reported together, e.g. as 'player-stopped'.
+    Raises:
+      MidiHubError: If the hub is not recording timing.
+    """
+    if self._latency_recorders is None:
+      raise MidiHubError(
+          'Timing is only recorded by a MidiHub with `record_timing` set.')
+    return collections.OrderedDict(
+        (name, recorder.report())
+        for name, recorder in self._latency_recorders.items())
 
   @concurrency.serialized
   def _handle_message(self, msg):
@@ -982,26 +1287,28 @@ class MidiHub(object):
       msg: The mido.Message MIDI message to handle.
     """
     # Notify any threads waiting for this message.
-    msg_str = str(msg)
-    for regex in list(self._signals):
-      if regex.match(msg_str) is not None:
-        self._signals[regex].notify_all()
-        del self._signals[regex]
+    for cond_var in self._signals.pop_matches(msg):
+      cond_var.notify_all()
 
     # Call any callbacks waiting for this message.
-    for regex in list(self._callbacks):
-      if regex.match(msg_str) is not None:
-        for fn in self._callbacks[regex]:
+    for fns in self._callbacks.pop_matches(msg):
+      for fn in fns:
+        if self._callback_pool is None:
           threading.Thread(target=fn, args=(msg,)).start()
+        else:
+          self._callback_pool.submit(fn, msg).add_done_callback(
+              _log_callback_error)
 
-        del self._callbacks[regex]
-
-    # Remove any captors that are no longer alive.
-    self._captors[:] = [t for t in self._captors if t.is_alive()]
     # Add a different copy of the message to the receive queue of each live
-    # capture thread.
+    # capture thread, and remove any captors that are no longer alive.
+    found_dead_captor = False
     for t in self._captors:
-      t.receive(msg.copy())
+      if t.is_alive():
+        t.receive(msg.copy())
+      else:
+        found_dead_captor = True
+    if found_dead_captor:
+      self._captors[:] = [t for t in self._captors if t.is_alive()]
 
     # Update control values if this is a control change message.
     if msg.type == 'control_change':
@@ -1057,9 +1364,12 @@ class MidiHub(object):
       captor_class = MonophonicMidiCaptor
     else:
       captor_class = PolyphonicMidiCaptor
-    captor = captor_class(qpm, start_time, stop_time, stop_signal)
+    latency_recorder = self._new_latency_recorder('captor')
+    captor = captor_class(qpm, start_time, stop_time, stop_signal,
+                          latency_recorder)
     with self._lock:
       self._captors.append(captor)
+      self._watch_latency_recorder(latency_recorder, captor)
     captor.start()
     return captor
 
@@ -1114,15 +1424,7 @@ class MidiHub(object):
       concurrency.Sleeper().sleep(timeout)
       return
 
-    signal_pattern = str(signal)
-    cond_var = None
-    for regex, cond_var in self._signals:
-      if regex.pattern == signal_pattern:
-        break
-    if cond_var is None:
-      cond_var = threading.Condition(self._lock)
-      self._signals[re.compile(signal_pattern)] = cond_var
-
+    cond_var = self._signals.setdefault(signal, threading.Condition(self._lock))
     cond_var.wait()
 
   @concurrency.serialized
@@ -1132,10 +1434,9 @@ class MidiHub(object):
     Args:
       signal: The MidiSignal to wake threads waiting on, or None to wake all.
     """
-    for regex in list(self._signals):
-      if signal is None or regex.pattern == str(signal):
-        self._signals[regex].notify_all()
-        del self._signals[regex]
+    for pattern in self._signals.patterns():
+      if signal is None or pattern == str(signal):
+        self._signals.pop(pattern).notify_all()
     for captor in self._captors:
       captor.wake_signal_waiters(signal)
 
@@ -1156,8 +1457,11 @@ class MidiHub(object):
       self._metronome.update(
           qpm, start_time, signals=signals, channel=channel)
     else:
+      latency_recorder = self._new_latency_recorder('metronome')
       self._metronome = Metronome(
-          self._outport, qpm, start_time, signals=signals, channel=channel)
+          self._outport, qpm, start_time, signals=signals, channel=channel,
+          latency_recorder=latency_recorder)
+      self._watch_latency_recorder(latency_recorder, self._metronome)
       self._metronome.start()
 
   @concurrency.serialized
@@ -1188,10 +1492,13 @@ class MidiHub(object):
     Returns:
       The MidiPlayer thread handling playback to enable updating.
     """
+    latency_recorder = self._new_latency_recorder('player')
     player = MidiPlayer(self._outport, sequence, start_time, allow_updates,
-                        self._playback_channel, self._playback_offset)
+                        self._playback_channel, self._playback_offset,
+                        latency_recorder)
     with self._lock:
       self._players.append(player)
+      self._watch_latency_recorder(latency_recorder, player)
     player.start()
     return player
 
@@ -1233,4 +1540,4 @@ class MidiHub(object):
       signal: A MidiSignal to use as a signal to call `fn` on the triggering
           message.
     """
-    self._callbacks[re.compile(str(signal))].append(fn)
+    self._callbacks.setdefault(signal, []).append(fn)
@@ -0,0 +1,159 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Measures the send and receive jitter of `MidiHub` threads.
+
+Runs headless, so timing regressions in live interaction can be caught on a
+machine without MIDI hardware: the hub sends to an in-process output port, and
+a driver thread plays the performer by calling the callback of an in-process
+input port at scheduled times. The hub runs a metronome, plays back a sequence
+and captures the input for the whole run, and then reports how late each
+thread sent or captured messages relative to their scheduled times.
+
+Example usage:
+  $ python magenta/interfaces/midi/midi_hub_benchmark.py \
+    --duration=10 --playback_notes_per_second=16 --max_p99_ms=5
+"""
+
+import threading
+import time
+
+from absl import app
+from absl import flags
+from magenta.common import concurrency
+from magenta.interfaces.midi import midi_hub
+import mido
+from note_seq.protobuf import music_pb2
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_float('duration', 10.0, 'Length of the run in seconds.')
+flags.DEFINE_integer('qpm', 120, 'Tempo of the metronome and capture.')
+flags.DEFINE_float('playback_notes_per_second', 16.0,
+                   'Density of the played back sequence.')
+flags.DEFINE_float('input_notes_per_second', 8.0,
+                   'Density of the notes sent to the input port.')
+flags.DEFINE_enum('texture', 'polyphonic', ['monophonic', 'polyphonic'],
+                  'The texture type of the hub.')
+flags.DEFINE_boolean('passthrough', True,
+                     'Whether to pass input messages through to the output.')
+flags.DEFINE_float('max_p99_ms', None,
+                   'If set, exits with an error when the p99 lateness of any '
+                   'thread exceeds this many milliseconds.')
+
+
+class _VirtualPort(mido.ports.BaseIOPort):
+  """An in-process MIDI port that counts the messages sent to it."""
+
+  def __init__(self):
+    super(_VirtualPort, self).__init__()
+    self.num_sent = 0
+
+  def _send(self, msg):
+    self.num_sent += 1
+
+
+def _playback_sequence(start_time, stop_time):
+  """Returns a sequence of short notes between two wall times."""
+  sequence = music_pb2.NoteSequence()
+  period = 1. / FLAGS.playback_notes_per_second
+  note_time = start_time
+  i = 0
+  while note_time < stop_time:
+    sequence.notes.add(
+        pitch=60 + i % 12, velocity=64, start_time=note_time,
+        end_time=note_time + period / 2)
+    note_time += period
+    i += 1
+  return sequence
+
+
+def _perform(inport, start_time, stop_time, recorder):
+  """Sends notes to the input port on schedule, as a performer would."""
+  sleeper = concurrency.Sleeper()
+  period = 1. / FLAGS.input_notes_per_second
+  note_time = start_time
+  i = 0
+  while note_time + period / 2 < stop_time:
+    pitch = 48 + i % 12
+    for msg_type, msg_time in [('note_on', note_time),
+                               ('note_off', note_time + period / 2)]:
+      sleeper.sleep_until(msg_time)
+      inport.callback(mido.Message(msg_type, note=pitch, velocity=64))
+      recorder.record(msg_time)
+    note_time += period
+    i += 1
+
+
+def _format_report(report):
+  if report is None:
+    return '%8s' % 'no messages'
+  return '%8d %9.3f %9.3f %9.3f' % (
+      report['count'], report['p50'] * 1000, report['p99'] * 1000,
+      report['max'] * 1000)
+
+
+def main(unused_argv):
+  inport = _VirtualPort()
+  outport = _VirtualPort()
+  texture_type = (midi_hub.TextureType.MONOPHONIC
+                  if FLAGS.texture == 'monophonic'
+                  else midi_hub.TextureType.POLYPHONIC)
+  hub = midi_hub.MidiHub([inport], [outport], texture_type,
+                         passthrough=FLAGS.passthrough, record_timing=True)
+
+  # Burn in the Sleeper offset before anything is scheduled.
+  for _ in range(10):
+    concurrency.Sleeper().sleep(0.01)
+
+  start_time = time.time() + 0.5
+  stop_time = start_time + FLAGS.duration
+  hub.start_metronome(FLAGS.qpm, start_time)
+  captor = hub.start_capture(FLAGS.qpm, start_time, stop_time=stop_time)
+  player = hub.start_playback(
+      _playback_sequence(start_time, stop_time), start_time=start_time)
+  performer_recorder = concurrency.LatencyRecorder()
+  performer = threading.Thread(
+      target=_perform,
+      args=(inport, start_time, stop_time, performer_recorder))
+  performer.start()
+
+  performer.join()
+  player.join()
+  captor.join()
+  hub.stop_metronome()
+
+  reports = hub.timing_report()
+  reports['message_handling'] = hub.message_handling_latency()
+  reports['performer'] = performer_recorder.report()
+  print('%-18s %8s %9s %9s %9s' % ('thread', 'count', 'p50 ms', 'p99 ms',
+                                   'max ms'))
+  for name, report in reports.items():
+    print('%-18s %s' % (name, _format_report(report)))
+  print('%d messages sent to the output port, %d notes captured' % (
+      outport.num_sent, len(captor.captured_sequence().notes)))
+
+  if FLAGS.max_p99_ms is not None:
+    slow_threads = [
+        name for name, report in reports.items()
+        if report is not None and report['p99'] * 1000 > FLAGS.max_p99_ms]
+    if slow_threads:
+      print('p99 lateness exceeds %.3f ms for: %s' % (
+          FLAGS.max_p99_ms, ', '.join(slow_threads)))
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -16,6 +16,7 @@
 
 import collections
 import queue
+import re
 import threading
 import time
 
@@ -130,6 +131,32 @@ class MidiHubTest(tf.test.TestCase):
         r'^control_change channel=\d+ control=\d+ value=2 time=\d+.\d+$',
         str(sig))
 
+  def testMidiSignal_Matches(self):
+    signals = [
+        midi_hub.MidiSignal(msg=mido.Message(type='note_on', note=1)),
+        midi_hub.MidiSignal(type='note_on', note=1),
+        midi_hub.MidiSignal(type='note_off', velocity=127),
+        midi_hub.MidiSignal(type='control_change', value=2),
+        midi_hub.MidiSignal(type='control_change', control=1),
+        midi_hub.MidiSignal(note=1),
+        midi_hub.MidiSignal(value=2),
+    ]
+    messages = [
+        mido.Message(type='note_on', note=1, time=1.5),
+        mido.Message(type='note_on', note=1, velocity=3, time=1.5),
+        mido.Message(type='note_off', note=1, velocity=127, time=1.5),
+        mido.Message(type='note_off', note=2, time=1.5),
+        mido.Message(type='control_change', control=1, value=2, time=1.5),
+        mido.Message(type='control_change', control=3, value=2, time=1.5),
+        mido.Message(type='pitchwheel', pitch=2, time=1.5),
+        mido.Message(type='clock', time=1.5),
+    ]
+    for sig in signals:
+      for msg in messages:
+        self.assertEqual(
+            re.match(str(sig), str(msg)) is not None, sig.matches(msg),
+            '%s, %s' % (sig, msg))
+
   def testMetronome(self):
     start_time = time.time() + 0.1
     qpm = 180
@@ -151,6 +178,50 @@ class MidiHubTest(tf.test.TestCase):
       else:
         self.assertEqual(msg.type, 'note_off')
 
+  def testTimingReport(self):
+    with self.assertRaises(midi_hub.MidiHubError):
+      self.midi_hub.timing_report()
+
+    port = MockMidiPort()
+    hub = midi_hub.MidiHub([port], [port], midi_hub.TextureType.POLYPHONIC,
+                           record_timing=True)
+    start_time = time.time() + 0.1
+    hub.start_metronome(start_time=start_time, qpm=180)
+    sequence = music_pb2.NoteSequence()
+    testing_lib.add_track_to_sequence(
+        sequence, 0, [Note(60, 64, start_time, start_time + 0.1)])
+    player = hub.start_playback(sequence, start_time=start_time)
+    hub.start_capture(180, start_time, stop_time=start_time + 0.2)
+    player.join()
+    hub.stop_metronome()
+    hub.__del__()
+
+    report = hub.timing_report()
+    self.assertEqual(['metronome-0', 'player-0', 'captor-0'], list(report))
+    self.assertEqual(2, report['player-0']['count'])
+    self.assertLess(report['player-0']['max'], 0.01)
+    self.assertGreater(report['metronome-0']['count'], 0)
+    self.assertIsNone(report['captor-0'])
+
+  def testTimingReport_StoppedThreads(self):
+    port = MockMidiPort()
+    hub = midi_hub.MidiHub([port], [port], midi_hub.TextureType.POLYPHONIC,
+                           record_timing=True)
+    for _ in range(3):
+      start_time = time.time() + 0.05
+      sequence = music_pb2.NoteSequence()
+      testing_lib.add_track_to_sequence(
+          sequence, 0, [Note(60, 64, start_time, start_time + 0.05)])
+      hub.start_playback(sequence, start_time=start_time).join()
+    hub.__del__()
+
+    # The recorders of the first two players are merged when the next player
+    # starts, so the number of recorders kept does not grow with each thread.
+    report = hub.timing_report()
+    self.assertEqual(['player-stopped', 'player-2'], list(report))
+    self.assertEqual(4, report['player-stopped']['count'])
+    self.assertEqual(2, report['player-2']['count'])
+
   def testStartPlayback_NoUpdates(self):
     # Use a time in the past to test handling of past notes.
     start_time = time.time() - 0.01
@@ -237,6 +308,61 @@ class MidiHubTest(tf.test.TestCase):
     self.assertFalse(note_events)
     player.stop()
 
+  def testStartPlayback_Updates_Incremental(self):
+    start_time = time.time() + 0.1
+    seq = music_pb2.NoteSequence()
+    notes = [Note(pitch, 100, start_time + 0.1 * i, start_time + 0.1 * i + 0.05)
+             for i, pitch in enumerate([10, 11, 12])]
+    testing_lib.add_track_to_sequence(seq, 0, notes)
+    player = self.midi_hub.start_playback(seq, allow_updates=True)
+
+    # Remove the second note, change the velocity of the third and add a note
+    # before it. Repeating the update must not schedule duplicates.
+    new_seq = music_pb2.NoteSequence()
+    notes = [notes[0], Note(12, 50, notes[2].start, notes[2].end),
+             Note(13, 60, start_time + 0.15, start_time + 0.18)]
+    testing_lib.add_track_to_sequence(new_seq, 0, notes)
+    player.update_sequence(new_seq, start_time=start_time)
+    player.update_sequence(new_seq, start_time=start_time)
+
+    concurrency.Sleeper().sleep_until(start_time + 0.4)
+
+    note_events = []
+    for note in notes:
+      note_events.append((note.start, 'note_on', note.pitch, note.velocity))
+      note_events.append((note.end, 'note_off', note.pitch, 64))
+    note_events = collections.deque(sorted(note_events))
+    while not self.port.message_queue.empty():
+      msg = self.port.message_queue.get()
+      note_event = note_events.popleft()
+      self.assertEqual(note_event[1:], (msg.type, msg.note, msg.velocity))
+      self.assertAlmostEqual(msg.time, note_event[0], delta=0.01)
+
+    self.assertFalse(note_events)
+    player.stop()
+
+  def testStartPlayback_ZeroDurationNote(self):
+    start_time = time.time() + 0.1
+    seq = music_pb2.NoteSequence()
+    # The zero-length note starts where the previous note with the same pitch
+    # ends, and the next one starts.
+    notes = [Note(10, 100, start_time, start_time + 0.05),
+             Note(10, 90, start_time + 0.05, start_time + 0.05),
+             Note(10, 80, start_time + 0.05, start_time + 0.1)]
+    testing_lib.add_track_to_sequence(seq, 0, notes)
+    player = self.midi_hub.start_playback(seq, allow_updates=False)
+    player.join()
+
+    expected_events = [
+        ('note_on', 100), ('note_off', 64), ('note_on', 90), ('note_off', 64),
+        ('note_on', 80), ('note_off', 64)]
+    events = []
+    while not self.port.message_queue.empty():
+      msg = self.port.message_queue.get()
+      self.assertEqual(10, msg.note)
+      events.append((msg.type, msg.velocity))
+    self.assertEqual(expected_events, events)
+
   def testCaptureSequence_StopSignal(self):
     start_time = 1.0
 
@@ -686,6 +812,52 @@ class MidiHubTest(tf.test.TestCase):
         signal=midi_hub.MidiSignal(type='control_change', value=1))
     self.assertAlmostEqual(time.time() - wait_start, 1.2, delta=0.01)
 
+  def testRegisterCallback(self):
+    called = queue.Queue()
+    self.midi_hub.register_callback(
+        called.put, midi_hub.MidiSignal(type='control_change', control=1))
+    self.midi_hub.register_callback(
+        called.put, midi_hub.MidiSignal(type='note_on', note=2))
+    self.send_capture_messages()
+
+    self.assertEqual(self.capture_messages[1], called.get(timeout=1))
+    self.assertEqual(self.capture_messages[4], called.get(timeout=1))
+    # Callbacks are only called at the first matching message.
+    time.sleep(0.1)
+    self.assertTrue(called.empty())
+
+    latency = self.midi_hub.message_handling_latency()
+    self.assertEqual(len(self.capture_messages), latency['count'])
+    self.assertLessEqual(latency['p50'], latency['p99'])
+    self.assertLessEqual(latency['p99'], latency['max'])
+
+  def testRegisterCallback_Blocking(self):
+    # By default each callback runs on its own thread, so a callback that
+    # blocks does not delay the others.
+    unblock = threading.Event()
+    called = queue.Queue()
+    self.midi_hub.register_callback(
+        lambda msg: unblock.wait(),
+        midi_hub.MidiSignal(type='control_change', control=1))
+    self.midi_hub.register_callback(
+        called.put, midi_hub.MidiSignal(type='note_on', note=2))
+    self.send_capture_messages()
+
+    self.assertEqual(self.capture_messages[4], called.get(timeout=1))
+    unblock.set()
+
+  def testRegisterCallback_Pool(self):
+    port = MockMidiPort()
+    hub = midi_hub.MidiHub([port], [port], midi_hub.TextureType.POLYPHONIC,
+                           callback_workers=2)
+    called = queue.Queue()
+    hub.register_callback(
+        called.put, midi_hub.MidiSignal(type='note_on', note=2))
+    msg = mido.Message(type='note_on', note=2, velocity=64)
+    port.callback(msg)
+    self.assertEqual(msg, called.get(timeout=1))
+    hub.__del__()
+
   def testWaitForEvent_Time(self):
     for msg in self.capture_messages[3:-1]:
       threading.Timer(0.1 * msg.time, self.port.callback, args=[msg]).start()
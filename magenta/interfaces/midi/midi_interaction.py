@@ -15,9 +15,11 @@
 """A module for implementing interaction between MIDI and SequenceGenerators."""
 
 import abc
+from concurrent import futures
 import threading
 import time
 
+from magenta.common import concurrency
 import note_seq
 from note_seq.protobuf import generator_pb2
 from note_seq.protobuf import music_pb2
@@ -200,6 +202,11 @@ class CallAndResponseMidiInteraction(MidiInteraction):
     state_control_number: The optinal control change number to use for sending
         state update control changes. The values are 0 for `IDLE`, 1 for
         `LISTENING`, and 2 for `RESPONDING`.
+    speculative_generation: A boolean specifying whether to generate responses
+        in the background while the call is being played. At each tick of the
+        call, a response is generated assuming the call ends with a silent
+        tick, replacing any earlier one. If the call does end that way, the
+        response is played without waiting for a new generation.
 
     Raises:
       ValueError: If exactly one of `clock_signal` or `tick_duration` is not
@@ -237,7 +244,8 @@ class CallAndResponseMidiInteraction(MidiInteraction):
                tempo_control_number=None,
                temperature_control_number=None,
                loop_control_number=None,
-               state_control_number=None):
+               state_control_number=None,
+               speculative_generation=False):
     super(CallAndResponseMidiInteraction, self).__init__(
         midi_hub, sequence_generators, qpm, generator_select_control_number,
         tempo_control_number, temperature_control_number)
@@ -262,6 +270,17 @@ class CallAndResponseMidiInteraction(MidiInteraction):
     self._panic = threading.Event()
     # Even for signalling when to mutate response.
     self._mutate = threading.Event()
+    # A lock to avoid running sequence generators concurrently.
+    self._generate_lock = threading.Lock()
+    # A worker for speculative generation, and the pending speculation as a
+    # (key, Future) tuple, if any.
+    self._generation_pool = (
+        futures.ThreadPoolExecutor(max_workers=1)
+        if speculative_generation else None)
+    self._speculation = None
+    # The end times of calls and the times their first response notes start.
+    self._response_latencies = concurrency.LatencyRecorder()
+    self._num_speculation_hits = 0
 
   def _update_state(self, state):
     """Logs and sends a control change with the state."""
@@ -304,7 +323,7 @@ class CallAndResponseMidiInteraction(MidiInteraction):
             self._midi_hub.control_value(self._loop_control_number) == 127)
 
   def _generate(self, input_sequence, zero_time, response_start_time,
-                response_end_time):
+                response_end_time, sequence_generator=None, temperature=None):
     """Generates a response sequence with the currently-selected generator.
 
     Args:
@@ -313,10 +332,19 @@ class CallAndResponseMidiInteraction(MidiInteraction):
       response_start_time: The float time in seconds for the start of
           generation.
       response_end_time: The float time in seconds for the end of generation.
+      sequence_generator: The SequenceGenerator to use, or None to use the
+          currently-selected one.
+      temperature: The temperature to use, or None to use the current control
+          value.
 
     Returns:
       The generated NoteSequence.
     """
+    if sequence_generator is None:
+      sequence_generator = self._sequence_generator
+    if temperature is None:
+      temperature = self._temperature()
+
     # Generation is simplified if we always start at 0 time.
     response_start_time -= zero_time
     response_end_time -= zero_time
@@ -329,25 +357,156 @@ class CallAndResponseMidiInteraction(MidiInteraction):
         start_time=response_start_time,
         end_time=response_end_time)
 
-    # Get current temperature setting.
-    generator_options.args['temperature'].float_value = self._temperature()
+    generator_options.args['temperature'].float_value = temperature
 
     # Generate response.
     tf.logging.info(
         "Generating sequence using '%s' generator.",
-        self._sequence_generator.details.id)
+        sequence_generator.details.id)
     tf.logging.debug('Generator Details: %s',
-                     self._sequence_generator.details)
+                     sequence_generator.details)
     tf.logging.debug('Bundle Details: %s',
-                     self._sequence_generator.bundle_details)
+                     sequence_generator.bundle_details)
     tf.logging.debug('Generator Options: %s', generator_options)
-    response_sequence = self._sequence_generator.generate(
-        adjust_sequence_times(input_sequence, -zero_time), generator_options)
+    with self._generate_lock:
+      response_sequence = sequence_generator.generate(
+          adjust_sequence_times(input_sequence, -zero_time), generator_options)
     response_sequence = note_seq.trim_note_sequence(response_sequence,
                                                     response_start_time,
                                                     response_end_time)
     return adjust_sequence_times(response_sequence, zero_time)
 
+  def _response_generation_args(self, captured_sequence, capture_start_time,
+                                tick_time, tick_duration, silent_tick):
+    """Returns the `_generate` arguments for a call that ends at `tick_time`.
+
+    Args:
+      captured_sequence: The NoteSequence captured up to `tick_time`.
+      capture_start_time: The float time in seconds the call capture started.
+      tick_time: The float time in seconds of the tick that ends the call.
+      tick_duration: The float duration in seconds of the last tick.
+      silent_tick: Whether the call ends because no notes were played during
+          the last tick.
+
+    Returns:
+      The input sequence, zero time, response start time and response end
+      time.
+    """
+    if silent_tick:
+      # Move the sequence forward one tick in time.
+      captured_sequence = adjust_sequence_times(
+          captured_sequence, tick_duration)
+      captured_sequence.total_time = tick_time
+      capture_start_time += tick_duration
+
+    # Compute duration of response.
+    num_ticks = self._midi_hub.control_value(
+        self._response_ticks_control_number)
+
+    if num_ticks:
+      response_duration = num_ticks * tick_duration
+    else:
+      # Use capture duration.
+      response_duration = tick_time - capture_start_time
+
+    return (captured_sequence, capture_start_time, tick_time,
+            tick_time + response_duration)
+
+  def _generation_key(self, input_sequence, zero_time, response_start_time,
+                      response_end_time):
+    """Returns a key that is equal for `_generate` calls with equal results."""
+    def _round(t):
+      # Tick times are derived in different ways, so ignore rounding errors.
+      return round(t, 6)
+
+    notes = tuple(
+        (note.pitch, note.velocity, _round(note.start_time),
+         _round(note.end_time), note.is_drum)
+        for note in input_sequence.notes)
+    qpm = input_sequence.tempos[0].qpm if input_sequence.tempos else None
+    return (notes, qpm, _round(input_sequence.total_time), _round(zero_time),
+            _round(response_start_time), _round(response_end_time),
+            self._sequence_generator.details.id, self._temperature())
+
+  def _speculate(self, *generate_args):
+    """Starts generating a response in the background.
+
+    Replaces any pending speculation with different arguments.
+
+    Args:
+      *generate_args: The arguments to `_generate`.
+    """
+    key = self._generation_key(*generate_args)
+    if self._speculation is not None:
+      if self._speculation[0] == key:
+        return
+      self._cancel_speculation()
+    self._speculation = (
+        key,
+        self._generation_pool.submit(
+            self._generate, *generate_args,
+            sequence_generator=self._sequence_generator,
+            temperature=self._temperature()))
+
+  def _cancel_speculation(self):
+    """Drops the pending speculation, if any."""
+    if self._speculation is not None:
+      # A generation that has already started cannot be interrupted, so its
+      # result is ignored.
+      self._speculation[1].cancel()
+      self._speculation = None
+
+  def _generate_response(self, *generate_args):
+    """Generates a response, reusing a matching speculation if there is one.
+
+    Args:
+      *generate_args: The arguments to `_generate`.
+
+    Returns:
+      The generated NoteSequence.
+    """
+    speculation = self._speculation
+    self._speculation = None
+    if speculation is not None:
+      if speculation[0] == self._generation_key(*generate_args):
+        try:
+          response_sequence = speculation[1].result()
+        except Exception:  # pylint:disable=broad-except
+          tf.logging.exception('Speculative generation failed.')
+        else:
+          self._num_speculation_hits += 1
+          tf.logging.info('Using speculatively generated response.')
+          return response_sequence
+      else:
+        speculation[1].cancel()
+    return self._generate(*generate_args)
+
+  def _record_response_latency(self, response_sequence, call_end_time):
+    """Records and logs the time from the end of a call to its response."""
+    if not response_sequence.notes:
+      return
+    first_note_time = max(
+        time.time(),
+        min(note.start_time for note in response_sequence.notes))
+    self._response_latencies.record(call_end_time, first_note_time)
+    tf.logging.info('First response note starts %.3f s after the call ended.',
+                    first_note_time - call_end_time)
+
+  def response_latency(self):
+    """Returns statistics of the time to the first note of recent responses.
+
+    Returns:
+      A dictionary with the number of recent responses `count`, the `p50`,
+      `p99` and `max` float times in seconds from the end of each call to the
+      start of the first note of its response, and `speculation_hits`, the
+      total number of responses that were generated speculatively. None if no
+      responses with notes have been played.
+    """
+    report = self._response_latencies.report()
+    if report is not None:
+      report['speculation_hits'] = self._num_speculation_hits
+    return report
+
   def run(self):
     """The main loop for a real-time call and response interaction."""
     start_time = time.time()
@@ -412,6 +571,7 @@ class CallAndResponseMidiInteraction(MidiInteraction):
         listen_ticks += 1
 
       if not captured_sequence.notes:
+        self._cancel_speculation()
         # Reset captured sequence since we are still idling.
         if response_sequence.total_time <= tick_time:
           self._update_state(self.State.IDLE)
@@ -432,31 +592,12 @@ class CallAndResponseMidiInteraction(MidiInteraction):
           # Create response and start playback.
           self._update_state(self.State.RESPONDING)
 
-          capture_start_time = self._captor.start_time
-
-          if silent_tick:
-            # Move the sequence forward one tick in time.
-            captured_sequence = adjust_sequence_times(
-                captured_sequence, tick_duration)
-            captured_sequence.total_time = tick_time
-            capture_start_time += tick_duration
-
-          # Compute duration of response.
-          num_ticks = self._midi_hub.control_value(
-              self._response_ticks_control_number)
-
-          if num_ticks:
-            response_duration = num_ticks * tick_duration
-          else:
-            # Use capture duration.
-            response_duration = tick_time - capture_start_time
-
-          response_start_time = tick_time
-          response_sequence = self._generate(
-              captured_sequence,
-              capture_start_time,
-              response_start_time,
-              response_start_time + response_duration)
+          generate_args = self._response_generation_args(
+              captured_sequence, self._captor.start_time, tick_time,
+              tick_duration, silent_tick)
+          _, _, response_start_time, response_end_time = generate_args
+          response_duration = response_end_time - response_start_time
+          response_sequence = self._generate_response(*generate_args)
 
           # If it took too long to generate, push response to next tick.
           if (time.time() - response_start_time) >= tick_duration / 4:
@@ -472,6 +613,7 @@ class CallAndResponseMidiInteraction(MidiInteraction):
           # initial events due to generation lag.
           player.update_sequence(
               response_sequence, start_time=response_start_time)
+          self._record_response_latency(response_sequence, tick_time)
 
           # Optionally capture during playback.
           if self._allow_overlap:
@@ -485,6 +627,13 @@ class CallAndResponseMidiInteraction(MidiInteraction):
       else:
         # Continue listening.
         self._update_state(self.State.LISTENING)
+        if (self._generation_pool is not None and
+            listen_ticks >= self._min_listen_ticks):
+          # Start generating the response for the call ending with a silent
+          # tick next.
+          self._speculate(*self._response_generation_args(
+              captured_sequence, self._captor.start_time,
+              tick_time + tick_duration, tick_duration, silent_tick=True))
 
       # Potentially loop or mutate previous response.
       if self._mutate.is_set() and not response_sequence.notes:
@@ -513,6 +662,9 @@ class CallAndResponseMidiInteraction(MidiInteraction):
       last_tick_time = tick_time
 
     player.stop()
+    if self._generation_pool is not None:
+      self._cancel_speculation()
+      self._generation_pool.shutdown(wait=False)
 
   def stop(self):
     self._stop_signal.set()
@@ -0,0 +1,109 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for midi_interaction."""
+
+import threading
+
+from magenta.interfaces.midi import midi_interaction
+from note_seq import testing_lib
+from note_seq.protobuf import generator_pb2
+from note_seq.protobuf import music_pb2
+import tensorflow.compat.v1 as tf
+
+
+class FakeMidiHub(object):
+  """A MidiHub without any control values set."""
+
+  def control_value(self, unused_control_number):
+    return None
+
+
+class FakeSequenceGenerator(object):
+  """Responds with a single note, recording the inputs it is called with."""
+
+  def __init__(self):
+    self.details = generator_pb2.GeneratorDetails(id='fake')
+    self.bundle_details = None
+    self.inputs = []
+    self.release = threading.Event()
+    self.release.set()
+
+  def generate(self, input_sequence, generator_options):
+    self.release.wait()
+    self.inputs.append(input_sequence)
+    start_time = generator_options.generate_sections[0].start_time
+    response = music_pb2.NoteSequence()
+    response.notes.add(pitch=60, velocity=100, start_time=start_time,
+                       end_time=start_time + 0.5)
+    return response
+
+
+class CallAndResponseMidiInteractionTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.generator = FakeSequenceGenerator()
+    self.interaction = midi_interaction.CallAndResponseMidiInteraction(
+        FakeMidiHub(), [self.generator], 120, None, tick_duration=2.0,
+        speculative_generation=True)
+    self.call = music_pb2.NoteSequence()
+    self.call.tempos.add(qpm=120)
+    testing_lib.add_track_to_sequence(
+        self.call, 0, [(60, 100, 100.5, 101.0), (62, 100, 101.0, 101.5)])
+    self.call.total_time = 102.0
+
+  def testSpeculation_Hit(self):
+    # While listening at the tick at 102.0, speculate that the call ends with
+    # a silent tick at 104.0.
+    self.interaction._speculate(*self.interaction._response_generation_args(
+        self.call, 100.0, 104.0, 2.0, silent_tick=True))
+
+    # At 104.0, the call is captured with no new notes.
+    captured = music_pb2.NoteSequence()
+    captured.CopyFrom(self.call)
+    captured.total_time = 104.0
+    generate_args = self.interaction._response_generation_args(
+        captured, 100.0, 104.0, 104.0 - 102.0, silent_tick=True)
+    self.assertEqual((104.0, 106.0), generate_args[2:])
+    response = self.interaction._generate_response(*generate_args)
+
+    self.assertLen(self.generator.inputs, 1)
+    self.assertEqual(104.0, response.notes[0].start_time)
+    self.interaction._record_response_latency(response, 104.0)
+    latency = self.interaction.response_latency()
+    self.assertEqual(1, latency['count'])
+    self.assertEqual(1, latency['speculation_hits'])
+
+  def testSpeculation_Miss(self):
+    # Block the speculative generation until after the call has changed.
+    self.generator.release.clear()
+    self.interaction._speculate(*self.interaction._response_generation_args(
+        self.call, 100.0, 104.0, 2.0, silent_tick=True))
+
+    testing_lib.add_track_to_sequence(self.call, 0, [(64, 100, 102.5, 103.0)])
+    self.call.total_time = 104.0
+    generate_args = self.interaction._response_generation_args(
+        self.call, 100.0, 104.0, 2.0, silent_tick=False)
+    self.generator.release.set()
+    self.interaction._generate_response(*generate_args)
+
+    self.assertIsNone(self.interaction._speculation)
+    self.assertIsNone(self.interaction.response_latency())
+    self.interaction._generation_pool.shutdown(wait=True)
+    # The response was generated from the call with the new note.
+    self.assertLen(self.generator.inputs[-1].notes, 3)
+
+
+if __name__ == '__main__':
+  tf.test.main()
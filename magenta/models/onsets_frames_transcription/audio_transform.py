@@ -12,18 +12,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""SoX-based audio transform functions for the purpose of data augmentation."""
+"""Audio transform functions for the purpose of data augmentation.
+
+Transforms are run either through SoX or by an in-memory numpy implementation
+of the same pipeline stages, selected with the `audio_transform_engine` hparam.
+"""
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import io
 import math
 import random
 import subprocess
 import tempfile
+import wave
 
 from magenta.contrib import training as contrib_training
+import librosa
+from note_seq import audio_io
+import numpy as np
+import scipy.signal
 import sox
 import tensorflow.compat.v1 as tf
 
@@ -66,6 +76,7 @@ AUDIO_TRANSFORM_PIPELINE = [
 # transformation will be performed.
 DEFAULT_AUDIO_TRANSFORM_HPARAMS = contrib_training.HParams(
     transform_audio=False,
+    audio_transform_engine='sox',
     audio_transform_noise_type='pinknoise',
     audio_transform_min_noise_vol=0.0,
     audio_transform_max_noise_vol=0.04,
@@ -100,18 +111,23 @@ class AudioTransformParameter(object):
     self.max_value = max_value
     self.scale = scale
 
-  def sample(self):
+  def sample(self, rng=None):
     """Sample the parameter, returning a random value in its range.
 
+    Args:
+      rng: A numpy RandomState to sample with. If None, uses the `random`
+          module.
+
     Returns:
       A value drawn uniformly at random between `min_value` and `max_value`.
     """
+    uniform = rng.uniform if rng is not None else random.uniform
     if self.scale == 'linear':
-      return random.uniform(self.min_value, self.max_value)
+      return uniform(self.min_value, self.max_value)
     else:
       log_min_value = math.log(self.min_value)
       log_max_value = math.log(self.max_value)
-      return math.exp(random.uniform(log_min_value, log_max_value))
+      return math.exp(uniform(log_min_value, log_max_value))
 
 
 class AudioTransformStage(object):
@@ -139,6 +155,25 @@ class AudioTransformStage(object):
     args = dict((param.name, param.sample()) for param in self.params)
     getattr(transformer, self.name)(**args)
 
+  def apply_to_samples(self, samples, sample_rate, rng):
+    """Apply this stage to audio samples in memory.
+
+    Args:
+      samples: A 1-D numpy array of audio samples.
+      sample_rate: The sample rate of `samples`.
+      rng: A numpy RandomState used to sample the stage parameters.
+
+    Returns:
+      The transformed samples, with the same length as `samples`.
+
+    Raises:
+      ValueError: If the stage has no numpy implementation.
+    """
+    if self.name not in _NUMPY_STAGES:
+      raise ValueError('no numpy implementation of stage: %s' % self.name)
+    args = dict((param.name, param.sample(rng)) for param in self.params)
+    return _NUMPY_STAGES[self.name](samples, sample_rate, **args)
+
 
 def construct_pipeline(hparams, pipeline):
   """Construct an audio transform pipeline from hyperparameters.
@@ -169,6 +204,214 @@ def construct_pipeline(hparams, pipeline):
   ]
 
 
+# FFT size of the phase vocoder used for pitch shifting.
+_PITCH_N_FFT = 2048
+
+# Delays of the comb and allpass filters of the reverb at 44.1 kHz, from
+# Freeverb, which the SoX reverb is based on.
+_REVERB_COMB_DELAYS = (1116, 1188, 1277, 1356, 1422, 1491, 1557, 1617)
+_REVERB_ALLPASS_DELAYS = (556, 441, 341, 225)
+_REVERB_ALLPASS_FEEDBACK = 0.5
+_REVERB_DAMPING = 0.2
+_REVERB_INPUT_GAIN = 0.015
+
+# Filter that turns white noise into pink noise, with a -3 dB/octave slope.
+_PINK_NOISE_B = (0.049922035, -0.095993537, 0.050612699, -0.004408786)
+_PINK_NOISE_A = (1.0, -2.494956002, 2.017265875, -0.522189400)
+
+
+def _pitch(samples, sample_rate, n_semitones):
+  """Shifts the pitch of samples without changing their duration.
+
+  The samples are time-stretched with a phase vocoder, whose phases are
+  accumulated for all frames at once, and then resampled to their original
+  duration.
+
+  Args:
+    samples: A 1-D numpy array of audio samples.
+    sample_rate: The sample rate of `samples`.
+    n_semitones: The pitch shift in semitones.
+
+  Returns:
+    The pitch-shifted samples.
+  """
+  del sample_rate
+  ratio = 2.0 ** (n_semitones / 12.0)
+  hop_length = _PITCH_N_FFT // 4
+  stft = librosa.stft(
+      samples.astype(np.float32), n_fft=_PITCH_N_FFT, hop_length=hop_length)
+  stft = np.pad(stft, [(0, 0), (0, 2)])
+  magnitudes = np.abs(stft)
+  angles = np.angle(stft)
+
+  # Stretch time by `ratio`, interpolating magnitudes between frames and
+  # advancing each bin's phase by its measured frequency.
+  steps = np.arange(0, stft.shape[1] - 2, 1 / ratio)
+  frames = steps.astype(int)
+  alpha = (steps - frames).astype(np.float32)
+  magnitude = ((1 - alpha) * magnitudes[:, frames] +
+               alpha * magnitudes[:, frames + 1])
+  # Phases are accumulated in float64, since they grow with every frame.
+  expected_advance = np.linspace(
+      0, np.pi * hop_length, stft.shape[0])[:, np.newaxis]
+  advance = angles[:, frames + 1] - angles[:, frames] - expected_advance
+  advance -= 2 * np.pi * np.round(advance / (2 * np.pi))
+  advance += expected_advance
+  phase = angles[:, :1] + np.cumsum(
+      np.concatenate([np.zeros_like(advance[:, :1]), advance[:, :-1]], axis=1),
+      axis=1)
+  stretched = librosa.istft(
+      magnitude * np.exp(1j * phase), hop_length=hop_length,
+      length=int(round(len(samples) * ratio)))
+
+  return np.interp(
+      np.arange(len(samples)) * ratio, np.arange(len(stretched)), stretched)
+
+
+def _contrast(samples, sample_rate, amount):
+  """Applies the SoX contrast effect, a simple form of compression."""
+  del sample_rate
+  x = np.clip(samples, -1.0, 1.0) * (np.pi / 2)
+  return np.sin(x + amount / 750.0 * np.sin(4 * x))
+
+
+def _equalizer(samples, sample_rate, frequency, width_q, gain_db):
+  """Applies a peaking equalizer biquad filter, like the SoX equalizer."""
+  if frequency >= sample_rate / 2:
+    return samples
+  a = 10.0 ** (gain_db / 40.0)
+  w0 = 2 * np.pi * frequency / sample_rate
+  alpha = np.sin(w0) / (2 * width_q)
+  b_coefs = [1 + alpha * a, -2 * np.cos(w0), 1 - alpha * a]
+  a_coefs = [1 + alpha / a, -2 * np.cos(w0), 1 - alpha / a]
+  return scipy.signal.lfilter(b_coefs, a_coefs, samples)
+
+
+def _feedback_delay(samples, delay, feedback):
+  """Returns w with w[n] = samples[n] + feedback * w[n - delay]."""
+  num_blocks = -(-len(samples) // delay)
+  blocks = np.zeros(num_blocks * delay)
+  blocks[:len(samples)] = samples
+  # Runs the recursion over consecutive blocks of `delay` samples at once.
+  blocks = scipy.signal.lfilter(
+      [1.0], [1.0, -feedback], blocks.reshape(num_blocks, delay), axis=0)
+  return blocks.ravel()[:len(samples)]
+
+
+def _delay(samples, delay):
+  return np.concatenate([np.zeros(delay), samples[:len(samples) - delay]])
+
+
+def _reverb(samples, sample_rate, reverberance):
+  """Adds Freeverb-style reverb, like the SoX reverb with default settings.
+
+  Args:
+    samples: A 1-D numpy array of audio samples.
+    sample_rate: The sample rate of `samples`.
+    reverberance: The reverberance in percent, which sets the feedback of the
+        comb filters as in SoX.
+
+  Returns:
+    The samples mixed with the reverberated signal.
+  """
+  a = -1 / math.log(1 - 0.3)
+  b = 100 / (math.log(1 - 0.98) * a + 1)
+  feedback = 1 - math.exp((reverberance - b) / (a * b))
+
+  scale = sample_rate / 44100.0
+  inputs = samples * _REVERB_INPUT_GAIN
+  wet = np.zeros_like(inputs)
+  for delay in _REVERB_COMB_DELAYS:
+    delay = max(int(delay * scale), 1)
+    wet += _delay(_feedback_delay(inputs, delay, feedback), delay)
+  # Freeverb damps inside each comb filter; damping the sum is close enough.
+  wet = scipy.signal.lfilter(
+      [1 - _REVERB_DAMPING], [1.0, -_REVERB_DAMPING], wet)
+  for delay in _REVERB_ALLPASS_DELAYS:
+    delay = max(int(delay * scale), 1)
+    wet = _delay(
+        _feedback_delay(wet, delay, _REVERB_ALLPASS_FEEDBACK), delay) - wet
+  return samples + wet
+
+
+_NUMPY_STAGES = {
+    'pitch': _pitch,
+    'contrast': _contrast,
+    'equalizer': _equalizer,
+    'reverb': _reverb,
+}
+
+
+def colored_noise(num_samples, noise_type, rng):
+  """Generates noise with a peak amplitude of 1.
+
+  Args:
+    num_samples: The number of samples to generate.
+    noise_type: One of "whitenoise", "pinknoise", "brownnoise".
+    rng: The numpy RandomState to generate noise with.
+
+  Returns:
+    A 1-D numpy array of noise.
+
+  Raises:
+    ValueError: If `noise_type` is not one of "whitenoise", "pinknoise", or
+        "brownnoise".
+  """
+  if noise_type not in ('whitenoise', 'pinknoise', 'brownnoise'):
+    raise ValueError('invalid noise type: %s' % noise_type)
+  noise = rng.uniform(-1.0, 1.0, num_samples)
+  if noise_type == 'pinknoise':
+    noise = scipy.signal.lfilter(_PINK_NOISE_B, _PINK_NOISE_A, noise)
+  elif noise_type == 'brownnoise':
+    # A leaky integrator, so that the noise does not drift away.
+    noise = scipy.signal.lfilter([1.0], [1.0, -0.999], noise)
+  peak = np.max(np.abs(noise)) if num_samples else 0.0
+  return noise / peak if peak > 0 else noise
+
+
+def transform_samples(samples, sample_rate, hparams, pipeline=None, rng=None):
+  """Transform audio samples in memory based on hyperparameters.
+
+  A numpy implementation of the SoX transforms in `transform_wav_audio`. Noise
+  is mixed in first, as with `sox -m`, then the pipeline stages are applied,
+  and the result is scaled down if it would clip, like the SoX guard. The
+  result is close to, but not identical to, the SoX output.
+
+  Args:
+    samples: A 1-D numpy array of audio samples.
+    sample_rate: The sample rate of `samples`.
+    hparams: The tf.contrib.training.HParams object to use to construct the
+        audio transform pipeline.
+    pipeline: A list of pipeline stages, each specified as a tuple of stage
+        name and a dictionary of parameters. If None, uses
+        `AUDIO_TRANSFORM_PIPELINE`.
+    rng: A numpy RandomState used to sample transform parameters and noise,
+        which makes the transform deterministic. If None, uses the global
+        numpy random state.
+
+  Returns:
+    The transformed samples, as a float32 numpy array with the same length as
+    `samples`.
+  """
+  if rng is None:
+    rng = np.random
+  pipeline = construct_pipeline(
+      hparams, pipeline if pipeline is not None else AUDIO_TRANSFORM_PIPELINE)
+
+  noise_vol = rng.uniform(hparams.audio_transform_min_noise_vol,
+                          hparams.audio_transform_max_noise_vol)
+  noise = colored_noise(len(samples), hparams.audio_transform_noise_type, rng)
+  samples = (np.asarray(samples, np.float64) + noise_vol * noise) / 2
+
+  for stage in pipeline:
+    samples = stage.apply_to_samples(samples, sample_rate, rng)
+
+  peak = np.max(np.abs(samples)) if len(samples) else 0.0
+  if peak > 1.0:
+    samples /= peak
+  return samples.astype(np.float32)
+
+
 def run_pipeline(pipeline, input_filename, output_filename):
   """Run an audio transform pipeline.
 
@@ -219,8 +462,9 @@ def transform_wav_audio(wav_audio, hparams, pipeline=None):
   """Transform the contents of a wav file based on hyperparameters.
 
   Args:
-    wav_audio: The contents of a wav file; this will be written to a temporary
-        file and transformed via SoX.
+    wav_audio: The contents of a wav file; with the 'sox' engine, this will be
+        written to a temporary file and transformed via SoX, and with the
+        'numpy' engine it is transformed in memory by `transform_samples`.
     hparams: The tf.contrib.training.HParams object to use to construct the
         audio transform pipeline.
     pipeline: A list of pipeline stages, each specified as a tuple of stage
@@ -230,10 +474,22 @@ def transform_wav_audio(wav_audio, hparams, pipeline=None):
   Returns:
     The contents of the wav file that results from applying the audio transform
     pipeline to the input audio.
+
+  Raises:
+    ValueError: If `hparams.audio_transform_engine` is not 'sox' or 'numpy'.
   """
   if not hparams.transform_audio:
     return wav_audio
 
+  if hparams.audio_transform_engine == 'numpy':
+    sample_rate = wave.open(io.BytesIO(wav_audio)).getframerate()
+    samples = audio_io.wav_data_to_samples(wav_audio, sample_rate)
+    samples = transform_samples(samples, sample_rate, hparams, pipeline)
+    return audio_io.samples_to_wav_data(samples, sample_rate)
+  elif hparams.audio_transform_engine != 'sox':
+    raise ValueError(
+        'invalid audio transform engine: %s' % hparams.audio_transform_engine)
+
   pipeline = construct_pipeline(
       hparams, pipeline if pipeline is not None else AUDIO_TRANSFORM_PIPELINE)
 
@@ -0,0 +1,72 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Benchmarks the numpy and SoX audio transform engines.
+
+Transforms random training-length examples with the default
+`AUDIO_TRANSFORM_PIPELINE` and reports examples per second for each engine.
+The SoX engine is skipped if the `sox` binary is not installed.
+
+Example usage:
+  $ python magenta/models/onsets_frames_transcription/audio_transform_benchmark.py \
+    --num_examples=50 --seconds=20
+"""
+
+import copy
+import shutil
+import time
+
+from absl import app
+from absl import flags
+from magenta.models.onsets_frames_transcription import audio_transform
+from note_seq import audio_io
+import numpy as np
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('num_examples', 50, 'Number of examples to transform.')
+flags.DEFINE_float('seconds', 20.0, 'Length of each example in seconds.')
+flags.DEFINE_integer('sample_rate', 16000, 'Sample rate of the examples.')
+flags.DEFINE_integer('seed', 0, 'Random seed.')
+
+
+def main(unused_argv):
+  rng = np.random.RandomState(FLAGS.seed)
+  num_samples = int(FLAGS.seconds * FLAGS.sample_rate)
+  examples = [
+      audio_io.samples_to_wav_data(
+          0.1 * rng.randn(num_samples).astype(np.float32), FLAGS.sample_rate)
+      for _ in range(FLAGS.num_examples)]
+
+  engines = ['numpy']
+  if shutil.which('sox'):
+    engines.append('sox')
+  else:
+    print('sox not found; only benchmarking the numpy engine.')
+
+  hparams = copy.deepcopy(audio_transform.DEFAULT_AUDIO_TRANSFORM_HPARAMS)
+  hparams.transform_audio = True
+  print('Transforming %d examples of %.1f seconds.' %
+        (FLAGS.num_examples, FLAGS.seconds))
+  for engine in engines:
+    hparams.audio_transform_engine = engine
+    start = time.time()
+    for wav_data in examples:
+      audio_transform.transform_wav_audio(wav_data, hparams)
+    elapsed = time.time() - start
+    print('%-6s %8.2f examples/s' % (engine, FLAGS.num_examples / elapsed))
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,111 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for audio_transform."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+
+from magenta.models.onsets_frames_transcription import audio_transform
+from note_seq import audio_io
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+tf.disable_v2_behavior()
+
+SAMPLE_RATE = 16000
+
+
+def _sine(frequency, seconds=2.0):
+  t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+  return 0.5 * np.sin(2 * np.pi * frequency * t)
+
+
+def _peak_frequency(samples):
+  spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+  return np.argmax(spectrum) * SAMPLE_RATE / len(samples)
+
+
+class AudioTransformTest(tf.test.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.hparams = copy.deepcopy(
+        audio_transform.DEFAULT_AUDIO_TRANSFORM_HPARAMS)
+    self.hparams.transform_audio = True
+    self.hparams.audio_transform_engine = 'numpy'
+
+  def testTransformSamplesIsDeterministic(self):
+    samples = _sine(440)
+    first = audio_transform.transform_samples(
+        samples, SAMPLE_RATE, self.hparams, rng=np.random.RandomState(1))
+    second = audio_transform.transform_samples(
+        samples, SAMPLE_RATE, self.hparams, rng=np.random.RandomState(1))
+    other = audio_transform.transform_samples(
+        samples, SAMPLE_RATE, self.hparams, rng=np.random.RandomState(2))
+    self.assertEqual(samples.shape, first.shape)
+    self.assertEqual(np.float32, first.dtype)
+    self.assertLessEqual(np.max(np.abs(first)), 1.0)
+    np.testing.assert_array_equal(first, second)
+    self.assertFalse(np.array_equal(first, other))
+
+  def testPitchShift(self):
+    samples = _sine(440)
+    shifted = audio_transform._pitch(samples, SAMPLE_RATE, n_semitones=1.0)
+    self.assertEqual(samples.shape, shifted.shape)
+    self.assertAlmostEqual(440 * 2 ** (1 / 12), _peak_frequency(shifted),
+                           delta=1.0)
+
+  def testEqualizer(self):
+    samples = _sine(1000)
+    equalized = audio_transform._equalizer(
+        samples, SAMPLE_RATE, frequency=1000.0, width_q=2.0, gain_db=-10.0)
+    # Skip the filter transient.
+    gain_db = 20 * np.log10(
+        np.std(equalized[SAMPLE_RATE:]) / np.std(samples[SAMPLE_RATE:]))
+    self.assertAlmostEqual(-10.0, gain_db, places=2)
+
+  def testReverbAddsTail(self):
+    samples = np.zeros(SAMPLE_RATE)
+    samples[0] = 1.0
+    reverberated = audio_transform._reverb(
+        samples, SAMPLE_RATE, reverberance=50.0)
+    self.assertEqual(1.0, reverberated[0])
+    self.assertGreater(np.max(np.abs(reverberated[SAMPLE_RATE // 2:])), 0.0)
+
+  def testColoredNoise(self):
+    rng = np.random.RandomState(0)
+    for noise_type in ['whitenoise', 'pinknoise', 'brownnoise']:
+      noise = audio_transform.colored_noise(1000, noise_type, rng)
+      self.assertEqual((1000,), noise.shape)
+      self.assertAlmostEqual(1.0, np.max(np.abs(noise)))
+    with self.assertRaises(ValueError):
+      audio_transform.colored_noise(1000, 'bluenoise', rng)
+
+  def testTransformWavAudio(self):
+    wav_data = audio_io.samples_to_wav_data(_sine(440), SAMPLE_RATE)
+    transformed = audio_transform.transform_wav_audio(wav_data, self.hparams)
+    self.assertEqual(len(wav_data), len(transformed))
+    self.assertNotEqual(wav_data, transformed)
+
+    self.hparams.audio_transform_engine = 'ffmpeg'
+    with self.assertRaises(ValueError):
+      audio_transform.transform_wav_audio(wav_data, self.hparams)
+
+
+if __name__ == '__main__':
+  tf.test.main()
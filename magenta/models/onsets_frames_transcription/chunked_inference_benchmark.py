@@ -0,0 +1,201 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Benchmarks chunked against whole-file acoustic model inference.
+
+Runs the acoustic model with random weights on a random spectrogram as long as
+a full recording, once over the whole spectrogram and once split into
+overlapping chunks that are batched and stitched back together with
+`infer_util.chunk_windows` and `infer_util.stitch_chunks`. Each mode runs in
+its own process, so that their peak memory use can be compared.
+
+Example usage:
+  $ python magenta/models/onsets_frames_transcription/chunked_inference_benchmark.py \
+    --minutes=60 --chunk_length_secs=30 --chunk_margin_secs=2 --batch_size=4
+"""
+
+import multiprocessing
+import queue
+import resource
+import time
+
+from absl import app
+from absl import flags
+from magenta.models.onsets_frames_transcription import configs
+from magenta.models.onsets_frames_transcription import constants
+from magenta.models.onsets_frames_transcription import data
+from magenta.models.onsets_frames_transcription import infer_util
+import numpy as np
+import tensorflow.compat.v1 as tf
+from tensorflow.compat.v1 import estimator as tf_estimator
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('config', 'onsets_frames', 'Name of the config to use.')
+flags.DEFINE_float('minutes', 60.0, 'Length of the recording in minutes.')
+flags.DEFINE_float('chunk_length_secs', 30.0, 'Length of a chunk.')
+flags.DEFINE_float('chunk_margin_secs', 2.0,
+                   'Context on each side of a chunk that is dropped.')
+flags.DEFINE_integer('batch_size', 4, 'Number of chunks to run together.')
+flags.DEFINE_enum('mode', 'both', ['both', 'whole', 'chunked'],
+                  'Which inference modes to run.')
+flags.DEFINE_integer('seed', 0, 'Random seed.')
+
+
+def _peak_rss_mb():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_inference(config_name, mode, minutes, chunk_length_secs,
+                   chunk_margin_secs, batch_size, seed, results):
+  """Runs the model in one mode and puts its outputs and timings in results."""
+  tf.disable_v2_behavior()
+  hparams = configs.CONFIG_MAP[config_name].hparams
+  frames_per_second = data.hparams_frames_per_second(hparams)
+  num_frames = int(minutes * 60 * frames_per_second)
+  num_bins = data.hparams_frame_size(hparams)
+  spec = np.random.RandomState(seed).randn(
+      num_frames, num_bins).astype(np.float32)
+
+  with tf.Graph().as_default():
+    # The graph is built identically in both modes, so it is initialized with
+    # the same random weights.
+    tf.set_random_seed(seed)
+    spec_ph = tf.placeholder(tf.float32, [None, None, num_bins, 1])
+    length_ph = tf.placeholder(tf.int32, [None])
+    label_shape = tf.stack([
+        tf.shape(spec_ph)[0], tf.shape(spec_ph)[1], constants.MIDI_PITCHES])
+    labels = data.LabelTensors(
+        labels=tf.zeros(label_shape),
+        label_weights=tf.zeros(label_shape),
+        onsets=tf.zeros(label_shape),
+        offsets=tf.zeros(label_shape),
+        velocities=tf.zeros(label_shape),
+        note_sequence=tf.fill(tf.shape(length_ph), ''))
+    features = data.FeatureTensors(
+        spec=spec_ph,
+        length=length_ph,
+        sequence_id=tf.fill(tf.shape(length_ph), ''))
+    predictions = configs.CONFIG_MAP[config_name].model_fn(
+        features, labels, tf_estimator.ModeKeys.PREDICT, hparams,
+        None).predictions
+    fetches = [predictions['frame_probs'], predictions['onset_probs']]
+
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      baseline_rss_mb = _peak_rss_mb()
+      start = time.time()
+      if mode == 'whole':
+        frame_probs, onset_probs = sess.run(fetches, {
+            spec_ph: spec[np.newaxis, :, :, np.newaxis],
+            length_ph: [num_frames],
+        })
+        frame_probs, onset_probs = frame_probs[0], onset_probs[0]
+      else:
+        windows = infer_util.chunk_windows(
+            num_frames, int(chunk_length_secs * frames_per_second),
+            int(chunk_margin_secs * frames_per_second))
+        chunks = []
+        for i in range(0, len(windows), batch_size):
+          batch = windows[i:i + batch_size]
+          chunk_probs = sess.run(fetches, {
+              spec_ph: np.stack([spec[w.start:w.end] for w in batch])[
+                  :, :, :, np.newaxis],
+              length_ph: [w.end - w.start for w in batch],
+          })
+          chunks.extend(zip(*chunk_probs))
+        frame_probs = infer_util.stitch_chunks(
+            [frame for frame, _ in chunks], windows)
+        onset_probs = infer_util.stitch_chunks(
+            [onset for _, onset in chunks], windows)
+      results.put({
+          'mode': mode,
+          'seconds': time.time() - start,
+          'peak_rss_mb': _peak_rss_mb(),
+          'baseline_rss_mb': baseline_rss_mb,
+          'frame_probs': frame_probs,
+          'onset_probs': onset_probs,
+      })
+
+
+def _get_result(result_queue, process):
+  """Waits for the result of an inference process.
+
+  Args:
+    result_queue: The queue the process puts its result on.
+    process: The inference process.
+
+  Returns:
+    The result dictionary.
+
+  Raises:
+    RuntimeError: If the process exits without putting a result.
+  """
+  while True:
+    try:
+      return result_queue.get(timeout=1.0)
+    except queue.Empty:
+      if not process.is_alive():
+        break
+  # The process may have put its result just before exiting.
+  try:
+    return result_queue.get(timeout=1.0)
+  except queue.Empty:
+    raise RuntimeError('Inference process exited with code %s without a '
+                       'result.' % process.exitcode)
+
+
+def main(unused_argv):
+  modes = ['whole', 'chunked'] if FLAGS.mode == 'both' else [FLAGS.mode]
+  print('Running %.1f minutes of audio with the %s config.' %
+        (FLAGS.minutes, FLAGS.config))
+
+  context = multiprocessing.get_context('spawn')
+  results = {}
+  for mode in modes:
+    result_queue = context.Queue()
+    process = context.Process(
+        target=_run_inference,
+        args=(FLAGS.config, mode, FLAGS.minutes, FLAGS.chunk_length_secs,
+              FLAGS.chunk_margin_secs, FLAGS.batch_size, FLAGS.seed,
+              result_queue))
+    process.start()
+    try:
+      results[mode] = _get_result(result_queue, process)
+    except RuntimeError as e:
+      raise RuntimeError('%s inference failed.' % mode) from e
+    process.join()
+    if process.exitcode:
+      raise RuntimeError('%s inference failed.' % mode)
+
+  print('%-8s %10s %16s' % ('mode', 'seconds', 'peak memory MB'))
+  for mode in modes:
+    result = results[mode]
+    print('%-8s %10.2f %16.0f' % (
+        mode, result['seconds'],
+        result['peak_rss_mb'] - result['baseline_rss_mb']))
+
+  if len(modes) == 2:
+    # The recurrent layers see less context in chunked mode, so the outputs
+    # are close but not identical.
+    for key in ['frame_probs', 'onset_probs']:
+      whole = results['whole'][key]
+      chunked = results['chunked'][key]
+      print('%s: mean abs difference %.5f, thresholded frames differ %.5f%%' % (
+          key, np.mean(np.abs(whole - chunked)),
+          100 * np.mean((whole > 0.5) != (chunked > 0.5))))
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -567,7 +567,8 @@ def read_examples(examples, is_training, shuffle_examples,
 
   Args:
     examples: A string path to a TFRecord file of examples, a python list of
-      serialized examples, or a Tensor placeholder for serialized examples.
+      serialized examples, a Tensor placeholder for serialized examples, or a
+      tf.data.Dataset of serialized examples.
     is_training: Whether this is a training run.
     shuffle_examples: Whether examples should be shuffled.
     skip_n_initial_records: Skip this many records at first.
@@ -602,6 +603,8 @@ def read_examples(examples, is_training, shuffle_examples,
               tf.data.TFRecordDataset, sloppy=True, cycle_length=8))
     else:
       input_dataset = tf.data.TFRecordDataset(filenames)
+  elif isinstance(examples, tf.data.Dataset):
+    input_dataset = examples
   else:
     input_dataset = tf.data.Dataset.from_tensor_slices(examples)
 
@@ -708,12 +711,14 @@ def provide_batch(examples,
                   params,
                   is_training,
                   shuffle_examples,
-                  skip_n_initial_records):
+                  skip_n_initial_records,
+                  num_parallel_calls=None):
   """Returns batches of tensors read from TFRecord files.
 
   Args:
     examples: A string path to a TFRecord file of examples, a python list of
-      serialized examples, or a Tensor placeholder for serialized examples.
+      serialized examples, a Tensor placeholder for serialized examples, or a
+      tf.data.Dataset of serialized examples.
     preprocess_examples: Whether to preprocess examples. If False, assume they
       have already been preprocessed.
     params: HParams object specifying hyperparameters. Called 'params' here
@@ -721,6 +726,9 @@ def provide_batch(examples,
     is_training: Whether this is a training run.
     shuffle_examples: Whether examples should be shuffled.
     skip_n_initial_records: Skip this many records at first.
+    num_parallel_calls: The number of examples to preprocess in parallel, e.g.
+      tf.data.experimental.AUTOTUNE. By default, examples are preprocessed
+      sequentially.
 
   Returns:
     Batched tensors in a TranscriptionData NamedTuple.
@@ -735,7 +743,8 @@ def provide_batch(examples,
         preprocess_example, hparams=hparams, is_training=is_training)
   else:
     input_map_fn = parse_preprocessed_example
-  input_tensors = input_dataset.map(input_map_fn)
+  input_tensors = input_dataset.map(
+      input_map_fn, num_parallel_calls=num_parallel_calls)
 
   model_input = input_tensors.map(
       functools.partial(
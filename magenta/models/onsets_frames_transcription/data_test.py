@@ -246,6 +246,21 @@ class DataTest(tf.test.TestCase):
         expected_inputs,
         feed_dict=feed_dict)
 
+  def _ValidateProvideBatchDataset(self,
+                                   truncated_length,
+                                   batch_size,
+                                   lengths,
+                                   expected_num_inputs):
+    examples, expected_inputs = self._CreateExamplesAndExpectedInputs(
+        truncated_length, lengths, expected_num_inputs)
+
+    self._ValidateProvideBatch(
+        tf.data.Dataset.from_tensor_slices(
+            [e.SerializeToString() for e in examples]),
+        truncated_length,
+        batch_size,
+        expected_inputs)
+
   def _ValidateProvideBatchBoth(self,
                                 truncated_length,
                                 batch_size,
@@ -266,6 +281,11 @@ class DataTest(tf.test.TestCase):
         batch_size=batch_size,
         lengths=lengths,
         expected_num_inputs=expected_num_inputs)
+    self._ValidateProvideBatchDataset(
+        truncated_length=truncated_length,
+        batch_size=batch_size,
+        lengths=lengths,
+        expected_num_inputs=expected_num_inputs)
 
   def testProvideBatchFullSeqs(self):
     self._ValidateProvideBatchBoth(
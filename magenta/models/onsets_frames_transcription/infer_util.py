@@ -24,6 +24,12 @@ from magenta.models.onsets_frames_transcription import data
 from note_seq import sequences_lib
 import numpy as np
 
+# A window of frames transcribed as one chunk. Only the frames in
+# [keep_start, keep_end) are kept when stitching chunks together; the rest are
+# context shared with the neighbouring chunks.
+ChunkWindow = collections.namedtuple(
+    'ChunkWindow', ('start', 'end', 'keep_start', 'keep_end'))
+
 
 def probs_to_pianoroll_viterbi(frame_probs, onset_probs, alpha=0.5):
   """Viterbi decoding of frame & onset probabilities to pianoroll.
@@ -41,43 +47,115 @@ def probs_to_pianoroll_viterbi(frame_probs, onset_probs, alpha=0.5):
     A numpy array (num-frames-by-num-pitches) representing the boolean-valued
     pianoroll.
   """
-  n, d = onset_probs.shape
+  return probs_to_pianoroll_viterbi_batch(
+      [frame_probs], [onset_probs], alpha=alpha)[0]
+
+
+def probs_to_pianoroll_viterbi_batch(frame_probs_list, onset_probs_list,
+                                     alpha=0.5):
+  """Viterbi decoding of frame & onset probabilities for multiple files.
+
+  Each pitch of each file is an independent two-state (off/on) chain, so all
+  files are decoded together by concatenating their pitches. The recurrence
+  over frames writes into preallocated buffers and does not allocate per
+  frame. Results are identical to decoding each file separately.
+
+  Args:
+    frame_probs_list: A list of numpy arrays (num-frames-by-num-pitches) of
+      frame probabilities. The number of frames may differ between files.
+    onset_probs_list: A list of numpy arrays (num-frames-by-num-pitches) of
+      onset probabilities, the same shapes as `frame_probs_list`.
+    alpha: Relative weight of onset and frame loss, a float between 0 and 1.
+      With alpha = 0, onset probabilities will be ignored. With alpha = 1, frame
+      probabilities will be ignored.
+
+  Returns:
+    A list of numpy arrays (num-frames-by-num-pitches) representing the
+    boolean-valued pianoroll of each file.
+  """
+  lengths = [probs.shape[0] for probs in onset_probs_list]
+  widths = [probs.shape[1] for probs in onset_probs_list]
+  n = max(lengths)
 
-  loss_matrix = np.zeros([n, d, 2], dtype=float)
-  path_matrix = np.zeros([n, d, 2], dtype=bool)
+  # Pad shorter files with arbitrary (finite) probabilities. The recurrence
+  # only looks backwards, so padding never affects a file's own frames.
+  def pad_and_concatenate(probs_list):
+    return np.concatenate([
+        np.pad(probs, [(0, n - probs.shape[0]), (0, 0)], constant_values=0.5)
+        for probs in probs_list], axis=1)
+  frame_probs = pad_and_concatenate(frame_probs_list)
+  onset_probs = pad_and_concatenate(onset_probs_list)
+  d = frame_probs.shape[1]
 
-  frame_losses = (1 - alpha) * -np.log(np.stack([1 - frame_probs,
-                                                 frame_probs], axis=-1))
-  onset_losses = alpha * -np.log(np.stack([1 - onset_probs,
-                                           onset_probs], axis=-1))
+  frame_losses_off = (1 - alpha) * -np.log(1 - frame_probs)
+  frame_losses_on = (1 - alpha) * -np.log(frame_probs)
+  onset_losses_off = alpha * -np.log(1 - onset_probs)
+  onset_losses_on = alpha * -np.log(onset_probs)
 
-  loss_matrix[0, :, :] = frame_losses[0, :, :] + onset_losses[0, :, :]
+  # Columns of the files that end at each frame.
+  ends = collections.defaultdict(lambda: np.zeros(d, dtype=bool))
+  offset = 0
+  for length, width in zip(lengths, widths):
+    ends[length - 1][offset:offset + width] = True
+    offset += width
+
+  # For each frame, whether the best path to the off and on states comes from
+  # the on state at the previous frame.
+  path_off = np.zeros([n, d], dtype=bool)
+  path_on = np.zeros([n, d], dtype=bool)
+  final_states = np.zeros(d, dtype=bool)
+
+  loss_off = np.empty(d, dtype=float)
+  loss_on = np.empty(d, dtype=float)
+  off_to_off = np.empty(d, dtype=float)
+  off_to_on = np.empty(d, dtype=float)
+  from_on = np.empty(d, dtype=float)
+
+  loss_off[:] = frame_losses_off[0] + onset_losses_off[0]
+  loss_on[:] = frame_losses_on[0] + onset_losses_on[0]
 
   for i in range(1, n):
-    transition_loss = np.tile(loss_matrix[i - 1, :, :][:, :, np.newaxis],
-                              [1, 1, 2])
+    if i - 1 in ends:
+      np.less(loss_on, loss_off, out=final_states, where=ends[i - 1])
+
+    # Only a transition from off to on incurs the onset loss; all other
+    # transitions incur the loss of there being no onset.
+    np.add(loss_off, onset_losses_off[i], out=off_to_off)
+    np.add(loss_off, onset_losses_on[i], out=off_to_on)
+    np.add(loss_on, onset_losses_off[i], out=from_on)
 
-    transition_loss[:, 0, 0] += onset_losses[i, :, 0]
-    transition_loss[:, 0, 1] += onset_losses[i, :, 1]
-    transition_loss[:, 1, 0] += onset_losses[i, :, 0]
-    transition_loss[:, 1, 1] += onset_losses[i, :, 0]
+    # Ties prefer the off state, as with np.argmin.
+    np.less(from_on, off_to_off, out=path_off[i])
+    np.less(from_on, off_to_on, out=path_on[i])
 
-    path_matrix[i, :, :] = np.argmin(transition_loss, axis=1)
+    np.copyto(loss_off, off_to_off)
+    np.copyto(loss_off, from_on, where=path_off[i])
+    np.copyto(loss_on, off_to_on)
+    np.copyto(loss_on, from_on, where=path_on[i])
 
-    loss_matrix[i, :, 0] = transition_loss[
-        np.arange(d), path_matrix[i, :, 0].astype(int), 0]
-    loss_matrix[i, :, 1] = transition_loss[
-        np.arange(d), path_matrix[i, :, 1].astype(int), 1]
+    loss_off += frame_losses_off[i]
+    loss_on += frame_losses_on[i]
 
-    loss_matrix[i, :, :] += frame_losses[i, :, :]
+  np.less(loss_on, loss_off, out=final_states, where=ends[n - 1])
 
   pianoroll = np.zeros([n, d], dtype=bool)
-  pianoroll[n - 1, :] = np.argmin(loss_matrix[n - 1, :, :], axis=-1)
-  for i in range(n - 2, -1, -1):
-    pianoroll[i, :] = path_matrix[
-        i + 1, np.arange(d), pianoroll[i + 1, :].astype(int)]
+  state = np.zeros(d, dtype=bool)
+  prev_state = np.empty(d, dtype=bool)
+  for i in range(n - 1, -1, -1):
+    if i in ends:
+      np.copyto(state, final_states, where=ends[i])
+    pianoroll[i] = state
+    if i > 0:
+      np.copyto(prev_state, path_off[i])
+      np.copyto(prev_state, path_on[i], where=state)
+      state, prev_state = prev_state, state
 
-  return pianoroll
+  pianorolls = []
+  offset = 0
+  for length, width in zip(lengths, widths):
+    pianorolls.append(pianoroll[:length, offset:offset + width])
+    offset += width
+  return pianorolls
 
 
 def predict_sequence(frame_probs,
@@ -138,6 +216,61 @@ def predict_sequence(frame_probs,
   return sequence_prediction
 
 
+def chunk_windows(num_frames, chunk_frames, margin_frames):
+  """Splits a recording into overlapping windows of a fixed length.
+
+  Consecutive windows overlap by `2 * margin_frames`, and the margins are
+  dropped when stitching, so every kept frame has at least `margin_frames` of
+  context on both sides, except at the ends of the recording. The last window
+  is moved back so that all windows have the full length if possible.
+
+  Args:
+    num_frames: The number of frames in the recording.
+    chunk_frames: The number of frames in a window.
+    margin_frames: The number of frames to drop from each side of a window.
+
+  Returns:
+    A list of ChunkWindows, whose kept frames cover [0, num_frames) in order.
+
+  Raises:
+    ValueError: If the margins leave no frames to keep.
+  """
+  if chunk_frames <= 2 * margin_frames:
+    raise ValueError(
+        'chunk_frames must be greater than twice margin_frames, got %d and %d'
+        % (chunk_frames, margin_frames))
+  windows = []
+  keep_start = 0
+  while True:
+    start = max(keep_start - margin_frames, 0)
+    if start + chunk_frames >= num_frames:
+      windows.append(ChunkWindow(
+          start=max(num_frames - chunk_frames, 0), end=num_frames,
+          keep_start=keep_start, keep_end=num_frames))
+      return windows
+    keep_end = start + chunk_frames - margin_frames
+    windows.append(ChunkWindow(
+        start=start, end=start + chunk_frames,
+        keep_start=keep_start, keep_end=keep_end))
+    keep_start = keep_end
+
+
+def stitch_chunks(chunks, windows):
+  """Concatenates the kept frames of per-chunk model outputs.
+
+  Args:
+    chunks: Model outputs for each window, with frames along the first axis.
+    windows: The ChunkWindows of the outputs, as returned by `chunk_windows`.
+
+  Returns:
+    The outputs for the whole recording.
+  """
+  return np.concatenate([
+      chunk[window.keep_start - window.start:window.keep_end - window.start]
+      for chunk, window in zip(chunks, windows)
+  ], axis=0)
+
+
 def labels_to_features_wrapper(data_fn):
   """Add wrapper to data_fn that add labels to features."""
   def wrapper(params, *args, **kwargs):
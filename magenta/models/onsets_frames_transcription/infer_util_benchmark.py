@@ -0,0 +1,136 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Benchmarks Viterbi decoding of frame and onset probabilities.
+
+Compares the original per-frame implementation of
+`infer_util.probs_to_pianoroll_viterbi` with the current one, decoding files
+one at a time and as a batch, on random probabilities shaped like long-form
+MAESTRO pieces. Also checks that all outputs are identical.
+
+Example usage:
+  $ python magenta/models/onsets_frames_transcription/infer_util_benchmark.py \
+    --num_files=4 --minutes=10
+"""
+
+import time
+
+from absl import app
+from absl import flags
+from magenta.models.onsets_frames_transcription import constants
+from magenta.models.onsets_frames_transcription import infer_util
+import numpy as np
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('num_files', 4, 'Number of files to decode.')
+flags.DEFINE_float('minutes', 10.0, 'Length of each file in minutes.')
+flags.DEFINE_float('frames_per_second', 31.25, 'Model frame rate.')
+flags.DEFINE_float('alpha', 0.5, 'Relative weight of onset and frame loss.')
+flags.DEFINE_integer('seed', 0, 'Random seed.')
+
+
+def _probs_to_pianoroll_viterbi_reference(frame_probs, onset_probs, alpha):
+  """The original implementation, which allocates temporaries per frame."""
+  n, d = onset_probs.shape
+
+  loss_matrix = np.zeros([n, d, 2], dtype=float)
+  path_matrix = np.zeros([n, d, 2], dtype=bool)
+
+  frame_losses = (1 - alpha) * -np.log(np.stack([1 - frame_probs,
+                                                 frame_probs], axis=-1))
+  onset_losses = alpha * -np.log(np.stack([1 - onset_probs,
+                                           onset_probs], axis=-1))
+
+  loss_matrix[0, :, :] = frame_losses[0, :, :] + onset_losses[0, :, :]
+
+  for i in range(1, n):
+    transition_loss = np.tile(loss_matrix[i - 1, :, :][:, :, np.newaxis],
+                              [1, 1, 2])
+
+    transition_loss[:, 0, 0] += onset_losses[i, :, 0]
+    transition_loss[:, 0, 1] += onset_losses[i, :, 1]
+    transition_loss[:, 1, 0] += onset_losses[i, :, 0]
+    transition_loss[:, 1, 1] += onset_losses[i, :, 0]
+
+    path_matrix[i, :, :] = np.argmin(transition_loss, axis=1)
+
+    loss_matrix[i, :, 0] = transition_loss[
+        np.arange(d), path_matrix[i, :, 0].astype(int), 0]
+    loss_matrix[i, :, 1] = transition_loss[
+        np.arange(d), path_matrix[i, :, 1].astype(int), 1]
+
+    loss_matrix[i, :, :] += frame_losses[i, :, :]
+
+  pianoroll = np.zeros([n, d], dtype=bool)
+  pianoroll[n - 1, :] = np.argmin(loss_matrix[n - 1, :, :], axis=-1)
+  for i in range(n - 2, -1, -1):
+    pianoroll[i, :] = path_matrix[
+        i + 1, np.arange(d), pianoroll[i + 1, :].astype(int)]
+
+  return pianoroll
+
+
+def _random_probs(rng, num_frames):
+  """Returns sparse, temporally smooth frame and onset probabilities."""
+  num_pitches = constants.MIDI_PITCHES
+  active = rng.rand(num_frames // 8 + 1, num_pitches) < 0.05
+  frame_probs = np.repeat(active, 8, axis=0)[:num_frames] * 0.9
+  frame_probs += rng.rand(num_frames, num_pitches) * 0.1
+  onset_probs = rng.rand(num_frames, num_pitches) ** 8
+  return frame_probs.astype(np.float32), onset_probs.astype(np.float32)
+
+
+def main(unused_argv):
+  rng = np.random.RandomState(FLAGS.seed)
+  num_frames = int(FLAGS.minutes * 60 * FLAGS.frames_per_second)
+  # Vary the lengths a little so batched files end at different frames.
+  files = [_random_probs(rng, num_frames - i * 100)
+           for i in range(FLAGS.num_files)]
+  print('Decoding %d files of ~%d frames.' % (FLAGS.num_files, num_frames))
+
+  results = {}
+
+  start = time.time()
+  results['reference'] = [
+      _probs_to_pianoroll_viterbi_reference(frame_probs, onset_probs,
+                                            FLAGS.alpha)
+      for frame_probs, onset_probs in files]
+  timings = {'reference': time.time() - start}
+
+  start = time.time()
+  results['single'] = [
+      infer_util.probs_to_pianoroll_viterbi(frame_probs, onset_probs,
+                                            FLAGS.alpha)
+      for frame_probs, onset_probs in files]
+  timings['single'] = time.time() - start
+
+  start = time.time()
+  results['batch'] = infer_util.probs_to_pianoroll_viterbi_batch(
+      [frame_probs for frame_probs, _ in files],
+      [onset_probs for _, onset_probs in files], FLAGS.alpha)
+  timings['batch'] = time.time() - start
+
+  for name in ['reference', 'single', 'batch']:
+    print('%-10s %8.3f s  %6.1fx' % (
+        name, timings[name], timings['reference'] / timings[name]))
+
+  for name in ['single', 'batch']:
+    for expected, actual in zip(results['reference'], results[name]):
+      if not np.array_equal(expected, actual):
+        raise ValueError('%s decoding differs from the reference.' % name)
+
+
+if __name__ == '__main__':
+  app.run(main)
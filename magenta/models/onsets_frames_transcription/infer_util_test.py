@@ -36,6 +36,56 @@ class InferUtilTest(tf.test.TestCase):
         [[False, False], [False, False], [True, False], [True, False]],
         pianoroll)
 
+  def testProbsToPianorollViterbiBatch(self):
+    rng = np.random.RandomState(0)
+    frame_probs_list = [rng.rand(length, 3) for length in [20, 7, 13]]
+    onset_probs_list = [rng.rand(length, 3) ** 4 for length in [20, 7, 13]]
+    pianorolls = infer_util.probs_to_pianoroll_viterbi_batch(
+        frame_probs_list, onset_probs_list, alpha=0.3)
+    self.assertLen(pianorolls, 3)
+    for frame_probs, onset_probs, pianoroll in zip(
+        frame_probs_list, onset_probs_list, pianorolls):
+      np.testing.assert_array_equal(
+          infer_util.probs_to_pianoroll_viterbi(
+              frame_probs, onset_probs, alpha=0.3),
+          pianoroll)
+
+  def testChunkWindows(self):
+    windows = infer_util.chunk_windows(
+        num_frames=100, chunk_frames=30, margin_frames=5)
+    self.assertEqual(
+        infer_util.ChunkWindow(start=0, end=30, keep_start=0, keep_end=25),
+        windows[0])
+    self.assertEqual(
+        infer_util.ChunkWindow(start=70, end=100, keep_start=85, keep_end=100),
+        windows[-1])
+    for window in windows:
+      self.assertEqual(30, window.end - window.start)
+      self.assertLessEqual(window.start, window.keep_start)
+      self.assertLessEqual(window.keep_end, window.end)
+    for previous, window in zip(windows[:-1], windows[1:]):
+      self.assertEqual(previous.keep_end, window.keep_start)
+      self.assertGreaterEqual(window.keep_start - window.start, 5)
+      self.assertGreaterEqual(previous.end - previous.keep_end, 5)
+
+  def testChunkWindowsShortRecording(self):
+    self.assertEqual(
+        [infer_util.ChunkWindow(start=0, end=10, keep_start=0, keep_end=10)],
+        infer_util.chunk_windows(num_frames=10, chunk_frames=30,
+                                 margin_frames=5))
+    with self.assertRaises(ValueError):
+      infer_util.chunk_windows(num_frames=10, chunk_frames=10, margin_frames=5)
+
+  def testStitchChunks(self):
+    outputs = np.random.RandomState(0).rand(137, 88)
+    for chunk_frames, margin_frames in [(20, 0), (30, 7), (137, 10), (200, 3)]:
+      windows = infer_util.chunk_windows(
+          num_frames=len(outputs), chunk_frames=chunk_frames,
+          margin_frames=margin_frames)
+      chunks = [outputs[window.start:window.end] for window in windows]
+      np.testing.assert_array_equal(
+          outputs, infer_util.stitch_chunks(chunks, windows))
+
 
 if __name__ == '__main__':
   tf.test.main()
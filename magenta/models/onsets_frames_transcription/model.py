@@ -321,7 +321,7 @@ def model_fn(features, labels, mode, params, config):
     metrics_values[loss_label] = loss_collection
 
   def predict_sequence():
-    """Convert frame predictions into a sequence (TF)."""
+    """Convert frame predictions into a sequence per example (TF)."""
 
     def _predict(frame_probs, onset_probs, frame_predictions, onset_predictions,
                  offset_predictions, velocity_values):
@@ -337,20 +337,29 @@ def model_fn(features, labels, mode, params, config):
           min_pitch=constants.MIN_MIDI_PITCH)
       return sequence.SerializeToString()
 
-    sequence = tf.py_func(
-        _predict,
-        inp=[
-            frame_probs[0],
-            onset_probs[0],
-            frame_predictions[0],
-            onset_predictions[0],
-            offset_predictions[0],
-            velocity_values[0],
-        ],
-        Tout=tf.string,
-        stateful=False)
-    sequence.set_shape([])
-    return tf.expand_dims(sequence, axis=0)
+    # The frame predictions are flattened across the batch, so each example is
+    # sliced out of them using the lengths of the examples before it.
+    num_examples = tf.dimension_value(length.shape[0]) or 1
+    starts = tf.cumsum(length, exclusive=True)
+    sequences = []
+    for i in range(num_examples):
+      start = starts[i]
+      end = starts[i] + length[i]
+      sequence = tf.py_func(
+          _predict,
+          inp=[
+              frame_probs[i, :length[i]],
+              onset_probs[i, :length[i]],
+              frame_predictions[0, start:end],
+              onset_predictions[0, start:end],
+              offset_predictions[0, start:end],
+              velocity_values[0, start:end],
+          ],
+          Tout=tf.string,
+          stateful=False)
+      sequence.set_shape([])
+      sequences.append(sequence)
+    return tf.stack(sequences)
 
   predictions = {
       'frame_probs': frame_probs,
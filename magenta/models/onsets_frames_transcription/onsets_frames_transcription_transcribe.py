@@ -18,15 +18,23 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+from concurrent import futures
+import functools
 import os
+import time
 
 from magenta.models.onsets_frames_transcription import audio_label_data_utils
 from magenta.models.onsets_frames_transcription import configs
+from magenta.models.onsets_frames_transcription import constants
 from magenta.models.onsets_frames_transcription import data
 from magenta.models.onsets_frames_transcription import infer_util
 from magenta.models.onsets_frames_transcription import train_util
+from note_seq import audio_io
 from note_seq import midi_io
 from note_seq.protobuf import music_pb2
+import librosa
+import numpy as np
 import six
 import tensorflow.compat.v1 as tf
 
@@ -50,6 +58,31 @@ tf.app.flags.DEFINE_boolean(
 tf.app.flags.DEFINE_string(
     'transcribed_file_suffix', '',
     'Optional suffix to add to transcribed files.')
+tf.app.flags.DEFINE_boolean(
+    'batch_mode', False,
+    'Whether to restore the model once and stream all files through a single '
+    'prediction pipeline, rather than restoring it for every file. Arguments '
+    'may also be glob patterns.')
+tf.app.flags.DEFINE_integer(
+    'batch_size', 1,
+    'In batch mode, the number of files to transcribe together. Files are '
+    'grouped by size, and shorter files in a batch are padded to the longest '
+    'one. Unless the config uses sequence lengths, the padding may slightly '
+    'change the transcriptions.')
+tf.app.flags.DEFINE_integer(
+    'num_workers', 4,
+    'In batch mode, the number of threads used to decode audio files and to '
+    'write MIDI files.')
+tf.app.flags.DEFINE_float(
+    'chunk_length_secs', 0,
+    'If positive, split recordings into overlapping chunks of this length, '
+    'which are transcribed as batches of --batch_size and stitched back '
+    'together. This bounds the memory used for long recordings. Implies '
+    '--batch_mode.')
+tf.app.flags.DEFINE_float(
+    'chunk_margin_secs', 1.0,
+    'The context on each side of a chunk that is dropped when stitching, so '
+    'consecutive chunks overlap by twice this length.')
 tf.app.flags.DEFINE_string(
     'log', 'INFO',
     'The threshold for what messages will be logged: '
@@ -74,6 +107,321 @@ def create_example(filename, sample_rate, load_audio_with_librosa):
   return example_list[0].SerializeToString()
 
 
+def create_chunk_examples(filename, hparams, chunk_frames, margin_frames,
+                          load_audio_with_librosa):
+  """Splits an audio file into Example protos of overlapping chunks.
+
+  The audio is normalized as a whole, like in `create_example`, so that every
+  chunk sees the same levels as whole-file transcription would.
+
+  Args:
+    filename: The audio file.
+    hparams: The hparams of the model.
+    chunk_frames: The number of frames in a chunk.
+    margin_frames: The number of frames of context on each side of a chunk.
+    load_audio_with_librosa: Whether to use librosa for sampling audio.
+
+  Returns:
+    A list of serialized Example protos, and the list of
+    `infer_util.ChunkWindow`s they cover.
+  """
+  wav_data = tf.gfile.Open(filename, 'rb').read()
+  if load_audio_with_librosa:
+    samples = audio_io.wav_data_to_samples_librosa(
+        wav_data, hparams.sample_rate)
+  else:
+    samples = audio_io.wav_data_to_samples(wav_data, hparams.sample_rate)
+  samples = librosa.util.normalize(samples, norm=np.inf)
+
+  num_frames = int(len(samples) / hparams.sample_rate *
+                   data.hparams_frames_per_second(hparams))
+  windows = infer_util.chunk_windows(num_frames, chunk_frames, margin_frames)
+  hop_length = hparams.spec_hop_length
+  examples = []
+  for window in windows:
+    # Half a frame of extra audio keeps the number of frames computed from the
+    # chunk's duration from being rounded down.
+    chunk_samples = samples[window.start * hop_length:
+                            window.end * hop_length + hop_length // 2]
+    example = audio_label_data_utils.create_example(
+        six.ensure_text(filename, 'utf-8'), music_pb2.NoteSequence(),
+        audio_io.samples_to_wav_data(chunk_samples, hparams.sample_rate))
+    examples.append(example.SerializeToString())
+  return examples, windows
+
+
+# An example fed to the model: the index of its file (None for padding), the
+# windows of all chunks of the file (None if it is not chunked), and its
+# number of frames.
+_ExampleInfo = collections.namedtuple(
+    '_ExampleInfo', ('file_index', 'windows', 'num_frames'))
+
+
+def _create_padding_example(hparams):
+  """Creates a short silent Example proto to fill the last batch with."""
+  wav_data = audio_io.samples_to_wav_data(
+      np.zeros(hparams.sample_rate // 10, np.float32), hparams.sample_rate)
+  example_list = list(
+      audio_label_data_utils.process_record(
+          wav_data=wav_data,
+          sample_rate=hparams.sample_rate,
+          ns=music_pb2.NoteSequence(),
+          example_id='',
+          min_length=0,
+          max_length=-1,
+          allow_empty_notesequence=True))
+  num_frames = data.wav_to_num_frames(
+      wav_data, data.hparams_frames_per_second(hparams))
+  return example_list[0].SerializeToString(), num_frames
+
+
+def _expand_filenames(patterns):
+  """Expands glob patterns, keeping plain filenames that match nothing."""
+  filenames = []
+  for pattern in patterns:
+    filenames.extend(tf.gfile.Glob(pattern) or [pattern])
+  return filenames
+
+
+def _file_length_key(filename):
+  """Sort key ordering files by length, with unreadable files last."""
+  try:
+    return (False, tf.gfile.Stat(filename).length)
+  except tf.errors.OpError:
+    # Leave the error to be logged when the file fails to load.
+    return (True, 0)
+
+
+def _generate_examples(filenames, create_examples_fn, hparams, batch_size,
+                       num_workers, example_infos):
+  """Yields serialized examples, decoding audio files in a thread pool.
+
+  Files that fail to load are logged and skipped. Padding examples are
+  appended so that the last batch is full.
+
+  Args:
+    filenames: The audio files to transcribe.
+    create_examples_fn: Returns the serialized examples of a file, and their
+      `infer_util.ChunkWindow`s or None if the file is not chunked.
+    hparams: The hparams of the model.
+    batch_size: The batch size of the prediction pipeline.
+    num_workers: The number of files to decode in parallel.
+    example_infos: A deque that an `_ExampleInfo` is appended to for every
+      example, before it is yielded.
+
+  Yields:
+    Serialized Example protos.
+  """
+  def _create_examples(filename):
+    try:
+      return create_examples_fn(filename)
+    except Exception as e:  # pylint: disable=broad-except
+      tf.logging.error('Failed to load %s: %s', filename, e)
+      return None
+
+  num_examples = 0
+  with futures.ThreadPoolExecutor(num_workers) as pool:
+    # Keep a bounded number of files decoded ahead of the model.
+    pending = collections.deque()
+    indexed_filenames = enumerate(filenames)
+    while True:
+      while len(pending) < 2 * num_workers:
+        file_index, filename = next(indexed_filenames, (None, None))
+        if filename is None:
+          break
+        pending.append(
+            (file_index, pool.submit(_create_examples, filename)))
+      if not pending:
+        break
+      file_index, result = pending.popleft()
+      if result is None:
+        continue
+      examples, windows = result
+      for example, window in zip(examples, windows or [None]):
+        num_frames = window.end - window.start if window else None
+        example_infos.append(_ExampleInfo(file_index, windows, num_frames))
+        num_examples += 1
+        yield example
+
+  if num_examples % batch_size:
+    padding_example, num_frames = _create_padding_example(hparams)
+    for _ in range(batch_size - num_examples % batch_size):
+      example_infos.append(_ExampleInfo(None, None, num_frames))
+      yield padding_example
+
+
+def _split_batch(values, lengths):
+  """Splits a batch of model outputs into the outputs of each example.
+
+  Outputs of some models are flattened across the batch, while others are
+  padded to the longest example.
+
+  Args:
+    values: The outputs for a batch.
+    lengths: The number of frames of each example.
+
+  Returns:
+    A list of the outputs of each example.
+  """
+  if len(values) == len(lengths):
+    return [value[:length] for value, length in zip(values, lengths)]
+  return np.split(values[0], np.cumsum(lengths)[:-1])
+
+
+# The model outputs that are stitched together for chunked transcription.
+_CHUNK_PREDICTION_KEYS = (
+    'frame_probs', 'onset_probs', 'frame_predictions', 'onset_predictions',
+    'offset_predictions', 'velocity_values')
+
+
+def _predict_stitched_sequence(chunks, windows, hparams):
+  """Predicts a NoteSequence from the stitched model outputs of all chunks."""
+  outputs = {
+      key: infer_util.stitch_chunks([chunk[key] for chunk in chunks], windows)
+      for key in _CHUNK_PREDICTION_KEYS
+  }
+  drums_only = hparams.get('drums_only', False)
+  if drums_only:
+    outputs['frame_predictions'] = outputs['onset_predictions']
+    outputs['offset_predictions'] = outputs['onset_predictions']
+  sequence_prediction = infer_util.predict_sequence(
+      min_pitch=constants.MIN_MIDI_PITCH,
+      hparams=hparams,
+      onsets_only=drums_only,
+      **outputs)
+  if drums_only:
+    for note in sequence_prediction.notes:
+      note.is_drum = True
+  return sequence_prediction
+
+
+def _write_transcription(sequence_prediction, filename):
+  """Writes a NoteSequence to a MIDI file next to `filename`."""
+  midi_filename = filename + FLAGS.transcribed_file_suffix + '.midi'
+  midi_io.sequence_proto_to_midi_file(sequence_prediction, midi_filename)
+  tf.logging.info('Transcription written to %s.', midi_filename)
+
+
+def _write_chunked_transcription(chunks, windows, hparams, filename):
+  _write_transcription(
+      _predict_stitched_sequence(chunks, windows, hparams), filename)
+
+
+def run_batch(filenames, config, hparams, data_fn):
+  """Transcribes all files with a single restore of the model.
+
+  Audio files are decoded in a thread pool and fed to one prediction pipeline,
+  which computes spectrograms in parallel. MIDI files are written in a second
+  thread pool while the model runs on the next batch.
+
+  If --chunk_length_secs is set, every file is split into overlapping chunks
+  that are batched like separate files. Once all chunks of a file have been
+  run, their outputs are stitched together and decoded into a NoteSequence.
+
+  Args:
+    filenames: The audio files to transcribe.
+    config: The config of the model.
+    hparams: The hparams of the model.
+    data_fn: The function that provides batches of examples.
+  """
+  hparams.batch_size = FLAGS.batch_size
+  hparams.predict_batch_size = FLAGS.batch_size
+  if FLAGS.chunk_length_secs:
+    frames_per_second = data.hparams_frames_per_second(hparams)
+    create_examples_fn = functools.partial(
+        create_chunk_examples,
+        hparams=hparams,
+        chunk_frames=int(FLAGS.chunk_length_secs * frames_per_second),
+        margin_frames=int(FLAGS.chunk_margin_secs * frames_per_second),
+        load_audio_with_librosa=FLAGS.load_audio_with_librosa)
+    predict_keys = list(_CHUNK_PREDICTION_KEYS)
+  else:
+    def create_examples_fn(filename):
+      return [create_example(filename, hparams.sample_rate,
+                             FLAGS.load_audio_with_librosa)], None
+    predict_keys = ['sequence_predictions']
+    if FLAGS.batch_size > 1:
+      # Batch files of similar lengths together to limit padding.
+      filenames = sorted(filenames, key=_file_length_key)
+
+  example_infos = collections.deque()
+
+  def transcription_data(params):
+    examples = tf.data.Dataset.from_generator(
+        functools.partial(
+            _generate_examples,
+            filenames=filenames,
+            create_examples_fn=create_examples_fn,
+            hparams=hparams,
+            batch_size=FLAGS.batch_size,
+            num_workers=FLAGS.num_workers,
+            example_infos=example_infos),
+        output_types=tf.string,
+        output_shapes=tf.TensorShape([]))
+    return data_fn(
+        examples=examples,
+        preprocess_examples=True,
+        params=params,
+        is_training=False,
+        shuffle_examples=False,
+        skip_n_initial_records=0,
+        num_parallel_calls=tf.data.experimental.AUTOTUNE)
+  input_fn = infer_util.labels_to_features_wrapper(transcription_data)
+
+  estimator = train_util.create_estimator(config.model_fn,
+                                          os.path.expanduser(FLAGS.model_dir),
+                                          hparams)
+  checkpoint_path = None
+  if FLAGS.checkpoint_path:
+    checkpoint_path = os.path.expanduser(FLAGS.checkpoint_path)
+
+  start_time = time.time()
+  num_transcribed = 0
+  # The outputs of the chunks run so far, by file index.
+  file_chunks = collections.defaultdict(list)
+  with futures.ThreadPoolExecutor(FLAGS.num_workers) as pool:
+    writes = []
+    for prediction in estimator.predict(
+        input_fn,
+        predict_keys=predict_keys,
+        checkpoint_path=checkpoint_path,
+        yield_single_examples=False):
+      # Examples are predicted in the order they were generated.
+      infos = [example_infos.popleft() for _ in range(FLAGS.batch_size)]
+      if FLAGS.chunk_length_secs:
+        outputs = {
+            key: _split_batch(prediction[key],
+                              [info.num_frames for info in infos])
+            for key in predict_keys
+        }
+      for i, info in enumerate(infos):
+        if info.file_index is None:
+          # A padding example.
+          continue
+        filename = filenames[info.file_index]
+        if info.windows is None:
+          writes.append(pool.submit(
+              _write_transcription,
+              music_pb2.NoteSequence.FromString(
+                  prediction['sequence_predictions'][i]),
+              filename))
+          num_transcribed += 1
+          continue
+        chunks = file_chunks[info.file_index]
+        chunks.append({key: outputs[key][i] for key in predict_keys})
+        if len(chunks) == len(info.windows):
+          del file_chunks[info.file_index]
+          writes.append(pool.submit(
+              _write_chunked_transcription, chunks, info.windows, hparams,
+              filename))
+          num_transcribed += 1
+    for write in writes:
+      write.result()
+
+  tf.logging.info('Transcribed %d of %d files in %.1f seconds.',
+                  num_transcribed, len(filenames), time.time() - start_time)
+
+
 def run(argv, config_map, data_fn):
   """Create transcriptions."""
   tf.logging.set_verbosity(FLAGS.log)
@@ -84,6 +432,10 @@ def run(argv, config_map, data_fn):
   hparams.batch_size = 1
   hparams.truncated_length_secs = 0
 
+  if FLAGS.batch_mode or FLAGS.chunk_length_secs:
+    run_batch(_expand_filenames(argv[1:]), config, hparams, data_fn)
+    return
+
   with tf.Graph().as_default():
     examples = tf.placeholder(tf.string, [None])
 
@@ -0,0 +1,127 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Ring buffer of audio samples shared between processes."""
+
+import multiprocessing
+
+import numpy as np
+
+
+class ChunkOverwrittenError(Exception):  # pylint:disable=g-bad-exception-name
+  pass
+
+
+class AudioRingBuffer(object):
+  """Fixed-size ring buffer of float32 audio samples in shared memory.
+
+  One process appends samples with `write`; worker processes that were given
+  the buffer when they were started read chunks back by their absolute sample
+  index. Samples live in a `multiprocessing.RawArray`, so only indices need to
+  be sent between processes. Indices only grow, and sample `i` is stored at
+  position `i % capacity`.
+
+  There is no locking: a reader must only ask for samples that were written
+  before it was told about them (e.g. through a queue), and is responsible for
+  checking that the writer has not lapped them with `is_overwritten`. The
+  writer publishes the end of a write before copying its samples, so a write
+  that is still copying already counts as overwriting the samples it replaces.
+  """
+
+  def __init__(self, capacity):
+    self._capacity = capacity
+    self._samples = multiprocessing.RawArray('f', capacity)
+    self._num_written = multiprocessing.RawValue('q', 0)
+    # The end index of the write in progress, which is set before its samples
+    # are copied. It is equal to `_num_written` between writes.
+    self._num_reserved = multiprocessing.RawValue('q', 0)
+    self._array = None
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    # The numpy view is recreated in the worker, rather than pickled by value.
+    state['_array'] = None
+    return state
+
+  @property
+  def capacity(self):
+    return self._capacity
+
+  @property
+  def num_written(self):
+    """Total number of samples ever written, i.e. the next write index."""
+    return self._num_written.value
+
+  def _view(self):
+    if self._array is None:
+      self._array = np.frombuffer(self._samples, dtype=np.float32)
+    return self._array
+
+  def write(self, samples):
+    """Appends samples, overwriting the oldest ones.
+
+    Args:
+      samples: 1D array of samples, at most `capacity` long.
+
+    Returns:
+      The index of the first written sample.
+
+    Raises:
+      ValueError: If more samples than the capacity are written at once.
+    """
+    num_samples = len(samples)
+    if num_samples > self._capacity:
+      raise ValueError('Cannot write %d samples to a ring buffer of %d.' %
+                       (num_samples, self._capacity))
+    array = self._view()
+    start = self._num_written.value
+    self._num_reserved.value = start + num_samples
+    offset = start % self._capacity
+    head = min(num_samples, self._capacity - offset)
+    array[offset:offset + head] = samples[:head]
+    array[:num_samples - head] = samples[head:]
+    self._num_written.value = start + num_samples
+    return start
+
+  def is_overwritten(self, start):
+    """Whether the sample at `start` has been or is being overwritten."""
+    return self._num_reserved.value - start > self._capacity
+
+  def read(self, start, length):
+    """Returns `length` samples from index `start`.
+
+    The result is a view into shared memory, unless the chunk wraps around the
+    end of the buffer, in which case the two parts are copied together.
+
+    Args:
+      start: Index of the first sample.
+      length: Number of samples.
+
+    Returns:
+      A 1D float32 array.
+
+    Raises:
+      ChunkOverwrittenError: If part of the chunk was already overwritten.
+    """
+    if self.is_overwritten(start):
+      raise ChunkOverwrittenError(
+          'Samples from %d were overwritten; the ring buffer holds %d samples '
+          'up to %d.' % (start, self._capacity, self._num_reserved.value))
+    array = self._view()
+    offset = start % self._capacity
+    if offset + length <= self._capacity:
+      return array[offset:offset + length]
+    return np.concatenate(
+        (array[offset:], array[:offset + length - self._capacity]))
@@ -0,0 +1,89 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for audio_ring_buffer."""
+
+from multiprocessing import reduction
+
+from absl.testing import absltest
+from magenta.models.onsets_frames_transcription.realtime import audio_ring_buffer
+import numpy as np
+
+
+class AudioRingBufferTest(absltest.TestCase):
+
+  def testReadIsViewWithoutWrap(self):
+    ring = audio_ring_buffer.AudioRingBuffer(8)
+    self.assertEqual(0, ring.write(np.arange(5, dtype=np.float32)))
+    chunk = ring.read(1, 3)
+    np.testing.assert_array_equal([1, 2, 3], chunk)
+    ring.write(np.array([9], dtype=np.float32))
+    ring.write(np.array([7, 7, 7, 7, 7], dtype=np.float32))
+    # The view sees the writer's later samples in the same positions.
+    np.testing.assert_array_equal([7, 7, 3], chunk)
+
+  def testReadAcrossWrap(self):
+    ring = audio_ring_buffer.AudioRingBuffer(8)
+    ring.write(np.arange(6, dtype=np.float32))
+    self.assertEqual(6, ring.write(np.arange(6, 11, dtype=np.float32)))
+    self.assertEqual(11, ring.num_written)
+    np.testing.assert_array_equal(np.arange(4, 11), ring.read(4, 7))
+
+  def testOverwritten(self):
+    ring = audio_ring_buffer.AudioRingBuffer(4)
+    ring.write(np.zeros(3, dtype=np.float32))
+    ring.write(np.zeros(3, dtype=np.float32))
+    self.assertTrue(ring.is_overwritten(1))
+    self.assertFalse(ring.is_overwritten(2))
+    with self.assertRaises(audio_ring_buffer.ChunkOverwrittenError):
+      ring.read(0, 2)
+
+  def testOverwrittenDuringWrite(self):
+    ring = audio_ring_buffer.AudioRingBuffer(4)
+    ring.write(np.zeros(3, dtype=np.float32))
+    overwritten_during_copy = []
+
+    class Samples(object):
+      """Samples that check the buffer while they are being copied."""
+
+      def __len__(self):
+        return 2
+
+      def __getitem__(self, index):
+        overwritten_during_copy.append(ring.is_overwritten(1))
+        return np.ones(2, dtype=np.float32)[index]
+
+    ring.write(Samples())
+    # Sample 1 is lapped by the write before its samples are copied.
+    self.assertTrue(all(overwritten_during_copy))
+    self.assertEqual(5, ring.num_written)
+
+  def testWriteTooLong(self):
+    ring = audio_ring_buffer.AudioRingBuffer(4)
+    with self.assertRaises(ValueError):
+      ring.write(np.zeros(5, dtype=np.float32))
+
+  def testPickleSharesSamples(self):
+    ring = audio_ring_buffer.AudioRingBuffer(4)
+    ring.write(np.ones(2, dtype=np.float32))
+    state = ring.__getstate__()
+    self.assertIsNone(state['_array'])
+    self.assertIs(ring._samples, state['_samples'])  # pylint:disable=protected-access
+    with self.assertRaises(RuntimeError):
+      # Shared arrays may only be passed to processes when they are started.
+      reduction.ForkingPickler.dumps(ring)
+
+
+if __name__ == '__main__':
+  absltest.main()
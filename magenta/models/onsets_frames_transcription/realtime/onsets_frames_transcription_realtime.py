@@ -16,6 +16,7 @@
 
 import multiprocessing
 import threading
+import time
 
 from absl import app
 from absl import flags
@@ -23,11 +24,13 @@ import attr
 from colorama import Fore
 from colorama import Style
 from magenta.models.onsets_frames_transcription.realtime import audio_recorder
+from magenta.models.onsets_frames_transcription.realtime import audio_ring_buffer
 from magenta.models.onsets_frames_transcription.realtime import tflite_model
 import numpy as np
 
 flags.DEFINE_string('model_path', 'onsets_frames_wavinput.tflite',
-                    'File path of TFlite model.')
+                    'File path of TFlite model. Workers return its thresholded '
+                    'frame activations, not its onsets, for display.')
 flags.DEFINE_string('mic', None, 'Optional: Input source microphone ID.')
 flags.DEFINE_float('mic_amplify', 30.0, 'Multiply raw audio mic input')
 flags.DEFINE_string(
@@ -38,15 +41,20 @@ flags.DEFINE_integer(
     'Sample Rate. The model expects 16000. However, some microphones do not '
     'support sampling at this rate. In that case use --sample_rate_hz 48000 and'
     'the code will automatically downsample to 16000')
+flags.DEFINE_float(
+    'ring_buffer_secs', 10.0,
+    'Seconds of audio kept in the shared ring buffer that workers read chunks '
+    'from. Chunks that are not picked up within this time are dropped.')
 FLAGS = flags.FLAGS
 
 
 class TfLiteWorker(multiprocessing.Process):
   """Process for executing TFLite inference."""
 
-  def __init__(self, model_path, task_queue, result_queue):
+  def __init__(self, model_path, ring_buffer, task_queue, result_queue):
     multiprocessing.Process.__init__(self)
     self._model_path = model_path
+    self._ring_buffer = ring_buffer
     self._task_queue = task_queue
     self._result_queue = result_queue
     self._model = None
@@ -59,26 +67,67 @@ class TfLiteWorker(multiprocessing.Process):
 
   def run(self):
     self.setup()
+    length = self._model.get_input_wav_length()
     while True:
       task = self._task_queue.get()
       if task is None:
         self._task_queue.task_done()
         return
-      task(self._model)
+      try:
+        frames = infer_frames(self._model,
+                              self._ring_buffer.read(task.start, length))
+      except audio_ring_buffer.ChunkOverwrittenError:
+        # Still report the chunk so that the collector does not wait for it.
+        frames = None
+      # The chunk is read in place, so it may have been lapped during inference.
+      if self._ring_buffer.is_overwritten(task.start):
+        frames = None
       self._task_queue.task_done()
-      self._result_queue.put(task)
+      self._result_queue.put(
+          ChunkResult(task.serial, frames, task.capture_time))
 
 
 @attr.s
-class AudioChunk(object):
+class ChunkTask(object):
+  """A chunk of audio in the ring buffer, sent to workers by index."""
   serial = attr.ib()
-  samples = attr.ib(repr=lambda w: '{} {}'.format(w.shape, w.dtype))
+  start = attr.ib()
+  # time.time() when the last sample of the chunk was captured.
+  capture_time = attr.ib()
+
+
+@attr.s
+class ChunkResult(object):
+  """Frame activations of a chunk, or None if the chunk was dropped."""
+  serial = attr.ib()
+  frames = attr.ib(repr=lambda w: 'None' if w is None else str(w.shape))
+  capture_time = attr.ib()
+
+
+def infer_frames(model, samples):
+  """Runs the model and returns a [time, pitch] bool array of active frames.
+
+  These are the frame activations rather than the onsets, so that held notes
+  are displayed for as long as they sound.
+
+  Args:
+    model: The tflite_model.Model to run.
+    samples: The 1D float32 audio samples of a chunk.
+
+  Returns:
+    A [time, pitch] bool array that is True where the frame logit is positive.
+  """
+  return model.infer(samples)[:, :, 0] > 0.0
 
 
 class AudioQueue(object):
-  """Audio queue."""
+  """Audio queue.
+
+  Recorded audio is written to a shared ring buffer, and the callback is given
+  a ChunkTask for each complete, overlapping chunk of `frame_length` samples.
+  """
 
-  def __init__(self, callback, audio_device_index, sample_rate_hz,
+  def __init__(self, callback, ring_buffer, audio_device_index, sample_rate_hz,
                model_sample_rate, frame_length, overlap):
     # Initialize recorder.
     downsample_factor = sample_rate_hz / model_sample_rate
@@ -87,10 +136,12 @@ class AudioQueue(object):
         downsample_factor=downsample_factor,
         device_index=audio_device_index)
 
+    self._ring_buffer = ring_buffer
+    self._sample_rate = model_sample_rate
     self._frame_length = frame_length
     self._overlap = overlap
 
-    self._audio_buffer = np.array([], dtype=np.int16).reshape(0, 1)
+    self._chunk_start = ring_buffer.num_written
     self._chunk_counter = 0
     self._callback = callback
 
@@ -100,37 +151,22 @@ class AudioQueue(object):
       timed_out = False
       while not timed_out:
         assert self._recorder.is_active
-        new_audio = self._recorder.get_audio(self._frame_length -
-                                             len(self._audio_buffer))
-        audio_samples = np.concatenate(
-            (self._audio_buffer, new_audio[0] * FLAGS.mic_amplify))
-
-        # Extract overlapping
-        first_unused_byte = 0
-        for pos in range(0, audio_samples.shape[0] - self._frame_length,
-                         self._frame_length - self._overlap):
+        missing = (self._chunk_start + self._frame_length -
+                   self._ring_buffer.num_written)
+        audio, _, capture_time = self._recorder.get_audio(missing)
+        self._ring_buffer.write(np.ravel(audio) * FLAGS.mic_amplify)
+
+        # Hand out every chunk that is now complete. `capture_time` is when the
+        # last written sample was captured, so earlier chunks ended earlier.
+        num_written = self._ring_buffer.num_written
+        while self._chunk_start + self._frame_length <= num_written:
+          chunk_end = self._chunk_start + self._frame_length
           self._callback(
-              AudioChunk(self._chunk_counter,
-                         audio_samples[pos:pos + self._frame_length]))
+              ChunkTask(self._chunk_counter, self._chunk_start,
+                        capture_time -
+                        (num_written - chunk_end) / self._sample_rate))
           self._chunk_counter += 1
-          first_unused_byte = pos + self._frame_length
-
-        # Keep the remaining bytes for next time
-        self._audio_buffer = audio_samples[first_unused_byte:]
-
-
-# This actually executes in each worker thread!
-class OnsetsTask(object):
-  """Inference task."""
-
-  def __init__(self, audio_chunk: AudioChunk):
-    self.audio_chunk = audio_chunk
-    self.result = None
-
-  def __call__(self, model):
-    samples = self.audio_chunk.samples[:, 0]
-    self.result = model.infer(samples)
-    self.timestep = model.get_timestep()
+          self._chunk_start += self._frame_length - self._overlap
 
 
 def result_collector(result_queue):
@@ -156,21 +192,31 @@ def result_collector(result_queue):
     ][n % 12]  #+ str(n//12)
 
   print('Listening to results..')
-  # TODO(mtyka) Ensure serial stitching of results (no guarantee that
-  # the blocks come in in order but they are all timestamped)
+  # Workers finish chunks out of order, so hold results back until all earlier
+  # chunks have been displayed.
+  pending = {}
+  next_serial = 0
   while True:
     result = result_queue.get()
-    serial = result.audio_chunk.serial
-    result_roll = result.result
-    if serial > 0:
-      result_roll = result_roll[4:]
-    for notes in result_roll:
-      for i in range(6, len(notes) - 6):
-        note = notes[i]
-        is_frame = note[0] > 0.0
-        notestr = notename(i, not is_frame)
-        print(notestr, end='')
-      print('|')
+    pending[result.serial] = result
+    while next_serial in pending:
+      result = pending.pop(next_serial)
+      next_serial += 1
+      latency_ms = 1000 * (time.time() - result.capture_time)
+      if result.frames is None:
+        print('Dropped chunk %d after %d ms.' % (result.serial, latency_ms))
+        continue
+      result_roll = result.frames
+      if result.serial > 0:
+        result_roll = result_roll[4:]
+      for t, frames in enumerate(result_roll):
+        for i in range(6, len(frames) - 6):
+          notestr = notename(i, not frames[i])
+          print(notestr, end='')
+        if t == len(result_roll) - 1:
+          print('| %d ms' % latency_ms)
+        else:
+          print('|')
 
 
 def main(argv):
@@ -200,24 +246,27 @@ def main(argv):
     for i, pos in enumerate(
         range(0, samples_length - model.get_input_wav_length() + overlap_wav,
               model.get_input_wav_length() - overlap_wav)):
-      chunk = samples[pos:pos + model.get_input_wav_length()]
-      task = OnsetsTask(AudioChunk(i, chunk))
-      task(model)
-      results.put(task)
+      chunk = samples[pos:pos + model.get_input_wav_length(), 0]
+      capture_time = time.time()
+      results.put(ChunkResult(i, infer_frames(model, chunk), capture_time))
   else:
     tasks = multiprocessing.JoinableQueue()
+    ring_buffer = audio_ring_buffer.AudioRingBuffer(
+        max(int(FLAGS.ring_buffer_secs * model.get_sample_rate()),
+            2 * model.get_input_wav_length()))
 
     ## Make and start the workers
     num_workers = 4
     workers = [
-        TfLiteWorker(FLAGS.model_path, tasks, results)
+        TfLiteWorker(FLAGS.model_path, ring_buffer, tasks, results)
         for i in range(num_workers)
     ]
     for w in workers:
       w.start()
 
     audio_feeder = AudioQueue(
-        callback=lambda audio_chunk: tasks.put(OnsetsTask(audio_chunk)),
+        callback=tasks.put,
+        ring_buffer=ring_buffer,
         audio_device_index=FLAGS.mic if FLAGS.mic is None else int(FLAGS.mic),
         sample_rate_hz=int(FLAGS.sample_rate_hz),
         model_sample_rate=model.get_sample_rate(),
@@ -41,6 +41,10 @@ flags.DEFINE_float(
     'eval_ratio', 0.1,
     'Fraction of input to set aside for eval set. Partition is randomly '
     'selected.')
+flags.DEFINE_integer(
+    'num_workers', 1,
+    'Number of worker processes used to build the dataset. With more than one '
+    'worker, each dataset is written as one TFRecord shard per worker.')
 flags.DEFINE_string(
     'log', 'INFO',
     'The threshold for what messages will be logged DEBUG, INFO, WARN, ERROR, '
@@ -58,10 +62,11 @@ def main(unused_argv):
 
   input_dir = os.path.expanduser(FLAGS.input)
   output_dir = os.path.expanduser(FLAGS.output_dir)
-  pipeline.run_pipeline_serial(
+  pipeline.run_pipeline_parallel(
       pipeline_instance,
       pipeline.tf_record_iterator(input_dir, pipeline_instance.input_type),
-      output_dir)
+      output_dir,
+      num_workers=FLAGS.num_workers)
 
 
 def console_entry_point():
@@ -94,6 +94,11 @@ tf.app.flags.DEFINE_integer(
 tf.app.flags.DEFINE_integer(
     'steps_per_iteration', 1,
     'The number of steps to take per beam search iteration.')
+tf.app.flags.DEFINE_integer(
+    'steps_per_run', 1,
+    'The number of steps to generate inside the TensorFlow graph per session '
+    'run when not using beam search. Larger values are faster, but changes in '
+    'the control signals may take effect up to this many steps late.')
 tf.app.flags.DEFINE_string(
     'log', 'INFO',
     'The threshold for what messages will be logged DEBUG, INFO, WARN, ERROR, '
@@ -102,7 +107,9 @@ tf.app.flags.DEFINE_string(
     'hparams', '',
     'Comma-separated list of `name=value` pairs. For each pair, the value of '
     'the hyperparameter named `name` is set to `value`. This mapping is merged '
-    'with the default hyperparameters.')
+    'with the default hyperparameters. When generating, `sample_in_graph=true` '
+    'samples events inside the TensorFlow graph, which is faster but ignores '
+    'the numpy random seed.')
 
 # Add flags for all performance control signals.
 for control_signal_cls in note_seq.all_performance_control_signals:
@@ -231,6 +238,7 @@ def run_with_flags(generator):
   generator_options.args['branch_factor'].int_value = FLAGS.branch_factor
   generator_options.args[
       'steps_per_iteration'].int_value = FLAGS.steps_per_iteration
+  generator_options.args['steps_per_run'].int_value = FLAGS.steps_per_run
 
   tf.logging.debug('primer_sequence: %s', primer_sequence)
   tf.logging.debug('generator_options: %s', generator_options)
@@ -110,7 +110,9 @@ tf.app.flags.DEFINE_string(
     'hparams', '',
     'Comma-separated list of `name=value` pairs. For each pair, the value of '
     'the hyperparameter named `name` is set to `value`. This mapping is merged '
-    'with the default hyperparameters.')
+    'with the default hyperparameters. When generating, `sample_in_graph=true` '
+    'samples events inside the TensorFlow graph, which is faster but ignores '
+    'the numpy random seed.')
 
 
 def get_checkpoint():
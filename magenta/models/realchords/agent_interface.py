@@ -18,15 +18,18 @@
 """
 
 import json
-from typing import List, Optional, Tuple, TypedDict
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
 from absl import logging
 import jax
 import jax.numpy as jnp
+from magenta.models.realchords import batching
 from magenta.models.realchords import data
 from magenta.models.realchords import event_codec
 from magenta.models.realchords import frame_codec
 from magenta.models.realchords import inference_utils
+from magenta.models.realchords import live_session
 from magenta.models.realchords import non_causal_model_interface
 import note_seq
 import numpy as np
@@ -38,6 +41,10 @@ _CHORD_MAPPING_FILENAME = (
     "realchords_opensource_assets/chord_mapping.json"
 )
 
+# Prompt lengths to compile each model for, so that short sessions do not pay
+# for attention over the full context.
+LENGTH_BUCKETS = (128, 256, 384)
+
 CHORD_OCTAVE = 4
 BASS_OCTAVE = 3
 
@@ -60,18 +67,35 @@ MODELS = [
 ]
 
 ChordInfo = Tuple[str, List[int], bool]
-
-
-class NoteInfo(TypedDict):
-  pitch: int
-  frame: int
-  on: bool
+NoteInfo = live_session.NoteInfo
 
 
 class Agent:
   """Interface for interacting with generative chord model."""
 
-  def __init__(self):
+  def __init__(
+      self,
+      batch_requests: bool = False,
+      max_batch_wait_ms: float = 5.0,
+      compilation_cache_dir: Optional[str] = None,
+      session_ttl_secs: Optional[float] = 30 * 60,
+      max_sessions: Optional[int] = 256,
+  ):
+    """Creates the models.
+
+    Args:
+      batch_requests: Whether to batch concurrent requests to each model, e.g.
+        from several performers. Batched requests do not reuse the decoder
+        cache of their session.
+      max_batch_wait_ms: The longest time a request waits for others to batch
+        with.
+      compilation_cache_dir: An optional directory to persist compiled model
+        functions in across server restarts.
+      session_ttl_secs: Seconds after its last request that a live session and
+        its decoder caches are freed, or None to keep idle sessions.
+      max_sessions: The maximum number of live sessions kept, or None for no
+        limit. The least recently used session is freed first.
+    """
     logging.info("Creating model...")
     self.models = {
         model["name"]: inference_utils.MusicTransformerInferenceModel(
@@ -81,11 +105,23 @@ class Agent:
             batch_size=1,
             model_parallel_submesh=(1, 1, 1, 1),
             gin_overrides="TASK_FEATURE_LENGTHS={'inputs': 0, 'targets': 512}",
-            additional_gin_path=[SMALL_MODEL_GIN_FILE_PATH]
+            additional_gin_path=[SMALL_MODEL_GIN_FILE_PATH],
+            length_buckets=LENGTH_BUCKETS,
+            compilation_cache_dir=compilation_cache_dir,
         )
         for model in MODELS
     }
-    self.non_causal_model = non_causal_model_interface.NonCausalModel()
+    self.non_causal_model = non_causal_model_interface.NonCausalModel(
+        batch_requests=batch_requests,
+        max_batch_wait_ms=max_batch_wait_ms,
+        compilation_cache_dir=compilation_cache_dir,
+    )
+    self.batchers = {}
+    if batch_requests:
+      self.batchers = {
+          name: batching.MicroBatcher(model, max_wait_ms=max_batch_wait_ms)
+          for name, model in self.models.items()
+      }
 
     # TODO(alexscarlatos): load the chord mapping from the model dir
     with open(_CHORD_MAPPING_FILENAME, "r") as f:
@@ -98,11 +134,34 @@ class Agent:
         event_codec.Event(type="note", value=0)
     )
     self.max_frames = 256
+    self.sessions = live_session.SessionStore(
+        self.codec,
+        ttl_secs=session_ttl_secs,
+        max_sessions=max_sessions,
+        on_end=self._clear_decoder_caches,
+    )
     logging.info("Devices: %s", jax.devices())
 
   def get_models(self) -> List[str]:
     return list(self.models.keys())
 
+  def get_batching_metrics(self) -> Dict[str, Dict[str, Any]]:
+    """Returns the batching metrics of each model, when batching requests."""
+    metrics = {
+        name: batcher.metrics() for name, batcher in self.batchers.items()
+    }
+    if self.non_causal_model.batcher is not None:
+      metrics["non_causal"] = self.non_causal_model.batcher.metrics()
+    return metrics
+
+  def get_latency_report(self) -> Dict[str, Dict[str, Any]]:
+    """Returns the startup and per-shape inference latency of each model."""
+    report = {
+        name: model.latency_report() for name, model in self.models.items()
+    }
+    report["non_causal"] = self.non_causal_model.model.latency_report()
+    return report
+
   def decode_chord_token(self, chord_token: int) -> ChordInfo:
     """Extract the underlying information from a given chord token.
 
@@ -203,6 +262,19 @@ class Agent:
         tokens.extend([self.note_rest_token] * (end_frame - len(tokens)))
     return tokens
 
+  def create_session(self) -> str:
+    """Creates a server-side live session and returns its id."""
+    return self.sessions.create()
+
+  def end_session(self, session_id: str) -> None:
+    """Discards a server-side live session."""
+    self.sessions.end(session_id)
+
+  def _clear_decoder_caches(self, session_id: str) -> None:
+    """Frees the decoder caches of an ended or evicted live session."""
+    for model in self.models.values():
+      model.clear_decoder_cache(session_id)
+
   def generate_live(
       self,
       model_name: str,
@@ -215,7 +287,7 @@ class Agent:
       silence_till: int,
       intro_set: bool,
   ) -> Tuple[List[ChordInfo], List[int], Optional[List[int]]]:
-    """Generate chords for a given frame.
+    """Generate chords for a given frame from the full session history.
 
     - Condition on melody and previously generated chord tokens.
     - Generate lookahead frames into the future.
@@ -239,6 +311,99 @@ class Agent:
       intro_chord_tokens: list of chord tokens to fill in session beginning,
         only returned when first generated right before silence cutoff frame
     """
+    session = live_session.LiveSession.from_history(
+        self.codec, notes, chord_tokens, intro_set
+    )
+    new_chords, new_chord_tokens, intro_chord_tokens, _ = self._generate(
+        session, model_name, frame, lookahead, commitahead, temperature,
+        silence_till,
+    )
+    return new_chords, new_chord_tokens, intro_chord_tokens
+
+  def generate_live_session(
+      self,
+      session_id: str,
+      model_name: str,
+      new_notes: List[NoteInfo],
+      note_index: int,
+      frame: int,
+      lookahead: int,
+      commitahead: int,
+      temperature: float,
+      silence_till: int,
+  ) -> Tuple[
+      List[ChordInfo], List[int], Optional[List[int]], Dict[str, float]
+  ]:
+    """Generate chords for a given frame of a server-side session.
+
+    Like `generate_live`, but only the note events played since the previous
+    call are sent. The session keeps the tokenized history, including the
+    chords returned by previous calls, so the cost of a call does not grow
+    with the length of the session.
+
+    Args:
+      session_id: id of a session from `create_session`
+      model_name: model to use, from MODELS keys
+      new_notes: note events not yet sent to the session
+      note_index: index of `new_notes[0]` among all note events in session
+      frame: frame to start generating at
+      lookahead: how many frames into the future to generate
+      commitahead: how many frames to leave chords unchanged since last call
+      temperature: model sampling temperature
+      silence_till: frames before generating with online model
+
+    Returns:
+      new_chords: list of ChordInfo, one for each frame in lookahead
+      new_chord_tokens: list of chord tokens, one for each frame in lookahead
+      intro_chord_tokens: list of chord tokens to fill in session beginning,
+        only returned when first generated right before silence cutoff frame
+      timing: milliseconds spent tokenizing, in model inference and in total
+
+    Raises:
+      KeyError: If there is no session with the given id.
+      live_session.NoteEventIndexError: If some note events are missing.
+    """
+    start_time = time.perf_counter()
+    session = self.sessions.get(session_id)
+    if session is None:
+      raise KeyError("Unknown session %s" % session_id)
+    with session.lock:
+      session.add_note_events(new_notes, note_index)
+      tokenize_time = time.perf_counter() - start_time
+
+      new_chords, new_chord_tokens, intro_chord_tokens, timing = (
+          self._generate(
+              session, model_name, frame, lookahead, commitahead,
+              temperature, silence_till,
+              cache_key=None if self.batchers else session_id,
+          )
+      )
+    timing["tokenize_ms"] += 1000 * tokenize_time
+    timing["total_ms"] = 1000 * (time.perf_counter() - start_time)
+    logging.info("Timing for frame %d: %s", frame, timing)
+    return new_chords, new_chord_tokens, intro_chord_tokens, timing
+
+  def _generate(
+      self,
+      session: live_session.LiveSession,
+      model_name: str,
+      frame: int,
+      lookahead: int,
+      commitahead: int,
+      temperature: float,
+      silence_till: int,
+      cache_key: Optional[str] = None,
+  ) -> Tuple[
+      List[ChordInfo], List[int], Optional[List[int]], Dict[str, float]
+  ]:
+    """Generate chords for a given frame and record them in the session.
+
+    If `cache_key` is given, the model keeps the decoder cache of the prompt
+    under it, so the next call only runs the frames added since this one. It
+    is not supported when batching requests.
+    """
+    timing = {"tokenize_ms": 0.0, "inference_ms": 0.0}
+
     # Wait until at most 4 frames before start to have enough context
     gen_start_frame = silence_till - min(lookahead, 4)
     if frame < gen_start_frame or frame == 0:
@@ -249,67 +414,61 @@ class Agent:
           lookahead,
           silence_till,
       )
-      return [], [], None
+      return [], [], None, timing
 
     logging.info("Generate chords for frame %s", frame)
 
-    model = self.models[model_name]
-
-    # Convert notes to frame token format
-    note_token_hist = self.melody_to_frame_tokens(notes, frame)
-    # logging.info("Note token hist: %s", note_token_hist)
+    model = self.batchers.get(model_name, self.models[model_name])
 
     # Use non-causal model to generate likely chords for introduction section
     intro_chord_tokens = None
-    if not intro_set:
+    if not session.intro_set:
+      start_time = time.perf_counter()
+      note_token_hist = session.get_note_tokens(frame)
+      timing["tokenize_ms"] += 1000 * (time.perf_counter() - start_time)
+      start_time = time.perf_counter()
       intro_chord_tokens = self.non_causal_model.get_output_tokens(
           note_token_hist, 0.0
       )
-      chord_tokens[:frame] = intro_chord_tokens
+      timing["inference_ms"] += 1000 * (time.perf_counter() - start_time)
+      session.set_chord_tokens(0, intro_chord_tokens)
+      session.intro_set = True
       logging.info("Intro chord tokens: %s", intro_chord_tokens)
 
-    # Fill any gaps in chord tokens with rests
-    for i in range(len(chord_tokens)):
-      if chord_tokens[i] == -1:
-        chord_tokens[i] = self.chord_rest_token
-    if len(chord_tokens) < frame:
-      chord_tokens.extend([self.chord_rest_token] * (frame - len(chord_tokens)))
-
-    # Create initial prompt (up to target frame)
-    chord_token_hist = chord_tokens[:frame]
-    # Trim beginning of context to avoid surpassing max length
-    max_context_len = self.max_frames - lookahead
-    note_token_hist = note_token_hist[-max_context_len:]
-    chord_token_hist = chord_token_hist[-max_context_len:]
-    prompt = np.full(
-        (1, 2 * len(chord_token_hist)), self.chord_rest_token, dtype=np.int32
-    )
-    prompt[0, 0::2] = chord_token_hist
-    prompt[0, 1::2] = note_token_hist
+    # Create initial prompt (up to target frame). Gaps in chord tokens are
+    # rests. Trim beginning of context to avoid surpassing max length.
+    start_time = time.perf_counter()
+    num_chord_frames = max(session.num_chord_frames, frame)
+    prompt = session.get_prompt(frame, self.max_frames - lookahead)
     start_idx = prompt.shape[1]
     logging.info("Prompt: %s", prompt)
 
     # First predict up to commit point to get predicted user notes
-    commit_frames = len(chord_tokens) - lookahead + commitahead - frame
+    commit_frames = num_chord_frames - lookahead + commitahead - frame
     commit_frames = max(commit_frames, 0)  # If frame is past commit point
+    committed_chord_tokens = session.get_chord_tokens(
+        frame, frame + min(commit_frames, lookahead)
+    )
+    timing["tokenize_ms"] += 1000 * (time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
     if commit_frames >= lookahead:
       # Can just look up new tokens in cache if lookahead was decreased by user
       # Otherwise will try to generate <= 0 tokens and will break model api
-      new_chord_tokens = np.array(
-          chord_tokens[frame : frame + min(commit_frames, lookahead)]
-      )
+      new_chord_tokens = np.array(committed_chord_tokens)
     else:
       if commit_frames > 0:
         new_tokens = model(
             decoder_prompt=jnp.array(prompt),
             decode_length=start_idx + commit_frames * 2,
             seed=np.random.randint(1234),
+            cache_key=cache_key,
             # Seems like type checker has bug handling kwargs type
             temperature=temperature,  # type: ignore
         )
         new_tokens = np.array(new_tokens)
         # Replace predicted chords with committed chords
-        new_tokens[0, 0::2] = chord_tokens[frame : frame + commit_frames]
+        new_tokens[0, 0::2] = committed_chord_tokens
         # Update prompt to commit point
         prompt = np.concatenate([prompt, new_tokens], axis=1)
 
@@ -318,16 +477,21 @@ class Agent:
           decoder_prompt=jnp.array(prompt),
           decode_length=start_idx + lookahead * 2 - 1,
           seed=np.random.randint(1234),
+          cache_key=cache_key,
           # Seems like type checker has bug handling kwargs type
           temperature=temperature,  # type: ignore
       )
       new_tokens = np.array(new_tokens)
       all_tokens = np.concatenate([prompt, new_tokens], axis=1)
       new_chord_tokens = all_tokens[0, start_idx::2]
+    timing["inference_ms"] += 1000 * (time.perf_counter() - start_time)
+
+    # Record new chord tokens as the frontend will
+    session.set_chord_tokens(frame, new_chord_tokens.tolist())
 
     # Decode and return new chord tokens
     new_chords = [
         self.decode_chord_token(chord_tok) for chord_tok in new_chord_tokens
     ]
     logging.info("Chords: %s, cur_frame: %d", new_chords, frame)
-    return new_chords, new_chord_tokens.tolist(), intro_chord_tokens
+    return new_chords, new_chord_tokens.tolist(), intro_chord_tokens, timing
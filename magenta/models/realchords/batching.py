@@ -0,0 +1,265 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-batching of concurrent inference requests.
+
+Each live request runs the model on a single prompt. When several performers
+share a server, a `MicroBatcher` collects the requests that arrive within a
+short deadline of each other, runs them as one batch of a precompiled size and
+hands each caller its own result.
+"""
+
+import collections
+import dataclasses
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_BATCH_SIZES = (1, 2, 4, 8)
+
+
+@dataclasses.dataclass
+class InferenceRequest:
+  """A single-example inference request.
+
+  Attributes:
+    decode_length: The total length of the decoder sequence, including the
+      prompt.
+    decoder_prompt: The `[1, length]` decoder prompt.
+    decoder_params: Scalar decoder params, e.g. the temperature. Only requests
+      with equal params are batched together.
+    seed: The seed for random sampling.
+    decode_rng: The decoder rng, used if there is no seed.
+    encoder_input_tokens: The `[1, length]` encoder inputs, for
+      encoder-decoder models.
+  """
+
+  decode_length: int
+  decoder_prompt: np.ndarray
+  decoder_params: Dict[str, Any]
+  seed: Optional[int] = None
+  decode_rng: Optional[Any] = None
+  encoder_input_tokens: Optional[np.ndarray] = None
+
+
+class _PendingRequest:
+  """A queued request and, once run, its result."""
+
+  def __init__(self, request: InferenceRequest):
+    self.request = request
+    try:
+      self.key = tuple(sorted(request.decoder_params.items()))
+      hash(self.key)
+    except TypeError:
+      # Params that cannot be compared are never batched with others.
+      self.key = self
+    self.enqueue_time = time.monotonic()
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+
+class MicroBatcher:
+  """Batches concurrent requests to an inference model.
+
+  The model must have an `infer_requests(requests, batch_size)` method, like
+  `inference_utils.MusicTransformerInferenceModel`. A request waits at most
+  `max_wait_ms` for others to batch with; the batch is run as soon as the
+  largest batch size is filled. Batches are padded to the smallest batch size
+  that fits them, so only those sizes are ever compiled.
+  """
+
+  def __init__(
+      self,
+      model: Any,
+      batch_sizes: Sequence[int] = DEFAULT_BATCH_SIZES,
+      max_wait_ms: float = 5.0,
+      compile_batch_sizes: bool = True,
+  ):
+    """Constructs a `MicroBatcher` and starts its worker thread.
+
+    Args:
+      model: The inference model.
+      batch_sizes: The batch sizes to run at.
+      max_wait_ms: The longest time a request waits for others to batch with.
+      compile_batch_sizes: Whether to compile the model for all batch sizes
+        up front, rather than on the first batch of each size.
+    """
+    if not batch_sizes:
+      raise ValueError('At least one batch size is required.')
+    self.model = model
+    self._batch_sizes = sorted(batch_sizes)
+    self._max_wait = max_wait_ms / 1000
+    if compile_batch_sizes:
+      model.compile_batch_sizes(self._batch_sizes)
+
+    self._queue = collections.deque()
+    self._cond = threading.Condition()
+    self._closed = False
+
+    self._max_queue_depth = 0
+    self._num_requests = 0
+    self._num_batches = collections.Counter()
+    self._num_filled_rows = 0
+    self._num_rows = 0
+
+    self._worker = threading.Thread(target=self._run, daemon=True)
+    self._worker.start()
+
+  def __call__(
+      self,
+      decode_length: int,
+      decoder_prompt: Any,
+      seed: Optional[int] = None,
+      decode_rng: Optional[Any] = None,
+      cache_key: Optional[str] = None,
+      **decoder_params: Any,
+  ) -> np.ndarray:
+    """Runs a request, batched with concurrent ones.
+
+    Takes the same arguments as the model's `__call__`, for a single prompt.
+
+    Args:
+      decode_length: The total length of the decoder sequence, including the
+        prompt.
+      decoder_prompt: The `[1, length]` decoder prompt.
+      seed: The seed for random sampling.
+      decode_rng: The decoder rng that will override the seed.
+      cache_key: Must be None; batched requests do not keep a decoder cache.
+      **decoder_params: Additional decoder params. `encoder_input_tokens` is
+        taken as the encoder inputs of the request.
+
+    Returns:
+      The predicted sequence of the request, with a batch dimension of 1.
+
+    Raises:
+      ValueError: If the prompt is not a single example, or a cache key is
+        given.
+      RuntimeError: If the batcher was closed.
+    """
+    if cache_key is not None:
+      raise ValueError('Batched requests do not support a decoder cache key.')
+    decoder_prompt = np.asarray(decoder_prompt)
+    if decoder_prompt.shape[0] != 1:
+      raise ValueError(
+          'Expected a single prompt, got a batch of %d'
+          % decoder_prompt.shape[0]
+      )
+    encoder_input_tokens = decoder_params.pop('encoder_input_tokens', None)
+    if encoder_input_tokens is not None:
+      encoder_input_tokens = np.asarray(encoder_input_tokens)
+    pending = _PendingRequest(
+        InferenceRequest(
+            decode_length=decode_length,
+            decoder_prompt=decoder_prompt,
+            decoder_params=decoder_params,
+            seed=seed,
+            decode_rng=decode_rng,
+            encoder_input_tokens=encoder_input_tokens,
+        )
+    )
+    with self._cond:
+      if self._closed:
+        raise RuntimeError('MicroBatcher is closed.')
+      self._queue.append(pending)
+      self._num_requests += 1
+      self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+      self._cond.notify()
+    pending.done.wait()
+    if pending.error is not None:
+      raise pending.error
+    return pending.result
+
+  def _take_batch(self) -> Optional[List[_PendingRequest]]:
+    """Waits for and dequeues the next batch, or None once closed."""
+    max_batch_size = self._batch_sizes[-1]
+    with self._cond:
+      while not self._queue and not self._closed:
+        self._cond.wait()
+      if not self._queue:
+        return None
+      first = self._queue[0]
+      deadline = first.enqueue_time + self._max_wait
+      while not self._closed:
+        num_compatible = sum(
+            pending.key == first.key for pending in self._queue
+        )
+        timeout = deadline - time.monotonic()
+        if num_compatible >= max_batch_size or timeout <= 0:
+          break
+        self._cond.wait(timeout)
+
+      batch = []
+      remaining = collections.deque()
+      for pending in self._queue:
+        if pending.key == first.key and len(batch) < max_batch_size:
+          batch.append(pending)
+        else:
+          remaining.append(pending)
+      self._queue = remaining
+      return batch
+
+  def _run(self) -> None:
+    while True:
+      batch = self._take_batch()
+      if batch is None:
+        return
+      batch_size = next(
+          size for size in self._batch_sizes if size >= len(batch)
+      )
+      try:
+        results = self.model.infer_requests(
+            [pending.request for pending in batch], batch_size
+        )
+      except Exception as e:  # pylint: disable=broad-except
+        for pending in batch:
+          pending.error = e
+      else:
+        for pending, result in zip(batch, results):
+          pending.result = result
+      with self._cond:
+        self._num_batches[batch_size] += 1
+        self._num_filled_rows += len(batch)
+        self._num_rows += batch_size
+      for pending in batch:
+        pending.done.set()
+
+  def metrics(self) -> Dict[str, Any]:
+    """Returns queue and batching metrics.
+
+    Returns:
+      A dict with the current `queue_depth`, the `max_queue_depth` seen, the
+      number of requests and batches run, `num_batches_by_size`, and
+      `batch_fill`, the fraction of batch rows that held a request.
+    """
+    with self._cond:
+      return {
+          'queue_depth': len(self._queue),
+          'max_queue_depth': self._max_queue_depth,
+          'num_requests': self._num_requests,
+          'num_batches': sum(self._num_batches.values()),
+          'num_batches_by_size': dict(self._num_batches),
+          'batch_fill': (
+              self._num_filled_rows / self._num_rows if self._num_rows else 0.0
+          ),
+      }
+
+  def close(self) -> None:
+    """Runs the queued requests and stops the worker thread."""
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+    self._worker.join()
@@ -0,0 +1,121 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for batching."""
+
+import threading
+
+from absl.testing import absltest
+from magenta.models.realchords import batching
+import numpy as np
+
+
+class FakeModel:
+  """Echoes each prompt plus its temperature, recording batch sizes."""
+
+  def __init__(self):
+    self.compiled_batch_sizes = []
+    self.batches = []
+
+  def compile_batch_sizes(self, batch_sizes):
+    self.compiled_batch_sizes.extend(batch_sizes)
+
+  def infer_requests(self, requests, batch_size):
+    self.batches.append((len(requests), batch_size))
+    return [
+        request.decoder_prompt[:, : request.decode_length]
+        + request.decoder_params['temperature']
+        for request in requests
+    ]
+
+
+class MicroBatcherTest(absltest.TestCase):
+
+  def testConcurrentRequestsAreBatched(self):
+    model = FakeModel()
+    batcher = batching.MicroBatcher(
+        model, batch_sizes=(1, 2, 4), max_wait_ms=1000
+    )
+    self.assertEqual([1, 2, 4], model.compiled_batch_sizes)
+
+    results = {}
+
+    def _request(i, temperature):
+      results[i] = batcher(
+          decode_length=2,
+          decoder_prompt=np.array([[i, i, i]]),
+          temperature=temperature,
+      )
+
+    threads = [
+        threading.Thread(target=_request, args=(i, 0 if i < 5 else 100))
+        for i in range(6)
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    batcher.close()
+
+    for i in range(6):
+      expected = i if i < 5 else i + 100
+      np.testing.assert_array_equal([[expected, expected]], results[i])
+    # Requests with different temperatures are never in the same batch.
+    self.assertEqual(6, sum(num_requests for num_requests, _ in model.batches))
+    self.assertTrue(
+        all(num_requests <= size for num_requests, size in model.batches)
+    )
+    metrics = batcher.metrics()
+    self.assertEqual(0, metrics['queue_depth'])
+    self.assertEqual(6, metrics['num_requests'])
+    self.assertEqual(len(model.batches), metrics['num_batches'])
+    self.assertEqual(
+        6 / sum(size for _, size in model.batches), metrics['batch_fill']
+    )
+
+  def testFullBatchRunsBeforeDeadline(self):
+    model = FakeModel()
+    batcher = batching.MicroBatcher(
+        model, batch_sizes=(2,), max_wait_ms=60_000
+    )
+    threads = [
+        threading.Thread(
+            target=batcher,
+            kwargs=dict(
+                decode_length=1,
+                decoder_prompt=np.array([[1]]),
+                temperature=0,
+            ),
+        )
+        for _ in range(2)
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join(timeout=10)
+      self.assertFalse(thread.is_alive())
+    self.assertEqual([(2, 2)], model.batches)
+    self.assertEqual(1.0, batcher.metrics()['batch_fill'])
+    batcher.close()
+
+  def testErrorsAreRaisedInCallers(self):
+    model = FakeModel()
+    batcher = batching.MicroBatcher(model, max_wait_ms=0)
+    with self.assertRaises(KeyError):
+      batcher(decode_length=1, decoder_prompt=np.array([[1]]))
+    batcher.close()
+
+
+if __name__ == '__main__':
+  absltest.main()
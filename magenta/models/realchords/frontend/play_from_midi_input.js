@@ -145,6 +145,7 @@ function toggleLiveSession() {
     bpmInput.disabled = false;
     timeSigInput.disabled = false;
     silenceInput.disabled = false;
+    endServerSession(lastSession);
     Tone.Transport.stop();
     Tone.Transport.cancel();
     stopMetronome();
@@ -168,6 +169,8 @@ function toggleLiveSession() {
       chordHistory: [],       // All chord pitch/symbol onsets with frames
       chordTokens: [],        // All chord tokens in frame format
       introSet: false,        // If model has generated intro section
+      serverSessionId: createServerSession(),  // Promise of server session ID
+      numNotesSent: 0,        // Note events already received by the server
     };
     liveSessionBtn.textContent = 'Stop Live Session';
     showChordsCheck.disabled = true;
@@ -231,38 +234,75 @@ function getSessionCurrentFrame() {
   return frame - curSession.startFrame;
 }
 
-/** Send session history as context to model to get new chord predictions */
+/**
+ * Create a session on the server that keeps the tokenized history, so that
+ * each request only needs to send new note events
+ * @return {!Promise<string>} Server session ID
+ */
+async function createServerSession() {
+  const result = await fetch(`${window.location.origin}/session`, {
+    'method': 'POST',
+  });
+  const {sessionId} = await result.json();
+  return sessionId;
+}
+
+/**
+ * End the server session of a live session
+ * @param {Object!} session
+ */
+async function endServerSession(session) {
+  const sessionId = await session.serverSessionId;
+  fetch(`${window.location.origin}/session/${sessionId}`, {
+    'method': 'DELETE',
+  });
+}
+
+/** Send new notes as context to model to get new chord predictions */
 async function syncWithServer() {
   // Exit loop if current session ended (in case ended during timeout)
   if (!curSession) {
     return;
   }
+  const session = curSession;
+  const sessionId = await session.serverSessionId;
 
-  // Send current frame and context to server for generation
+  // Send current frame and new notes to server for generation
   const curFrame = getSessionCurrentFrame();
+  const noteIndex = session.numNotesSent;
+  const notes = session.noteHistory.slice(noteIndex);
   const result = await fetch(`${window.location.origin}/play`, {
     'method': 'POST',
     headers: {
       'Content-Type': 'application/json',
     },
     body: JSON.stringify({
+      sessionId: sessionId,
       model: modelSelect.value,
-      notes: curSession.noteHistory,
-      chordTokens: curSession.chordTokens,
+      notes: notes,
+      noteIndex: noteIndex,
       frame: curFrame + 1,  // Request chords to play at the next frame
       lookahead: getLookaheadFrames(),
       commitahead: getCommitaheadFrames(),
       silenceTill: getSilenceFrames(),
       temperature: temperatureInput.valueAsNumber,
-      introSet: curSession.introSet,
     })
   });
   const json = await result.json();
 
   // Exit loop if current session ended (in case ended during fetch)
-  if (!curSession) {
+  if (curSession !== session) {
+    return;
+  }
+
+  // Resend notes the server is missing
+  if (result.status === 409) {
+    session.numNotesSent = json.numNoteEvents;
+    syncWithServer();
     return;
   }
+  session.numNotesSent = noteIndex + notes.length;
+  console.log('Server timing (ms)', json.timing);
 
   // Schedule chords based on agent response
   processAgentAction(json);
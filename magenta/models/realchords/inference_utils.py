@@ -17,14 +17,20 @@
 The **InferenceModel is for running model inference in Colab.
 """
 
+import collections
+import dataclasses
 import functools
+import time
 from typing import Any, Callable, List, Mapping, MutableMapping, Optional, Sequence, Tuple, Union
 
+from absl import logging
 from flax import linen as nn
+from flax.linen import partitioning as flax_partitioning
 import gin
 import jax
 from jax import random
 import jax.numpy as jnp
+from magenta.models.realchords import batching
 import numpy as np
 import seqio
 from t5x import decoding
@@ -36,6 +42,77 @@ import t5x.interactive_model
 Array = jnp.ndarray | np.ndarray
 PyTree = Any
 
+# Number of decoder caches kept per cache key. Keeping more than one lets a
+# call that extends the prompt with speculative tokens be followed by a call
+# that extends only the committed history.
+_MAX_DECODER_CACHES_PER_KEY = 2
+
+
+@dataclasses.dataclass
+class _DecoderCache:
+  """Decoder attention cache of a prompt prefix.
+
+  Attributes:
+    tokens: The `[batch, length]` decoder input tokens (BOS followed by the
+      prompt) whose keys and values are in `cache`.
+    cache: The flax `cache` collection of the decoder.
+  """
+
+  tokens: np.ndarray
+  cache: PyTree
+
+
+def _prefill_decoder_cache(module, params, inputs, causal_attention):
+  """Fills a decoder cache with the keys and values of the prompt.
+
+  This computes the same cache as the private
+  `DecoderOnlyModel._compute_kv_cache`, without depending on it or on the form
+  of what it returns: the cache is constrained to the sharding of its logical
+  axes, and the prompt is prefilled with `causal_attention`, so a prefix that
+  the model attends to bidirectionally is still attended to bidirectionally.
+
+  Args:
+    module: The flax decoder module of a t5x `DecoderOnlyModel`.
+    params: The model parameters.
+    inputs: The `[batch, length]` decoder input tokens, with everything after
+      the prompt masked out.
+    causal_attention: The `[batch, length]` decoder causal attention mask,
+      which has one more 1 than the number of prompt tokens.
+
+  Returns:
+    A tuple of the flax `cache` collection and the `[batch]` prompt lengths,
+    i.e. the index to start decoding from.
+  """
+  _, initial_variables = module.apply(
+      {'params': params},
+      jnp.ones_like(inputs),
+      jnp.ones_like(inputs),
+      enable_dropout=False,
+      decode=True,
+      mutable=['cache'],
+  )
+  cache = initial_variables['cache']
+  if 'cache_axes' in initial_variables:
+    cache = jax.tree_util.tree_map(
+        flax_partitioning.with_sharding_constraint,
+        cache,
+        flax_partitioning.get_axis_names(initial_variables['cache_axes']),
+    )
+  prompt_lengths = jnp.sum(causal_attention, axis=1) - 1
+  _, variables = module.apply(
+      {'params': params, 'cache': cache},
+      decoder_input_tokens=inputs,
+      # The causal attention mask covers the whole prompt including BOS, so
+      # using it as the targets makes the attention mask cover the prompt.
+      decoder_target_tokens=causal_attention,
+      decoder_causal_attention=causal_attention,
+      enable_dropout=False,
+      prefill=True,
+      prefill_lengths=prompt_lengths,
+      mutable=['cache'],
+  )
+  return variables['cache'], prompt_lengths
+
 
 class MusicTransformerInferenceModel:
   """An inference model for single Transformer temprature sampling."""
@@ -57,6 +134,8 @@ class MusicTransformerInferenceModel:
       load_gin_from_model_dir: bool = True,
       additional_gin_path: Optional[List[str]] = None,
       gin_skip_unknown: bool = False,
+      length_buckets: Optional[Sequence[int]] = None,
+      compilation_cache_dir: Optional[str] = None,
   ):
     """Initializes the model.
 
@@ -76,6 +155,12 @@ class MusicTransformerInferenceModel:
         a model from only the checkpoint but no gin config.
       gin_skip_unknown: Whether to skip unknown gin configs when loading gin
         files.
+      length_buckets: Decoder lengths to compile the inference function for,
+        in addition to the full target feature length. Each call is padded to
+        the shortest bucket that fits it rather than to the full length.
+        Buckets longer than the full length are ignored.
+      compilation_cache_dir: An optional directory to persist compiled
+        functions in, so that later runs skip compilation.
     """
     self._model_dir = model_dir
     self._gin_file_path = gin_file_path
@@ -83,6 +168,18 @@ class MusicTransformerInferenceModel:
     self.batch_size = batch_size
     self._model_parallel_submesh = model_parallel_submesh
     self._compiled_infer_fn = None
+    self._compiled_infer_fns = {}
+    self._length_buckets = tuple(length_buckets or ())
+    self._sequence_lengths = None
+    self._compilation_cache_dir = compilation_cache_dir
+    self.initialize_ms = None
+    self.compile_ms = {}
+    # Count, total and max inference milliseconds per compiled shape.
+    self._inference_ms = collections.defaultdict(lambda: [0, 0.0, 0.0])
+    self._partitioned_prefill_fn = None
+    self._partitioned_extend_cache_fn = None
+    self._partitioned_decode_from_cache_fn = None
+    self._decoder_caches = {}
     self._gin_overrides = gin_overrides
     self._default_decoder_params = dict(default_decoder_params)
     self._default_seed = default_seed
@@ -102,6 +199,8 @@ class MusicTransformerInferenceModel:
     if self._compiled_infer_fn:
       return
 
+    start_time = time.perf_counter()
+    self._set_compilation_cache_dir()
     ckpt_path = self._model_dir
     if self._step is not None:
       ckpt_path = f'{ckpt_path}/checkpoint_{self._step}'
@@ -146,8 +245,6 @@ class MusicTransformerInferenceModel:
         },
     )
 
-    train_state = self._interactive_model.train_state
-
     def _infer_fn(params, batch, decoder_params, rng):
       assert isinstance(
           self._interactive_model.model, t5x.models.DecoderOnlyModel
@@ -174,36 +271,344 @@ class MusicTransformerInferenceModel:
             partitioner.data_partition_spec,
         ),
     )
-    self._compiled_infer_fn = partitioner.compile(
-        partitioned_infer_fn,
-        train_state.params,
-        {
-            'decoder_input_tokens': jnp.zeros(
-                (self.batch_size, self.feature_lengths['targets']), np.int32
-            ),
-            'decoder_causal_attention': jnp.ones(
-                (self.batch_size, self.feature_lengths['targets']), np.int32
-            ),
-        },
+    self._partitioner = partitioner
+    self._partitioned_infer_fn = partitioned_infer_fn
+    self._compile_buckets([self.batch_size])
+
+    # Functions for decoding from a decoder cache that is kept across calls.
+    def _prefill_fn(params, batch):
+      inputs = batch['decoder_input_tokens'] * batch['decoder_causal_attention']
+      return _prefill_decoder_cache(
+          self._interactive_model.model.module,
+          params,
+          inputs,
+          batch['decoder_causal_attention'],
+      )
+
+    def _extend_cache_fn(params, cache, tokens, num_tokens):
+      module = self._interactive_model.model.module
+
+      def _step(i, cache):
+        token = jax.lax.dynamic_slice_in_dim(tokens, i, 1, axis=1)
+        _, new_vars = module.apply(
+            {'params': params, 'cache': cache},
+            token,
+            token,
+            enable_dropout=False,
+            decode=True,
+            max_decode_length=self.feature_lengths['targets'],
+            mutable=['cache'],
+        )
+        return new_vars['cache']
+
+      return jax.lax.fori_loop(0, num_tokens, _step, cache)
+
+    def _decode_from_cache_fn(
+        params, cache, batch, initial_index, decoder_params, rng
+    ):
+      # Same as `DecoderOnlyModel.predict_batch_with_aux`, with the prompt
+      # already in `cache`.
+      model = self._interactive_model.model
+      inputs = batch['decoder_input_tokens']
+      tokens_ids_to_logits = functools.partial(
+          model._compute_logits_from_slice,  # pylint: disable=protected-access
+          params=params,
+          max_decode_length=inputs.shape[1],
+      )
+      scanned = (
+          hasattr(model.module, 'scan_layers') and model.module.scan_layers
+      )
+      decoder_params = {
+          'eos_id': model.output_vocabulary.eos_id,
+          **decoder_params,
+      }
+      decode_fn = model._decode_fn  # pylint: disable=protected-access
+      decoded_sequences, scores = decode_fn(
+          inputs=inputs,
+          cache=cache,
+          tokens_to_logits=tokens_ids_to_logits,
+          num_decodes=1,
+          initial_index=initial_index,
+          cache_offset=1 if scanned else 0,
+          decode_rng=rng,
+          **decoder_params,
+      )
+      return (
+          models.remove_prefix(decoded_sequences[:, -1, :], initial_index),
+          scores[:, -1],
+      )
+
+    params_axes = self._interactive_model.train_state_axes.params
+    self._partitioned_prefill_fn = partitioner.partition(
+        _prefill_fn,
+        in_axis_resources=(params_axes, partitioner.data_partition_spec),
+        out_axis_resources=(None, None),
+    )
+    self._partitioned_extend_cache_fn = partitioner.partition(
+        _extend_cache_fn,
+        in_axis_resources=(params_axes, None, None, None),
+        out_axis_resources=None,
+    )
+    self._partitioned_decode_from_cache_fn = partitioner.partition(
+        _decode_from_cache_fn,
+        in_axis_resources=(
+            params_axes,
+            None,
+            partitioner.data_partition_spec,
+            None,
+            None,
+            None,
+        ),
+        out_axis_resources=(
+            partitioner.data_partition_spec,
+            partitioner.data_partition_spec,
+        ),
+    )
+    self._initialized = True
+    self._log_initialize_time(start_time)
+
+  @property
+  def feature_lengths(self) -> Mapping[str, int]:
+    return self._feature_lengths
+
+  def _set_compilation_cache_dir(self) -> None:
+    if self._compilation_cache_dir is not None:
+      jax.config.update(
+          'jax_compilation_cache_dir', self._compilation_cache_dir
+      )
+
+  def _log_initialize_time(self, start_time: float) -> None:
+    self.initialize_ms = 1000 * (time.perf_counter() - start_time)
+    logging.info(
+        'Initialized %s in %.0f ms, compile times (ms) by shape: %s',
+        self._model_dir,
+        self.initialize_ms,
+        self.compile_ms,
+    )
+
+  def _placeholder_batch(
+      self, batch_size: int, length: int
+  ) -> Mapping[str, jnp.ndarray]:
+    """Returns a batch of a compiled shape, for compilation."""
+    return {
+        'decoder_input_tokens': jnp.zeros((batch_size, length), np.int32),
+        'decoder_causal_attention': jnp.ones((batch_size, length), np.int32),
+    }
+
+  def _compile_infer_fn(self, batch_size: int, length: int) -> None:
+    """Compiles the inference function for a batch size and length."""
+    start_time = time.perf_counter()
+    self._compiled_infer_fns[batch_size, length] = self._partitioner.compile(
+        self._partitioned_infer_fn,
+        self._interactive_model.train_state.params,
+        self._placeholder_batch(batch_size, length),
         {
             'max_decode_steps': 2048,  # placeholder,
             **self._default_decoder_params,
         },
         random.PRNGKey(self._default_seed),  # placeholder of rng
     )
-    self._initialized = True
+    self.compile_ms[f'{batch_size}x{length}'] = 1000 * (
+        time.perf_counter() - start_time
+    )
 
-  @property
-  def feature_lengths(self) -> Mapping[str, int]:
-    return self._feature_lengths
+  def _compile_buckets(self, batch_sizes: Sequence[int]) -> None:
+    """Compiles the inference function for batch sizes at all lengths."""
+    full_length = self.feature_lengths['targets']
+    self._sequence_lengths = sorted(
+        {length for length in self._length_buckets if length < full_length}
+        | {full_length}
+    )
+    for batch_size in batch_sizes:
+      for length in self._sequence_lengths:
+        if (batch_size, length) not in self._compiled_infer_fns:
+          self._compile_infer_fn(batch_size, length)
+    self._compiled_infer_fn = self._compiled_infer_fns[
+        self.batch_size, full_length
+    ]
+
+  def compile_batch_sizes(self, batch_sizes: Sequence[int]) -> None:
+    """Compiles the inference function for additional batch sizes."""
+    self.initialize()
+    self._compile_buckets(batch_sizes)
+
+  def _bucket_length(self, length: int) -> int:
+    """Returns the shortest compiled length of at least `length`."""
+    for bucket_length in self._sequence_lengths:
+      if bucket_length >= length:
+        return bucket_length
+    return self._sequence_lengths[-1]
+
+  def latency_report(self) -> Mapping[str, Any]:
+    """Returns startup, compile and per-shape inference latencies in ms.
+
+    Shapes are keyed as `'<batch size>x<length>'`.
+    """
+    return {
+        'initialize_ms': self.initialize_ms,
+        'compile_ms': dict(self.compile_ms),
+        'inference_ms': {
+            f'{batch_size}x{length}': {
+                'count': count,
+                'mean': total_ms / count,
+                'max': max_ms,
+            }
+            for (batch_size, length), (count, total_ms, max_ms) in sorted(
+                self._inference_ms.items()
+            )
+        },
+    }
+
+  def infer_requests(
+      self,
+      requests: Sequence[batching.InferenceRequest],
+      batch_size: int,
+  ) -> List[np.ndarray]:
+    """Runs several single-example requests as one batch.
+
+    Each request is a prompt of its own length, padded into its own row. Rows
+    past the requests repeat the first one. All requests must share their
+    `decoder_params`, and they share the random key of the first request.
+
+    Args:
+      requests: The requests, at most `batch_size` of them.
+      batch_size: The batch size to run at. The inference function is compiled
+        for it if it was not yet.
+
+    Returns:
+      The `[1, length]` predictions of each request, as `__call__` returns.
+    """
+    self.initialize()
+    length = self._bucket_length(
+        max(request.decode_length for request in requests) + 1
+    )
+    decoder_tokens = np.zeros((batch_size, length), dtype=np.int32)
+    for i, request in enumerate(requests):
+      prompt = np.reshape(request.decoder_prompt, -1)
+      # Leave a BOS at the beginning.
+      decoder_tokens[i, 1 : len(prompt) + 1] = prompt
+    decoder_tokens[len(requests) :] = decoder_tokens[0]
+    batch = {
+        'decoder_input_tokens': jnp.asarray(decoder_tokens),
+        'decoder_causal_attention': jnp.ones(
+            (batch_size, length), dtype=np.int32
+        ),
+    }
+    decode_steps = [
+        request.decode_length - request.decoder_prompt.shape[-1]
+        for request in requests
+    ]
+    decoder_params = {
+        'max_decode_steps': jnp.array(max(decode_steps), dtype=jnp.int32),
+        **requests[0].decoder_params,
+    }
+    preds = np.asarray(
+        self._infer(batch, decoder_params, _request_rng(self, requests[0]))
+    )
+    return [preds[i : i + 1, :steps] for i, steps in enumerate(decode_steps)]
+
+  def _pad_prompt(
+      self, decoder_prompt: Array, length: Optional[int] = None
+  ) -> Mapping[str, jnp.ndarray]:
+    """Pads a batch of prompts to a compiled length, by default the full one."""
+    if length is None:
+      length = self.feature_lengths['targets']
+    prompt_length = decoder_prompt.shape[1]
+    return {
+        # Pad beginning with BOS and ending to match compilation length.
+        'decoder_input_tokens': jnp.pad(
+            decoder_prompt, [(0, 0), (1, length - prompt_length - 1)]
+        ),
+        'decoder_causal_attention': jnp.ones(
+            (decoder_prompt.shape[0], length), dtype=np.int32
+        ),
+    }
+
+  def _get_decoder_cache(
+      self, cache_key: str, decoder_prompt: np.ndarray
+  ) -> Tuple[PyTree, jnp.ndarray]:
+    """Returns the decoder cache for all but the last token of a prompt.
+
+    The longest cache kept for `cache_key` whose tokens are a prefix of the
+    prompt is extended by only the remaining tokens. If there is none, e.g.
+    because the context window slid forward and the prompt no longer starts
+    with the cached tokens, the cache is recomputed from the full prompt.
+
+    Args:
+      cache_key: The key of the caches to reuse and update, e.g. a session id.
+      decoder_prompt: The `[batch, length]` prompt.
+
+    Returns:
+      The cache, and the `[batch]` index to start decoding from.
+    """
+    prompt_length = decoder_prompt.shape[1]
+    # The first sampling step feeds the last prompt token, so the cache holds
+    # BOS followed by the rest of the prompt.
+    cache_tokens = np.pad(decoder_prompt[:, :-1], [(0, 0), (1, 0)])
+    params = self._interactive_model.train_state.params
+
+    reusable = [
+        entry
+        for entry in self._decoder_caches.get(cache_key, [])
+        if entry.tokens.shape[1] <= prompt_length
+        and np.array_equal(
+            entry.tokens, cache_tokens[:, : entry.tokens.shape[1]]
+        )
+    ]
+    if reusable:
+      entry = max(reusable, key=lambda entry: entry.tokens.shape[1])
+      num_cached = entry.tokens.shape[1]
+      new_tokens = np.zeros(
+          (self.batch_size, self.feature_lengths['targets']), dtype=np.int32
+      )
+      new_tokens[:, : prompt_length - num_cached] = cache_tokens[
+          :, num_cached:
+      ]
+      cache = self._partitioned_extend_cache_fn(
+          params,
+          entry.cache,
+          jnp.asarray(new_tokens),
+          jnp.array(prompt_length - num_cached, dtype=jnp.int32),
+      )
+      initial_index = jnp.full((self.batch_size,), prompt_length, jnp.int32)
+      if num_cached == prompt_length:
+        return cache, initial_index
+    else:
+      cache, initial_index = self._partitioned_prefill_fn(
+          params, self._pad_prompt(decoder_prompt)
+      )
+
+    entries = self._decoder_caches.setdefault(cache_key, [])
+    entries.append(_DecoderCache(tokens=cache_tokens, cache=cache))
+    del entries[:-_MAX_DECODER_CACHES_PER_KEY]
+    return cache, initial_index
+
+  def clear_decoder_cache(self, cache_key: str) -> None:
+    """Drops the decoder caches kept for `cache_key`."""
+    self._decoder_caches.pop(cache_key, None)
 
   def _infer(self, batch, decoder_params, rng):
-    preds, unused_scores = self._compiled_infer_fn(
+    shape = batch['decoder_input_tokens'].shape
+    if shape == (self.batch_size, self.feature_lengths['targets']):
+      compiled_infer_fn = self._compiled_infer_fn
+    else:
+      if shape not in self._compiled_infer_fns:
+        logging.warning('Compiling inference for uncompiled shape %s', shape)
+        self._compile_infer_fn(*shape)
+      compiled_infer_fn = self._compiled_infer_fns[shape]
+    start_time = time.perf_counter()
+    preds, unused_scores = compiled_infer_fn(
         self._interactive_model.train_state.params,
         batch,
         {**self._default_decoder_params, **decoder_params},
         rng,
     )
+    preds = jax.block_until_ready(preds)
+    elapsed_ms = 1000 * (time.perf_counter() - start_time)
+    latency = self._inference_ms[shape]
+    latency[0] += 1
+    latency[1] += elapsed_ms
+    latency[2] = max(latency[2], elapsed_ms)
     return preds
 
   def __call__(
@@ -212,6 +617,7 @@ class MusicTransformerInferenceModel:
       decoder_prompt: Array,
       seed: Optional[int] = None,
       decode_rng: Optional[Array] = None,
+      cache_key: Optional[str] = None,
       **decoder_params: Mapping[str, Any],
   ) -> jnp.ndarray:
     """Runs inference on the model, with an optional prompt.
@@ -222,6 +628,9 @@ class MusicTransformerInferenceModel:
       decoder_prompt: An optional batch of prompts for the decoder.
       seed: The seed for random sampling.
       decode_rng: The decoder rng that will override the seed.
+      cache_key: If given, the decoder attention cache of the prompt is kept
+        under this key. A later call with the same key whose prompt extends a
+        kept one only runs the new tokens through the decoder.
       **decoder_params: Additional kwargs to pass to model as `decoder_params`.
 
     Returns:
@@ -229,20 +638,6 @@ class MusicTransformerInferenceModel:
     """
     self.initialize()
     prompt_length = decoder_prompt.shape[1]
-    batch = {
-        # Pad beginning with BOS and ending to match compilation length.
-        'decoder_input_tokens': jnp.pad(
-            decoder_prompt,
-            [
-                (0, 0),
-                (1, self.feature_lengths['targets'] - prompt_length - 1),
-            ],
-        ),
-        'decoder_causal_attention': jnp.ones(
-            (self.batch_size, self.feature_lengths['targets']),
-            dtype=np.int32,
-        ),
-    }
     decode_steps = decode_length - prompt_length
     decoder_params = {
         'max_decode_steps': jnp.array(decode_steps, dtype=jnp.int32),
@@ -255,13 +650,42 @@ class MusicTransformerInferenceModel:
         rng = decode_rng
     else:
       rng = random.PRNGKey(seed)
-    preds = self._infer(batch, decoder_params, rng)
+    if cache_key is None:
+      batch = self._pad_prompt(
+          decoder_prompt, self._bucket_length(decode_length + 1)
+      )
+      preds = self._infer(batch, decoder_params, rng)
+    else:
+      # The decoder cache is kept at the full length.
+      cache, initial_index = self._get_decoder_cache(
+          cache_key, np.asarray(decoder_prompt, dtype=np.int32)
+      )
+      batch = self._pad_prompt(decoder_prompt)
+      preds, unused_scores = self._partitioned_decode_from_cache_fn(
+          self._interactive_model.train_state.params,
+          cache,
+          {'decoder_input_tokens': batch['decoder_input_tokens']},
+          initial_index,
+          {**self._default_decoder_params, **decoder_params},
+          rng,
+      )
 
     # Unlike encoder-decoder model, the decoder-only model will remove the
     # prompt (prefix) after generation. So preds = preditions + placeholders.
     return preds[:, :decode_steps]
 
 
+def _request_rng(
+    model: MusicTransformerInferenceModel, request: batching.InferenceRequest
+) -> jax.Array:
+  """Returns the random key of a request, as `__call__` picks it."""
+  if request.seed is not None:
+    return random.PRNGKey(request.seed)
+  if request.decode_rng is not None:
+    return request.decode_rng
+  return random.PRNGKey(model._default_seed)  # pylint: disable=protected-access
+
+
 # Function for selecting the log prob from logits.
 @jax.jit
 def select_sampled(
@@ -485,6 +909,8 @@ class NonCausalMusicTransformerInferenceModel(MusicTransformerInferenceModel):
     if self._compiled_infer_fn:
       return
 
+    start_time = time.perf_counter()
+    self._set_compilation_cache_dir()
     ckpt_path = self._model_dir
     if self._step is not None:
       ckpt_path = f'{ckpt_path}/checkpoint_{self._step}'
@@ -529,8 +955,6 @@ class NonCausalMusicTransformerInferenceModel(MusicTransformerInferenceModel):
         },
     )
 
-    train_state = self._interactive_model.train_state
-
     def _infer_fn(params, batch, decoder_params, rng):
       assert isinstance(
           self._interactive_model.model, t5x.models.EncoderDecoderModel
@@ -558,24 +982,74 @@ class NonCausalMusicTransformerInferenceModel(MusicTransformerInferenceModel):
             partitioner.data_partition_spec,
         ),
     )
-    self._compiled_infer_fn = partitioner.compile(
-        partitioned_infer_fn,
-        train_state.params,
-        {
-            'encoder_input_tokens': jnp.zeros(
-                (self.batch_size, self.feature_lengths['inputs']), np.int32
-            ),
-            'decoder_input_tokens': jnp.ones(
-                (self.batch_size, self.feature_lengths['targets']), np.int32
-            ),
-        },
-        {
-            'max_decode_steps': 2048,  # placeholder,
-            **self._default_decoder_params,
-        },
-        random.PRNGKey(self._default_seed),  # placeholder of rng
-    )
+    self._partitioner = partitioner
+    self._partitioned_infer_fn = partitioned_infer_fn
+    self._compile_buckets([self.batch_size])
     self._initialized = True
+    self._log_initialize_time(start_time)
+
+  def _placeholder_batch(
+      self, batch_size: int, length: int
+  ) -> Mapping[str, jnp.ndarray]:
+    return {
+        'encoder_input_tokens': jnp.zeros(
+            (batch_size, self.feature_lengths['inputs']), np.int32
+        ),
+        'decoder_input_tokens': jnp.ones((batch_size, length), np.int32),
+    }
+
+  def infer_requests(
+      self,
+      requests: Sequence[batching.InferenceRequest],
+      batch_size: int,
+  ) -> List[np.ndarray]:
+    """Runs several single-example requests as one batch.
+
+    See `MusicTransformerInferenceModel.infer_requests`. Each request must
+    have `encoder_input_tokens`.
+
+    Args:
+      requests: The requests, at most `batch_size` of them.
+      batch_size: The batch size to run at.
+
+    Returns:
+      The `[1, length]` predictions of each request, as `__call__` returns.
+    """
+    self.initialize()
+    length = self._bucket_length(
+        max(request.decode_length for request in requests) + 1
+    )
+    encoder_tokens = np.zeros(
+        (batch_size, self.feature_lengths['inputs']), dtype=np.int32
+    )
+    decoder_tokens = np.zeros((batch_size, length), dtype=np.int32)
+    for i, request in enumerate(requests):
+      encoder_tokens[i] = np.reshape(request.encoder_input_tokens, -1)
+      prompt = np.reshape(request.decoder_prompt, -1)
+      # Leave a BOS at the beginning.
+      decoder_tokens[i, 1 : len(prompt) + 1] = prompt
+    # Unused rows repeat the first request.
+    encoder_tokens[len(requests) :] = encoder_tokens[0]
+    decoder_tokens[len(requests) :] = decoder_tokens[0]
+    batch = {
+        'encoder_input_tokens': jnp.asarray(encoder_tokens),
+        'decoder_input_tokens': jnp.asarray(decoder_tokens),
+    }
+    decode_steps = [
+        request.decode_length - request.decoder_prompt.shape[-1]
+        for request in requests
+    ]
+    decoder_params = {
+        'max_decode_steps': jnp.array(max(decode_steps), dtype=jnp.int32),
+        **requests[0].decoder_params,
+    }
+    preds = np.asarray(
+        self._infer(batch, decoder_params, _request_rng(self, requests[0]))
+    )
+    return [
+        preds[i : i + 1, request.decoder_prompt.shape[-1] : steps]
+        for i, (request, steps) in enumerate(zip(requests, decode_steps))
+    ]
 
   def __call__(
       self,
@@ -603,15 +1077,12 @@ class NonCausalMusicTransformerInferenceModel(MusicTransformerInferenceModel):
       raise ValueError('encoder_input_tokens should be provided')
     encoder_input_tokens = decoder_params.pop('encoder_input_tokens')
     prompt_length = decoder_prompt.shape[1]
+    length = self._bucket_length(decode_length + 1)
     batch = {
         'encoder_input_tokens': encoder_input_tokens,
         # Pad beginning with BOS and ending to match compilation length.
         'decoder_input_tokens': jnp.pad(
-            decoder_prompt,
-            [
-                (0, 0),
-                (1, self.feature_lengths['targets'] - prompt_length - 1),
-            ],
+            decoder_prompt, [(0, 0), (1, length - prompt_length - 1)]
         ),
     }
     decode_steps = decode_length - prompt_length
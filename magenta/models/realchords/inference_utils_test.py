@@ -0,0 +1,83 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for inference_utils."""
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import jax
+import jax.numpy as jnp
+from magenta.models.realchords import inference_utils
+import numpy as np
+import seqio
+from t5x import models
+from t5x.examples.decoder_only import network
+
+
+def _tiny_model(inputs_bidirectional_attention):
+  config = network.TransformerConfig(
+      vocab_size=16,
+      dtype='float32',
+      emb_dim=8,
+      num_heads=2,
+      num_layers=2,
+      head_dim=4,
+      mlp_dim=16,
+      mlp_activations=('relu',),
+      dropout_rate=0.0,
+      logits_via_embedding=True,
+  )
+  return models.DecoderOnlyModel(
+      module=network.DecoderWrapper(config),
+      vocabulary=seqio.PassThroughVocabulary(size=16),
+      optimizer_def=None,
+      inputs_bidirectional_attention=inputs_bidirectional_attention,
+  )
+
+
+class PrefillDecoderCacheTest(parameterized.TestCase):
+
+  @parameterized.parameters(False, True)
+  def test_matches_compute_kv_cache(self, inputs_bidirectional_attention):
+    model = _tiny_model(inputs_bidirectional_attention)
+    shape = (2, 8)
+    params = model.get_initial_variables(
+        jax.random.PRNGKey(0),
+        input_shapes={
+            'decoder_input_tokens': shape,
+            'decoder_target_tokens': shape,
+        },
+    )['params']
+    tokens = jnp.array(np.random.RandomState(0).randint(1, 16, size=shape))
+    # Prompts of 3 and 5 tokens after BOS.
+    causal_attention = jnp.array(
+        [[1] * 4 + [0] * 4, [1] * 6 + [0] * 2], dtype=jnp.int32
+    )
+    inputs = tokens * causal_attention
+
+    # pylint: disable=protected-access
+    expected_cache, expected_index = model._compute_kv_cache(
+        params, inputs, causal_attention
+    )
+    cache, index = inference_utils._prefill_decoder_cache(
+        model.module, params, inputs, causal_attention
+    )
+    # pylint: enable=protected-access
+
+    np.testing.assert_array_equal(expected_index, index)
+    jax.tree_util.tree_map(np.testing.assert_allclose, expected_cache, cache)
+
+
+if __name__ == '__main__':
+  absltest.main()
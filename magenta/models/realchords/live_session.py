@@ -0,0 +1,325 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incrementally tokenized state of a live accompaniment session.
+
+The frontend streams note on/off events as the user plays. Rather than
+re-tokenizing the whole history on every request, a `LiveSession` appends new
+note events as they arrive and keeps the interleaved chord/note frame tokens in
+a growing buffer, so building the model prompt only touches the most recent
+context window.
+"""
+
+import collections
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, TypedDict
+
+from magenta.models.realchords import event_codec
+import numpy as np
+
+_INITIAL_CAPACITY_FRAMES = 1024
+
+
+class NoteInfo(TypedDict):
+  pitch: int
+  frame: int
+  on: bool
+
+
+class NoteEventIndexError(ValueError):
+  """Raised when note events do not continue from those already received."""
+
+
+class LiveSession:
+  """Frame tokens of a live session, updated incrementally.
+
+  Frame `i` of the session is stored at positions `2 * i` (chord token) and
+  `2 * i + 1` (note token) of an interleaved buffer, matching the layout of the
+  model prompt. Unwritten frames hold rest tokens.
+
+  Notes are converted to homophony in the same way as
+  `Agent.melody_to_frame_tokens`: playing a new note ends the currently held
+  note, and later notes overwrite earlier ones on shared frames.
+  """
+
+  def __init__(self, codec: event_codec.Codec):
+    """Constructs a `LiveSession`.
+
+    Args:
+      codec: The frame codec used to encode note events.
+    """
+    self._codec = codec
+    self.chord_rest_token = codec.encode_event(
+        event_codec.Event(type="chord", value=0)
+    )
+    self.note_rest_token = codec.encode_event(
+        event_codec.Event(type="note", value=0)
+    )
+    self._tokens = np.empty(2 * _INITIAL_CAPACITY_FRAMES, dtype=np.int32)
+    self._tokens[0::2] = self.chord_rest_token
+    self._tokens[1::2] = self.note_rest_token
+
+    self.num_note_events = 0
+    self.num_chord_frames = 0
+    self.intro_set = False
+    # Held while the session is updated and chords are generated for it, so
+    # overlapping requests for the same session run one at a time.
+    self.lock = threading.Lock()
+    self._cur_pitch = None
+    self._cur_start_frame = None
+
+  def _ensure_capacity(self, num_frames: int) -> None:
+    """Grows the token buffer to hold at least `num_frames` frames."""
+    capacity = len(self._tokens) // 2
+    if num_frames <= capacity:
+      return
+    while capacity < num_frames:
+      capacity *= 2
+    tokens = np.empty(2 * capacity, dtype=np.int32)
+    tokens[: len(self._tokens)] = self._tokens
+    tokens[len(self._tokens) :: 2] = self.chord_rest_token
+    tokens[len(self._tokens) + 1 :: 2] = self.note_rest_token
+    self._tokens = tokens
+
+  def _note_tokens(self, pitch: int) -> tuple[int, int]:
+    """Returns the onset and hold tokens for a pitch."""
+    onset_token = self._codec.encode_event(
+        event_codec.Event(type="note_on", value=pitch)
+    )
+    # +1 to pitch because 0 is used for rest.
+    hold_token = self._codec.encode_event(
+        event_codec.Event(type="note", value=pitch + 1)
+    )
+    return onset_token, hold_token
+
+  def _paint_note(
+      self,
+      tokens: np.ndarray,
+      pitch: int,
+      start_frame: int,
+      end_frame: int,
+      onset: bool = True,
+  ) -> None:
+    """Writes a note into the note positions of interleaved `tokens`."""
+    onset_token, hold_token = self._note_tokens(pitch)
+    tokens[2 * start_frame + 1 : 2 * end_frame + 1 : 2] = hold_token
+    if onset and 2 * start_frame + 1 < len(tokens):
+      tokens[2 * start_frame + 1] = onset_token
+
+  def add_note_events(
+      self, note_events: Sequence[NoteInfo], start_index: int
+  ) -> None:
+    """Appends note on/off events to the session.
+
+    Events that were already received (because the client resent them) are
+    skipped.
+
+    Args:
+      note_events: Note events in the order they were played.
+      start_index: Index of `note_events[0]` among all note events of the
+        session.
+
+    Raises:
+      NoteEventIndexError: If `start_index` is past the number of events
+        received so far, i.e. some events are missing.
+    """
+    if start_index > self.num_note_events:
+      raise NoteEventIndexError(
+          "Expected note events from index %d, got index %d"
+          % (self.num_note_events, start_index)
+      )
+    for event in note_events[self.num_note_events - start_index :]:
+      if event["on"]:
+        # End currently held note if playing new note
+        if self._cur_pitch is not None and self._cur_pitch != event["pitch"]:
+          self._end_note(event["frame"])
+        self._cur_pitch = event["pitch"]
+        self._cur_start_frame = event["frame"]
+      elif self._cur_pitch == event["pitch"]:
+        # End currently held note on release
+        self._end_note(event["frame"])
+        self._cur_pitch = None
+        self._cur_start_frame = None
+      self.num_note_events += 1
+
+  def _end_note(self, end_frame: int) -> None:
+    self._ensure_capacity(max(end_frame, self._cur_start_frame + 1))
+    self._paint_note(
+        self._tokens, self._cur_pitch, self._cur_start_frame, end_frame
+    )
+
+  def _get_window(self, start_frame: int, end_frame: int) -> np.ndarray:
+    """Returns a copy of the interleaved tokens for a range of frames."""
+    self._ensure_capacity(end_frame)
+    window = self._tokens[2 * start_frame : 2 * end_frame].copy()
+    if self._cur_pitch is not None:
+      # A note still being held at `end_frame` ends there. Its onset may be
+      # before the window.
+      self._paint_note(
+          window,
+          self._cur_pitch,
+          max(self._cur_start_frame - start_frame, 0),
+          end_frame - start_frame,
+          onset=self._cur_start_frame >= start_frame,
+      )
+    return window
+
+  def get_note_tokens(self, end_frame: int, start_frame: int = 0) -> List[int]:
+    """Returns the note token for each frame in `[start_frame, end_frame)`."""
+    return self._get_window(start_frame, end_frame)[1::2].tolist()
+
+  def get_chord_tokens(self, start_frame: int, end_frame: int) -> List[int]:
+    """Returns the chord token for each frame in `[start_frame, end_frame)`."""
+    self._ensure_capacity(end_frame)
+    return self._tokens[2 * start_frame : 2 * end_frame : 2].tolist()
+
+  def get_prompt(self, end_frame: int, max_frames: int) -> np.ndarray:
+    """Returns the interleaved chord/note prompt ending at `end_frame`.
+
+    Args:
+      end_frame: The frame to generate from; the prompt covers earlier frames.
+      max_frames: The maximum number of frames in the prompt. Earlier frames
+        are trimmed.
+
+    Returns:
+      An int32 numpy array of shape `[1, 2 * num_frames]`.
+    """
+    start_frame = max(end_frame - max_frames, 0)
+    return self._get_window(start_frame, end_frame)[np.newaxis]
+
+  def set_chord_tokens(
+      self, start_frame: int, chord_tokens: Sequence[int]
+  ) -> None:
+    """Records chord tokens starting at a frame, as the frontend does.
+
+    Args:
+      start_frame: The frame of `chord_tokens[0]`.
+      chord_tokens: Chord tokens, one per frame. Negative values are treated
+        as rests.
+    """
+    end_frame = start_frame + len(chord_tokens)
+    self._ensure_capacity(end_frame)
+    tokens = np.asarray(chord_tokens, dtype=np.int32)
+    self._tokens[2 * start_frame : 2 * end_frame : 2] = np.where(
+        tokens < 0, self.chord_rest_token, tokens
+    )
+    self.num_chord_frames = max(self.num_chord_frames, end_frame)
+
+  @classmethod
+  def from_history(
+      cls,
+      codec: event_codec.Codec,
+      notes: Sequence[NoteInfo],
+      chord_tokens: Sequence[int],
+      intro_set: bool,
+  ) -> "LiveSession":
+    """Creates a session from a full note and chord history."""
+    session = cls(codec)
+    session.add_note_events(notes, 0)
+    session.set_chord_tokens(0, chord_tokens)
+    session.intro_set = intro_set
+    return session
+
+
+class SessionStore:
+  """Holds the live sessions of a server, keyed by id.
+
+  Clients that disconnect without ending their session would otherwise keep it,
+  and any per-session state such as decoder caches, for the life of the
+  server. Sessions are therefore evicted once they have not been used for
+  `ttl_secs`, and the least recently used session is evicted when there are
+  more than `max_sessions`. Eviction happens when sessions are created or
+  looked up.
+  """
+
+  def __init__(
+      self,
+      codec: event_codec.Codec,
+      ttl_secs: Optional[float] = 30 * 60,
+      max_sessions: Optional[int] = 256,
+      on_end: Optional[Callable[[str], None]] = None,
+      clock: Callable[[], float] = time.monotonic,
+  ):
+    """Constructs a `SessionStore`.
+
+    Args:
+      codec: The frame codec used to encode note events.
+      ttl_secs: Seconds after its last use that a session is evicted, or None
+        to keep idle sessions.
+      max_sessions: The maximum number of sessions kept, or None for no limit.
+      on_end: An optional function called with the id of each session that is
+        ended or evicted, e.g. to free its decoder caches.
+      clock: Returns the current time in seconds.
+    """
+    self._codec = codec
+    self._ttl_secs = ttl_secs
+    self._max_sessions = max_sessions
+    self._on_end = on_end
+    self._clock = clock
+    # Session ids in order of last use, mapped to the session and that time.
+    self._sessions = collections.OrderedDict()
+    self._next_id = 0
+    self._lock = threading.Lock()
+
+  def _evict(self) -> List[str]:
+    """Removes expired and excess sessions. Must hold the lock."""
+    evicted = []
+    if self._ttl_secs is not None:
+      expiry = self._clock() - self._ttl_secs
+      while self._sessions:
+        session_id, (_, last_used) = next(iter(self._sessions.items()))
+        if last_used > expiry:
+          break
+        del self._sessions[session_id]
+        evicted.append(session_id)
+    if self._max_sessions is not None:
+      while len(self._sessions) > self._max_sessions:
+        evicted.append(self._sessions.popitem(last=False)[0])
+    return evicted
+
+  def _ended(self, session_ids: Sequence[str]) -> None:
+    if self._on_end is not None:
+      for session_id in session_ids:
+        self._on_end(session_id)
+
+  def __len__(self) -> int:
+    with self._lock:
+      return len(self._sessions)
+
+  def create(self) -> str:
+    """Creates a new session and returns its id."""
+    with self._lock:
+      session_id = str(self._next_id)
+      self._next_id += 1
+      self._sessions[session_id] = (LiveSession(self._codec), self._clock())
+      evicted = self._evict()
+    self._ended(evicted)
+    return session_id
+
+  def get(self, session_id: str) -> Optional[LiveSession]:
+    """Returns a session and marks it as used, or None if there is none."""
+    with self._lock:
+      evicted = self._evict()
+      entry = self._sessions.pop(session_id, None)
+      if entry is not None:
+        self._sessions[session_id] = (entry[0], self._clock())
+    self._ended(evicted)
+    return None if entry is None else entry[0]
+
+  def end(self, session_id: str) -> None:
+    with self._lock:
+      entry = self._sessions.pop(session_id, None)
+    if entry is not None:
+      self._ended([session_id])
@@ -0,0 +1,170 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for live_session."""
+
+from absl.testing import absltest
+from magenta.models.realchords import data
+from magenta.models.realchords import event_codec
+from magenta.models.realchords import frame_codec
+from magenta.models.realchords import live_session
+import numpy as np
+
+
+def _melody_to_frame_tokens(codec, melody_data, end_frame):
+  """Tokenizes the full history, as `Agent.melody_to_frame_tokens` does."""
+  cur_pitch = None
+  cur_start_step = None
+  notes = []
+  for event in melody_data:
+    if event['on']:
+      if cur_pitch is not None and cur_pitch != event['pitch']:
+        notes.append(data.Note(cur_pitch, cur_start_step, event['frame']))
+      cur_pitch = event['pitch']
+      cur_start_step = event['frame']
+    elif cur_pitch == event['pitch']:
+      notes.append(data.Note(cur_pitch, cur_start_step, event['frame']))
+      cur_pitch = None
+      cur_start_step = None
+  if cur_pitch is not None:
+    notes.append(data.Note(cur_pitch, cur_start_step, end_frame))
+  rest_token = codec.encode_event(event_codec.Event(type='note', value=0))
+  if not notes:
+    return [rest_token] * end_frame
+  frames = data.notes_to_frames(notes, downsample_rate=1)
+  tokens = [codec.encode_event(frame) for frame in frames][:end_frame]
+  return tokens + [rest_token] * (end_frame - len(tokens))
+
+
+def _random_note_events(rng, num_events):
+  events = []
+  frame = 0
+  held = []
+  for _ in range(num_events):
+    frame += rng.randint(0, 12)
+    if held and rng.rand() < 0.5:
+      pitch = held.pop(rng.randint(len(held)))
+      events.append({'pitch': pitch, 'frame': frame, 'on': False})
+    else:
+      pitch = 60 + rng.randint(12)
+      held.append(pitch)
+      events.append({'pitch': pitch, 'frame': frame, 'on': True})
+  return events, frame
+
+
+class LiveSessionTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.codec = frame_codec.get_frame_codec()
+
+  def testNoteTokensMatchFullTokenization(self):
+    rng = np.random.RandomState(0)
+    events, last_frame = _random_note_events(rng, 400)
+    session = live_session.LiveSession(self.codec)
+    index = 0
+    while index < len(events):
+      num_events = rng.randint(0, 5)
+      # Resend some events the session already has.
+      resend = min(index, rng.randint(0, 2))
+      session.add_note_events(
+          events[index - resend:index + num_events], index - resend)
+      index += num_events
+      received = events[:index]
+      last_event_frame = received[-1]['frame'] if received else 0
+      end_frame = last_event_frame + rng.randint(1, 3)
+      self.assertEqual(
+          _melody_to_frame_tokens(self.codec, received, end_frame),
+          session.get_note_tokens(end_frame))
+    self.assertEqual(len(events), session.num_note_events)
+    # The token buffer must have grown.
+    self.assertGreater(last_frame, live_session._INITIAL_CAPACITY_FRAMES)
+
+  def testMissingNoteEvents(self):
+    session = live_session.LiveSession(self.codec)
+    session.add_note_events([{'pitch': 60, 'frame': 0, 'on': True}], 0)
+    with self.assertRaises(live_session.NoteEventIndexError):
+      session.add_note_events([{'pitch': 60, 'frame': 2, 'on': False}], 2)
+
+  def testPrompt(self):
+    session = live_session.LiveSession(self.codec)
+    events = [
+        {'pitch': 60, 'frame': 1, 'on': True},
+        {'pitch': 60, 'frame': 3, 'on': False},
+        {'pitch': 62, 'frame': 4, 'on': True},
+    ]
+    session.add_note_events(events, 0)
+    session.set_chord_tokens(2, [5, -1, 7])
+    note_tokens = _melody_to_frame_tokens(self.codec, events, 8)
+    chord_tokens = [session.chord_rest_token] * 8
+    chord_tokens[2] = 5
+    chord_tokens[4] = 7
+
+    prompt = session.get_prompt(8, max_frames=6)
+    self.assertEqual((1, 12), prompt.shape)
+    self.assertEqual(chord_tokens[2:], prompt[0, 0::2].tolist())
+    self.assertEqual(note_tokens[2:], prompt[0, 1::2].tolist())
+    self.assertEqual(5, session.num_chord_frames)
+    self.assertEqual([5, session.chord_rest_token],
+                     session.get_chord_tokens(2, 4))
+
+
+class SessionStoreTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.codec = frame_codec.get_frame_codec()
+    self.now = 0.0
+    self.ended = []
+
+  def _store(self, **kwargs):
+    return live_session.SessionStore(
+        self.codec, on_end=self.ended.append, clock=lambda: self.now,
+        **kwargs)
+
+  def testEvictsIdleSessions(self):
+    store = self._store(ttl_secs=10, max_sessions=None)
+    first = store.create()
+    self.now = 6.0
+    second = store.create()
+    self.now = 9.0
+    # Using a session keeps it alive.
+    self.assertIsNotNone(store.get(first))
+    self.now = 17.0
+    self.assertIsNone(store.get(second))
+    self.assertIsNotNone(store.get(first))
+    self.assertEqual([second], self.ended)
+    self.assertLen(store, 1)
+
+  def testEvictsLeastRecentlyUsedSessions(self):
+    store = self._store(ttl_secs=None, max_sessions=2)
+    first = store.create()
+    second = store.create()
+    store.get(first)
+    third = store.create()
+    self.assertEqual([second], self.ended)
+    self.assertIsNotNone(store.get(first))
+    self.assertIsNotNone(store.get(third))
+
+  def testEnd(self):
+    store = self._store()
+    session_id = store.create()
+    store.end(session_id)
+    store.end(session_id)
+    self.assertIsNone(store.get(session_id))
+    self.assertEqual([session_id], self.ended)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -17,22 +17,30 @@
 @Author Alex Scarlatos (scarlatos@google.com)
 """
 
-from typing import List, Union
+from typing import List, Optional, Union
 
 from absl import logging
 import jax.numpy as jnp
+from magenta.models.realchords import batching
 from magenta.models.realchords import inference_utils
 from magenta.models.realchords import sequence_utils
 import numpy as np
 
 NON_CAUSAL_CHORD_MODEL_PATH = 'realchords_opensource_checkpoint/offline'
 PRETRAIN_MODEL_STEP = 50_000
+# Decode lengths (frames) to compile the model for.
+LENGTH_BUCKETS = (64, 128)
 
 
 class NonCausalModel:
   """Interface for interacting with non-causal model."""
 
-  def __init__(self):
+  def __init__(
+      self,
+      batch_requests: bool = False,
+      max_batch_wait_ms: float = 5.0,
+      compilation_cache_dir: Optional[str] = None,
+  ):
     self.model = inference_utils.NonCausalMusicTransformerInferenceModel(
         NON_CAUSAL_CHORD_MODEL_PATH,
         'realchords_opensource_gin/base_model_non_causal.gin',
@@ -42,7 +50,14 @@ class NonCausalModel:
         additional_gin_path=[
             'realchords_opensource_gin/base_model_non_causal.gin'
         ],
+        length_buckets=LENGTH_BUCKETS,
+        compilation_cache_dir=compilation_cache_dir,
     )
+    self.batcher = None
+    if batch_requests:
+      self.batcher = batching.MicroBatcher(
+          self.model, max_wait_ms=max_batch_wait_ms
+      )
 
   def get_output_tokens(
       self,
@@ -67,7 +82,8 @@ class NonCausalModel:
     )
     input_tokens = sequence_utils.add_eos(input_tokens)
     logging.info('input_tokens: %s', input_tokens)
-    output_tokens = self.model(
+    model = self.model if self.batcher is None else self.batcher
+    output_tokens = model(
         decoder_prompt=jnp.zeros([1, 0], dtype=np.int32),
         decode_length=decode_len,
         encoder_input_tokens=input_tokens,
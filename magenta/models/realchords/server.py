@@ -25,8 +25,36 @@ from absl import flags
 import flask
 
 from magenta.models.realchords import agent_interface
+from magenta.models.realchords import live_session
 
 PORT = flags.DEFINE_integer("port", 8080, "Port to listen on.")
+BATCH_REQUESTS = flags.DEFINE_bool(
+    "batch_requests",
+    False,
+    "Whether to batch concurrent model requests, e.g. from several performers.",
+)
+MAX_BATCH_WAIT_MS = flags.DEFINE_float(
+    "max_batch_wait_ms",
+    5.0,
+    "The longest time a request waits for others to batch with.",
+)
+COMPILATION_CACHE_DIR = flags.DEFINE_string(
+    "compilation_cache_dir",
+    None,
+    "Optional directory to persist compiled model functions in.",
+)
+SESSION_TTL_SECS = flags.DEFINE_float(
+    "session_ttl_secs",
+    30 * 60,
+    "Seconds after its last request that a live session and its decoder "
+    "caches are freed.",
+)
+MAX_SESSIONS = flags.DEFINE_integer(
+    "max_sessions",
+    256,
+    "The maximum number of live sessions kept. The least recently used "
+    "session is freed first.",
+)
 
 app = flask.Flask(__name__, static_url_path="", static_folder="frontend")
 
@@ -46,11 +74,81 @@ def get_models() -> str:
   return json.dumps(agent.get_models())
 
 
+@app.get("/metrics")
+def get_metrics() -> str:
+  """Get model latencies, and request queue depth and batch fill."""
+  assert agent is not None
+  return json.dumps({
+      "latency": agent.get_latency_report(),
+      "batching": agent.get_batching_metrics(),
+  })
+
+
+@app.post("/session")
+def create_session() -> str:
+  """Create a live session that keeps its history on the server."""
+  assert agent is not None
+  return json.dumps({"sessionId": agent.create_session()})
+
+
+@app.delete("/session/<session_id>")
+def end_session(session_id: str) -> str:
+  """End a live session."""
+  assert agent is not None
+  agent.end_session(session_id)
+  return json.dumps({})
+
+
 @app.post("/play")
-def play() -> str:
-  """Generate new chords given context."""
+def play():
+  """Generate new chords given context.
+
+  If the payload has a `sessionId`, `notes` only holds the note events played
+  since the previous request, starting at index `noteIndex`. Otherwise `notes`
+  and `chordTokens` hold the full session history.
+
+  Returns:
+    JSON with the new chords, or an error and status code if the session is
+    unknown (404) or note events are missing (409). For the latter the client
+    should resend note events from `numNoteEvents`.
+  """
   assert agent is not None
   payload = flask.request.get_json()
+  if "sessionId" in payload:
+    session = agent.sessions.get(payload["sessionId"])
+    if session is None:
+      return json.dumps({"error": "Unknown session"}), 404
+    try:
+      new_chords, new_chord_tokens, intro_chord_tokens, timing = (
+          agent.generate_live_session(
+              payload["sessionId"],
+              payload["model"],
+              payload["notes"],
+              payload["noteIndex"],
+              payload["frame"],
+              payload["lookahead"],
+              payload["commitahead"],
+              float(payload["temperature"]),
+              payload["silenceTill"],
+          )
+      )
+    except live_session.NoteEventIndexError as e:
+      return json.dumps({
+          "error": str(e),
+          "numNoteEvents": session.num_note_events,
+      }), 409
+    return json.dumps({
+        "newChords": new_chords,
+        "newChordTokens": new_chord_tokens,
+        "introChordTokens": intro_chord_tokens,
+        "frame": payload["frame"],
+        "timing": {
+            "tokenizeMs": timing["tokenize_ms"],
+            "inferenceMs": timing["inference_ms"],
+            "totalMs": timing["total_ms"],
+        },
+    })
+
   new_chords, new_chord_tokens, intro_chord_tokens = agent.generate_live(
       payload["model"],
       payload["notes"],
@@ -72,7 +170,13 @@ def play() -> str:
 
 def main(_: list[str]) -> None:
   global agent
-  agent = agent_interface.Agent()
+  agent = agent_interface.Agent(
+      batch_requests=BATCH_REQUESTS.value,
+      max_batch_wait_ms=MAX_BATCH_WAIT_MS.value,
+      compilation_cache_dir=COMPILATION_CACHE_DIR.value,
+      session_ttl_secs=SESSION_TTL_SECS.value,
+      max_sessions=MAX_SESSIONS.value,
+  )
 
   # TODO(alexscarlatos): start the server
 
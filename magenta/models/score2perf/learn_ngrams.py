@@ -0,0 +1,100 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Learns a performance event n-gram vocabulary from a Score2Perf dataset.
+
+Reads encoded performances from the TFRecord files of a Score2Perf problem
+generated without n-grams, and writes the n-grams that would save the most
+tokens, one per line. The result can be loaded with
+`ngram_tokenizer.read_ngrams` and passed as the `ngrams` argument of
+`MidiPerformanceEncoder`.
+
+Example usage:
+
+  python -m magenta.models.score2perf.learn_ngrams \
+    --input_pattern=/tmp/datagen/score2perf_maestro_language_uncropped_aug-train* \
+    --output_file=/tmp/ngrams.txt \
+    --num_ngrams=1000
+"""
+
+from absl import app
+from absl import flags
+from absl import logging
+from magenta.models.score2perf import music_encoders
+from magenta.models.score2perf import ngram_tokenizer
+from magenta.models.score2perf import score2perf
+import tensorflow.compat.v1 as tf
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    'input_pattern', None,
+    'Glob pattern of TFRecord files of tf.train.Example protos.')
+flags.DEFINE_string(
+    'feature', 'targets',
+    'Name of the int64 feature holding the encoded performance.')
+flags.DEFINE_string(
+    'output_file', None,
+    'File to write the n-grams to.')
+flags.DEFINE_integer(
+    'num_ngrams', 1000,
+    'Maximum number of n-grams to learn.')
+flags.DEFINE_integer(
+    'max_length', 4,
+    'Maximum length of the learned n-grams.')
+flags.DEFINE_integer(
+    'min_count', 2,
+    'Minimum number of occurrences of a learned n-gram.')
+
+
+def read_performances(input_pattern, feature):
+  """Yields the encoded performances in the matching TFRecord files."""
+  for path in tf.io.gfile.glob(input_pattern):
+    for record in tf.python_io.tf_record_iterator(path):
+      example = tf.train.Example.FromString(record)
+      yield example.features.feature[feature].int64_list.value
+
+
+def main(unused_argv):
+  logging.set_verbosity(logging.INFO)
+  if not FLAGS.input_pattern:
+    raise ValueError('--input_pattern is required.')
+  if not FLAGS.output_file:
+    raise ValueError('--output_file is required.')
+
+  encoder = music_encoders.MidiPerformanceEncoder(
+      steps_per_second=score2perf.STEPS_PER_SECOND,
+      num_velocity_bins=score2perf.NUM_VELOCITY_BINS,
+      min_pitch=score2perf.MIN_PITCH,
+      max_pitch=score2perf.MAX_PITCH)
+  performances = list(read_performances(FLAGS.input_pattern, FLAGS.feature))
+  logging.info('Read %d performances.', len(performances))
+
+  ngrams = ngram_tokenizer.learn_ngrams(
+      performances,
+      vocab_size=encoder.unigram_vocab_size,
+      num_ngrams=FLAGS.num_ngrams,
+      max_length=FLAGS.max_length,
+      min_count=FLAGS.min_count,
+      min_token=encoder.num_reserved_ids)
+  ngram_tokenizer.write_ngrams(ngrams, FLAGS.output_file)
+  logging.info('Wrote %d n-grams to %s.', len(ngrams), FLAGS.output_file)
+
+
+def console_entry_point():
+  app.run(main)
+
+
+if __name__ == '__main__':
+  console_entry_point()
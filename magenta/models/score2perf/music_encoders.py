@@ -20,11 +20,10 @@ from __future__ import print_function
 
 import tempfile
 
+from magenta.models.score2perf import ngram_tokenizer
 import note_seq
 from note_seq import performance_lib
 
-import pygtrie
-
 from tensor2tensor.data_generators import text_encoder
 
 CHORD_SYMBOL = note_seq.NoteSequence.TextAnnotation.CHORD_SYMBOL
@@ -63,7 +62,7 @@ class MidiPerformanceEncoder(object):
 
     Raises:
       ValueError: If any n-gram has length less than 2, or contains one of the
-          reserved IDs.
+          reserved IDs or an ID outside the performance event vocabulary.
     """
     self._steps_per_second = steps_per_second
     self._num_velocity_bins = num_velocity_bins
@@ -82,19 +81,21 @@ class MidiPerformanceEncoder(object):
         min_pitch=min_pitch,
         max_pitch=max_pitch)
 
-    # Create a trie mapping n-grams to new indices.
-    ngram_ids = range(self.unigram_vocab_size,
-                      self.unigram_vocab_size + len(self._ngrams))
-    self._ngrams_trie = pygtrie.Trie(zip(self._ngrams, ngram_ids))
-
-    # Also add all unigrams to the trie.
-    self._ngrams_trie.update(zip([(i,) for i in range(self.unigram_vocab_size)],
-                                 range(self.unigram_vocab_size)))
+    # Compile the n-grams into a tokenizer that maps them to new indices.
+    self._tokenizer = ngram_tokenizer.NGramTokenizer(
+        self._ngrams, self.unigram_vocab_size)
 
   @property
   def num_reserved_ids(self):
     return text_encoder.NUM_RESERVED_TOKENS
 
+  def _performance_event_ids(self, ns):
+    performance = note_seq.Performance(
+        note_seq.quantize_note_sequence_absolute(ns, self._steps_per_second),
+        num_velocity_bins=self._num_velocity_bins)
+    return [self._encoding.encode_event(event) + self.num_reserved_ids
+            for event in performance]
+
   def encode_note_sequence(self, ns):
     """Transform a NoteSequence into a list of performance event indices.
 
@@ -104,31 +105,30 @@ class MidiPerformanceEncoder(object):
     Returns:
       ids: List of performance event indices.
     """
-    performance = note_seq.Performance(
-        note_seq.quantize_note_sequence_absolute(ns, self._steps_per_second),
-        num_velocity_bins=self._num_velocity_bins)
+    return self.encode_note_sequences([ns])[0]
 
-    event_ids = [self._encoding.encode_event(event) + self.num_reserved_ids
-                 for event in performance]
+  def encode_note_sequences(self, note_sequences):
+    """Transform NoteSequences into lists of performance event indices.
 
+    N-grams in all of the performances are replaced in a single pass, which is
+    faster than encoding the NoteSequences one at a time.
+
+    Args:
+      note_sequences: List of NoteSequence protos containing the performances
+          to encode.
+
+    Returns:
+      List with a list of performance event indices for each NoteSequence.
+    """
     # Greedily encode performance event n-grams as new indices.
-    ids = []
-    j = 0
-    while j < len(event_ids):
-      ngram = ()
-      for i in range(j, len(event_ids)):
-        ngram += (event_ids[i],)
-        if self._ngrams_trie.has_key(ngram):
-          best_ngram = ngram
-        if not self._ngrams_trie.has_subtrie(ngram):
-          break
-      ids.append(self._ngrams_trie[best_ngram])
-      j += len(best_ngram)
+    encoded = self._tokenizer.tokenize_batch(
+        [self._performance_event_ids(ns) for ns in note_sequences])
 
     if self._add_eos:
-      ids.append(text_encoder.EOS_ID)
+      for ids in encoded:
+        ids.append(text_encoder.EOS_ID)
 
-    return ids
+    return encoded
 
   def encode(self, s):
     """Transform a MIDI filename into a list of performance event indices.
@@ -122,6 +122,27 @@ class MidiPerformanceEncoderTest(tf.test.TestCase):
 
     self.assertEqual(expected_ids, ids)
 
+  def testEncodeNoteSequencesNGrams(self):
+    encoder = music_encoders.MidiPerformanceEncoder(
+        steps_per_second=100, num_velocity_bins=32, min_pitch=21, max_pitch=108,
+        add_eos=True, ngrams=[(277, 129)])
+
+    ns1 = note_seq.NoteSequence()
+    testing_lib.add_track_to_sequence(ns1, 0, [(60, 97, 0.0, 1.0)])
+    ns2 = note_seq.NoteSequence()
+    testing_lib.add_track_to_sequence(ns2, 0, [(64, 97, 0.0, 1.0)])
+    ids = encoder.encode_note_sequences([ns1, note_seq.NoteSequence(), ns2])
+
+    expected_ids = [
+        [302, 41, 310, 1],       # VELOCITY(25), NOTE-ON(60),
+                                 # TIME-SHIFT(100) NOTE-OFF(60), EOS
+        [1],                     # EOS
+        [302, 45, 277, 133, 1],  # VELOCITY(25), NOTE-ON(64), TIME-SHIFT(100),
+                                 # NOTE-OFF(64), EOS
+    ]
+
+    self.assertEqual(expected_ids, ids)
+
   def testEncode(self):
     encoder = music_encoders.MidiPerformanceEncoder(
         steps_per_second=100, num_velocity_bins=32, min_pitch=21, max_pitch=108,
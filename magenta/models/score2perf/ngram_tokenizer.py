@@ -0,0 +1,243 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Greedy n-gram tokenization of performance event indices."""
+
+import numpy as np
+
+
+class NGramTokenizer(object):
+  """Replaces n-grams of tokens with new ids by greedy longest match.
+
+  Tokens in `[0, vocab_size)` map to themselves, and the i-th n-gram maps to
+  `vocab_size + i`. Starting from the beginning of a sequence, the longest
+  n-gram (or the single token) at the current position is replaced, and
+  tokenization continues after it.
+
+  The n-grams are compiled into a trie automaton stored as numpy arrays: edges
+  are keyed by `state * vocab_size + token` and kept sorted, so a transition is
+  a binary search. The longest match at every position of a sequence is found
+  by stepping all positions through the automaton together, one n-gram length
+  at a time, and only the final greedy walk over the matches is done in Python.
+  """
+
+  def __init__(self, ngrams, vocab_size):
+    """Compiles the n-gram automaton.
+
+    Args:
+      ngrams: List of n-grams (tuples of tokens). If an n-gram is repeated, the
+          id of its last occurrence is used.
+      vocab_size: Number of single tokens; tokens must be in
+          `[0, vocab_size)`.
+
+    Raises:
+      ValueError: If an n-gram has length less than 2 or contains a token
+          outside the vocabulary.
+    """
+    self._vocab_size = vocab_size
+
+    # State 0 is the root; every single token is accepted with its own id.
+    children = {(0, token): token + 1 for token in range(vocab_size)}
+    outputs = [-1] + list(range(vocab_size))
+    max_length = 1
+    for i, ngram in enumerate(ngrams):
+      if len(ngram) < 2:
+        raise ValueError('All n-grams must have length at least 2.')
+      state = 0
+      for token in ngram:
+        if not 0 <= token < vocab_size:
+          raise ValueError('N-gram token %d is outside the vocabulary of '
+                           'size %d.' % (token, vocab_size))
+        key = (state, token)
+        if key not in children:
+          children[key] = len(outputs)
+          outputs.append(-1)
+        state = children[key]
+      outputs[state] = vocab_size + i
+      max_length = max(max_length, len(ngram))
+
+    edges = sorted(
+        (state * vocab_size + token, child)
+        for (state, token), child in children.items())
+    self._edge_keys = np.array([key for key, _ in edges], dtype=np.int64)
+    self._edge_children = np.array([child for _, child in edges],
+                                   dtype=np.int64)
+    self._outputs = np.array(outputs, dtype=np.int64)
+    self._max_length = max_length
+
+  @property
+  def max_length(self):
+    return self._max_length
+
+  def _longest_matches(self, tokens, ends):
+    """Finds the longest match starting at each position.
+
+    Args:
+      tokens: 1D int64 array of tokens.
+      ends: 1D int64 array holding, for each position, the end of the sequence
+          it belongs to. Matches do not extend past it.
+
+    Returns:
+      A tuple of (lengths, ids) arrays with the length and id of the longest
+      match at each position.
+    """
+    num_tokens = len(tokens)
+    lengths = np.zeros(num_tokens, dtype=np.int64)
+    ids = np.zeros(num_tokens, dtype=np.int64)
+    positions = np.arange(num_tokens)
+    states = np.zeros(num_tokens, dtype=np.int64)
+    for length in range(1, self._max_length + 1):
+      in_sequence = positions + length <= ends[positions]
+      positions = positions[in_sequence]
+      states = states[in_sequence]
+      keys = states * self._vocab_size + tokens[positions + length - 1]
+      edges = np.minimum(np.searchsorted(self._edge_keys, keys),
+                         len(self._edge_keys) - 1)
+      has_edge = self._edge_keys[edges] == keys
+      positions = positions[has_edge]
+      states = self._edge_children[edges[has_edge]]
+      if not positions.size:
+        break
+      outputs = self._outputs[states]
+      accepted = outputs >= 0
+      lengths[positions[accepted]] = length
+      ids[positions[accepted]] = outputs[accepted]
+    return lengths, ids
+
+  def tokenize_batch(self, sequences):
+    """Tokenizes many sequences with a single pass over the automaton.
+
+    Args:
+      sequences: List of sequences (lists or 1D arrays) of tokens.
+
+    Returns:
+      A list with a list of ids for each sequence.
+
+    Raises:
+      ValueError: If a token is outside the vocabulary.
+    """
+    sizes = [len(sequence) for sequence in sequences]
+    tokens = np.concatenate(
+        [np.zeros(0, dtype=np.int64)] +
+        [np.asarray(sequence, dtype=np.int64) for sequence in sequences])
+    if tokens.size and (tokens.min() < 0 or
+                        tokens.max() >= self._vocab_size):
+      raise ValueError('Tokens must be in [0, %d).' % self._vocab_size)
+    if self._max_length == 1:
+      return [[int(token) for token in sequence] for sequence in sequences]
+
+    offsets = np.cumsum([0] + sizes)
+    ends = np.repeat(offsets[1:], sizes)
+    lengths, ids = self._longest_matches(tokens, ends)
+    lengths = lengths.tolist()
+    ids = ids.tolist()
+
+    results = []
+    for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+      result = []
+      j = start
+      while j < end:
+        result.append(ids[j])
+        j += lengths[j]
+      results.append(result)
+    return results
+
+  def tokenize(self, tokens):
+    """Tokenizes a single sequence of tokens, returning a list of ids."""
+    return self.tokenize_batch([tokens])[0]
+
+
+def learn_ngrams(sequences, vocab_size, num_ngrams, max_length=4,
+                 min_count=2, min_token=0):
+  """Learns an n-gram vocabulary from a corpus of token sequences.
+
+  Every n-gram of length 2 to `max_length` is counted, and n-grams are ranked
+  by the number of tokens they would save, `count * (length - 1)`, if none of
+  their occurrences overlapped.
+
+  Args:
+    sequences: Iterable of sequences (lists or 1D arrays) of tokens.
+    vocab_size: Number of single tokens; tokens must be less than this.
+    num_ngrams: Maximum number of n-grams to return.
+    max_length: Maximum n-gram length.
+    min_count: Minimum number of occurrences for an n-gram to be used.
+    min_token: N-grams containing tokens below this (e.g. padding or EOS) are
+        not counted.
+
+  Returns:
+    A list of n-grams (tuples of tokens), best first.
+
+  Raises:
+    ValueError: If n-grams of `max_length` tokens cannot be packed into 64-bit
+        keys, or a token is not less than `vocab_size`.
+  """
+  if vocab_size ** max_length > np.iinfo(np.int64).max:
+    raise ValueError('Cannot count %d-grams over a vocabulary of size %d.' %
+                     (max_length, vocab_size))
+
+  sequences = [np.asarray(sequence, dtype=np.int64) for sequence in sequences]
+  sizes = [len(sequence) for sequence in sequences]
+  tokens = np.concatenate([np.zeros(0, dtype=np.int64)] + sequences)
+  if tokens.size and tokens.max() >= vocab_size:
+    raise ValueError('Tokens must be less than %d.' % vocab_size)
+  ends = np.repeat(np.cumsum(sizes), sizes)
+  # Number of excluded tokens before each position.
+  num_excluded = np.concatenate([[0], np.cumsum(tokens < min_token)])
+
+  all_keys = []
+  all_lengths = []
+  all_counts = []
+  positions = np.arange(len(tokens))
+  keys = tokens.copy()
+  for length in range(2, max_length + 1):
+    in_sequence = positions + length <= ends[positions]
+    positions = positions[in_sequence]
+    keys = (keys[in_sequence] * vocab_size +
+            tokens[positions + length - 1])
+    valid = (num_excluded[positions + length] == num_excluded[positions])
+    unique_keys, counts = np.unique(keys[valid], return_counts=True)
+    frequent = counts >= min_count
+    all_keys.append(unique_keys[frequent])
+    all_counts.append(counts[frequent])
+    all_lengths.append(np.full(np.count_nonzero(frequent), length))
+
+  all_keys = np.concatenate([np.zeros(0, dtype=np.int64)] + all_keys)
+  all_lengths = np.concatenate([np.zeros(0, dtype=np.int64)] + all_lengths)
+  all_counts = np.concatenate([np.zeros(0, dtype=np.int64)] + all_counts)
+  # Best savings first; ties go to shorter n-grams, then smaller keys.
+  order = np.lexsort((all_keys, all_lengths, -all_counts * (all_lengths - 1)))
+
+  ngrams = []
+  for key, length in zip(all_keys[order[:num_ngrams]].tolist(),
+                         all_lengths[order[:num_ngrams]].tolist()):
+    ngram = []
+    for _ in range(length):
+      key, token = divmod(key, vocab_size)
+      ngram.append(token)
+    ngrams.append(tuple(reversed(ngram)))
+  return ngrams
+
+
+def write_ngrams(ngrams, path):
+  """Writes n-grams to a text file, one space-separated n-gram per line."""
+  with open(path, 'w') as f:
+    for ngram in ngrams:
+      f.write(' '.join(str(token) for token in ngram) + '\n')
+
+
+def read_ngrams(path):
+  """Reads n-grams written by `write_ngrams`."""
+  with open(path) as f:
+    return [tuple(int(token) for token in line.split())
+            for line in f if line.strip()]
@@ -0,0 +1,107 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for n-gram tokenization."""
+import os
+import tempfile
+
+from magenta.models.score2perf import ngram_tokenizer
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+tf.disable_v2_behavior()
+
+
+def _greedy_tokenize(tokens, ngrams, vocab_size):
+  """Reference tokenizer that tries every n-gram at every position."""
+  ngram_ids = {ngram: vocab_size + i for i, ngram in enumerate(ngrams)}
+  ids = []
+  j = 0
+  while j < len(tokens):
+    best = (tokens[j],), tokens[j]
+    for length in range(2, len(tokens) - j + 1):
+      ngram = tuple(tokens[j:j + length])
+      if ngram in ngram_ids:
+        best = ngram, ngram_ids[ngram]
+    ids.append(best[1])
+    j += len(best[0])
+  return ids
+
+
+class NGramTokenizerTest(tf.test.TestCase):
+
+  def testTokenize(self):
+    tokenizer = ngram_tokenizer.NGramTokenizer(
+        [(1, 2), (1, 2, 3, 4), (2, 3)], vocab_size=5)
+    self.assertEqual(4, tokenizer.max_length)
+    # (1, 2, 3) is only a prefix, so the longest match at 0 is (1, 2).
+    self.assertEqual([5, 3, 0], tokenizer.tokenize([1, 2, 3, 0]))
+    self.assertEqual([6, 4, 7], tokenizer.tokenize([1, 2, 3, 4, 4, 2, 3]))
+    self.assertEqual([], tokenizer.tokenize([]))
+
+  def testTokenizeBatchDoesNotMatchAcrossSequences(self):
+    tokenizer = ngram_tokenizer.NGramTokenizer([(1, 2)], vocab_size=4)
+    self.assertEqual(
+        [[1], [2, 4], [], [3]],
+        tokenizer.tokenize_batch([[1], [2, 1, 2], [], [3]]))
+
+  def testTokenizeMatchesGreedyReference(self):
+    rng = np.random.RandomState(0)
+    vocab_size = 4
+    ngrams = [tuple(rng.randint(vocab_size, size=rng.randint(2, 6)))
+              for _ in range(30)]
+    tokenizer = ngram_tokenizer.NGramTokenizer(ngrams, vocab_size)
+    sequences = [list(rng.randint(vocab_size, size=rng.randint(0, 50)))
+                 for _ in range(20)]
+    self.assertEqual(
+        [_greedy_tokenize(sequence, ngrams, vocab_size)
+         for sequence in sequences],
+        tokenizer.tokenize_batch(sequences))
+
+  def testRepeatedNGramUsesLastId(self):
+    tokenizer = ngram_tokenizer.NGramTokenizer([(0, 1), (0, 1)], vocab_size=2)
+    self.assertEqual([3], tokenizer.tokenize([0, 1]))
+
+  def testShortNGrams(self):
+    with self.assertRaises(ValueError):
+      ngram_tokenizer.NGramTokenizer([(1,)], vocab_size=5)
+    with self.assertRaises(ValueError):
+      ngram_tokenizer.NGramTokenizer([(1,), (2, 3)], vocab_size=5)
+    with self.assertRaises(ValueError):
+      ngram_tokenizer.NGramTokenizer([()], vocab_size=5)
+
+  def testInvalidTokens(self):
+    with self.assertRaises(ValueError):
+      ngram_tokenizer.NGramTokenizer([(1, 5)], vocab_size=5)
+    tokenizer = ngram_tokenizer.NGramTokenizer([], vocab_size=5)
+    with self.assertRaises(ValueError):
+      tokenizer.tokenize([5])
+
+  def testLearnNGrams(self):
+    sequences = [[2, 3, 4, 2, 3, 4, 0], [2, 3, 0, 2, 3], [4, 2]]
+    ngrams = ngram_tokenizer.learn_ngrams(
+        sequences, vocab_size=5, num_ngrams=3, max_length=3, min_token=2)
+    # (2, 3) occurs 4 times, (2, 3, 4) twice and (3, 4) and (4, 2) twice each;
+    # n-grams containing the excluded token 0 are never counted.
+    self.assertEqual([(2, 3), (2, 3, 4), (3, 4)], ngrams)
+
+  def testWriteAndReadNGrams(self):
+    ngrams = [(3, 4), (5, 6, 7)]
+    path = os.path.join(tempfile.mkdtemp(), 'ngrams.txt')
+    ngram_tokenizer.write_ngrams(ngrams, path)
+    self.assertEqual(ngrams, ngram_tokenizer.read_ngrams(path))
+
+
+if __name__ == '__main__':
+  tf.test.main()
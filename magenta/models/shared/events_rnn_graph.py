@@ -65,6 +65,69 @@ def make_rnn_cell(rnn_layer_sizes,
   return cell
 
 
+def _sample_with_temperature(logits, temperature):
+  """Samples a class index for each row of logits.
+
+  Args:
+    logits: A float32 tensor of unnormalized log-probabilities, sized
+        `[batch_size, num_classes]`.
+    temperature: A float32 scalar tensor by which to divide the logits before
+        computing the softmax.
+
+  Returns:
+    sample: An int64 tensor with the sampled class index for each row, sized
+        `[batch_size]`.
+    log_prob: A float32 tensor with the log-probability of each sampled class
+        under the softmax with temperature, sized `[batch_size]`.
+  """
+  log_softmax = tf.nn.log_softmax(logits / temperature)
+  sample = tf.squeeze(tf.random.categorical(log_softmax, 1), axis=1)
+  log_prob = tf.gather(log_softmax, sample, axis=1, batch_dims=1)
+  return sample, log_prob
+
+
+def _get_unrolled_inputs_fn(encoder_decoder):
+  """Returns a function that encodes sampled classes as the next model inputs.
+
+  Generating several steps inside the graph requires computing the model input
+  for each step from the previously sampled class index. This is only possible
+  for encoder/decoders whose input is a one-hot (or index) encoding of the
+  previous class, optionally concatenated with a control input.
+
+  Args:
+    encoder_decoder: The EventSequenceEncoderDecoder or
+        ConditionalEventSequenceEncoderDecoder used by the model.
+
+  Returns:
+    A function that takes an int64 tensor of sampled class indices, sized
+    `[batch_size]`, and an optional float32 tensor of control inputs, sized
+    `[batch_size, control_input_size]`, and returns the float32 expanded model
+    inputs, sized `[batch_size, input_depth]`. Returns None if the
+    encoder/decoder is not supported.
+  """
+  if isinstance(encoder_decoder,
+                note_seq.ConditionalEventSequenceEncoderDecoder):
+    target_encoder_decoder = encoder_decoder._target_encoder_decoder  # pylint:disable=protected-access
+    if type(target_encoder_decoder) is not (  # pylint:disable=unidiomatic-typecheck
+        note_seq.OneHotEventSequenceEncoderDecoder):
+      return None
+    num_classes = encoder_decoder.num_classes
+    return lambda sample, control_inputs: tf.concat(
+        [control_inputs, tf.one_hot(sample, num_classes)], axis=1)
+  elif type(encoder_decoder) is (  # pylint:disable=unidiomatic-typecheck
+      note_seq.OneHotEventSequenceEncoderDecoder):
+    num_classes = encoder_decoder.num_classes
+    return lambda sample, unused_control_inputs: tf.one_hot(
+        sample, num_classes)
+  elif type(encoder_decoder) is (  # pylint:disable=unidiomatic-typecheck
+      note_seq.OneHotIndexEventSequenceEncoderDecoder):
+    input_depth = encoder_decoder.input_depth
+    return lambda sample, unused_control_inputs: tf.one_hot(
+        sample, input_depth)
+  else:
+    return None
+
+
 def get_build_graph_fn(mode, config, sequence_example_file_paths=None):
   """Returns a function that builds the TensorFlow graph.
 
@@ -264,9 +327,74 @@ def get_build_graph_fn(mode, config, sequence_example_file_paths=None):
           sm = tf.reshape(sm, [hparams.batch_size, -1, num_classes[i]])
           softmax.append(sm)
 
+      # Also sample the next event for each sequence in the graph, so that
+      # generation only needs to fetch the chosen class indices and their
+      # log-probabilities rather than the full softmax.
+      last_logits = tf.reshape(
+          logits_flat, [hparams.batch_size, -1, num_logits])[:, -1, :]
+      if isinstance(num_classes, numbers.Number):
+        sample, log_prob = _sample_with_temperature(last_logits, temperature)
+      else:
+        samples = []
+        log_probs = []
+        for i in range(len(num_classes)):
+          sub_sample, sub_log_prob = _sample_with_temperature(
+              last_logits[:, logits_offsets[i]:logits_offsets[i + 1]],
+              temperature)
+          samples.append(sub_sample)
+          log_probs.append(sub_log_prob)
+        sample = tf.stack(samples, axis=1)
+        log_prob = tf.add_n(log_probs)
+
       tf.add_to_collection('inputs', inputs)
       tf.add_to_collection('temperature', temperature)
       tf.add_to_collection('softmax', softmax)
+      tf.add_to_collection('sample', sample)
+      tf.add_to_collection('log_prob', log_prob)
+
+      unrolled_inputs_fn = _get_unrolled_inputs_fn(encoder_decoder)
+      if unrolled_inputs_fn is not None:
+        # Continue generating from the final state for `num_unrolled_steps`
+        # steps in total inside a while loop, feeding each sampled class back
+        # in as the next input. Control inputs, if any, are held fixed for all
+        # steps.
+        num_unrolled_steps = tf.placeholder(tf.int32, [])
+        if isinstance(encoder_decoder,
+                      note_seq.ConditionalEventSequenceEncoderDecoder):
+          control_inputs = tf.placeholder(
+              tf.float32, [hparams.batch_size, input_size - num_classes])
+          tf.add_to_collection('unrolled_control_inputs', control_inputs)
+        else:
+          control_inputs = None
+
+        def unrolled_step(i, prev_sample, state, samples_ta, log_probs_ta):
+          step_outputs, state = cell(
+              unrolled_inputs_fn(prev_sample, control_inputs), state)
+          # Reuse the output projection variables from the step above.
+          step_logits = tf_slim.layers.linear(
+              step_outputs, num_logits, scope='fully_connected', reuse=True)
+          step_sample, step_log_prob = _sample_with_temperature(
+              step_logits, temperature)
+          return (i + 1, step_sample, state,
+                  samples_ta.write(i, step_sample),
+                  log_probs_ta.write(i, step_log_prob))
+
+        samples_ta = tf.TensorArray(tf.int64, size=num_unrolled_steps)
+        log_probs_ta = tf.TensorArray(tf.float32, size=num_unrolled_steps)
+        _, _, unrolled_final_state, samples_ta, log_probs_ta = tf.while_loop(
+            lambda i, *unused_args: i < num_unrolled_steps,
+            unrolled_step,
+            [1, sample, final_state, samples_ta.write(0, sample),
+             log_probs_ta.write(0, log_prob)],
+            swap_memory=True)
+
+        tf.add_to_collection('num_unrolled_steps', num_unrolled_steps)
+        tf.add_to_collection('unrolled_samples',
+                             tf.transpose(samples_ta.stack()))
+        tf.add_to_collection('unrolled_log_probs',
+                             tf.transpose(log_probs_ta.stack()))
+        for state in tf.nest.flatten(unrolled_final_state):
+          tf.add_to_collection('unrolled_final_state', state)
       # Flatten state tuples for metagraph compatibility.
       for state in tf.nest.flatten(initial_state):
         tf.add_to_collection('initial_state', state)
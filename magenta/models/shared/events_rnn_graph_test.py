@@ -21,6 +21,7 @@ from magenta.models.shared import events_rnn_graph
 from magenta.models.shared import events_rnn_model
 import note_seq
 from note_seq import testing_lib
+import numpy as np
 import tensorflow.compat.v1 as tf
 
 tf.disable_v2_behavior()
@@ -59,6 +60,70 @@ class EventSequenceRNNGraphTest(tf.test.TestCase):
     with tf.Graph().as_default():
       events_rnn_graph.get_build_graph_fn('generate', self.config)()
 
+  def testGenerateGraphSampling(self):
+    self.config.hparams.batch_size = 4
+    with tf.Graph().as_default():
+      events_rnn_graph.get_build_graph_fn('generate', self.config)()
+      inputs = tf.get_collection('inputs')[0]
+      temperature = tf.get_collection('temperature')[0]
+      softmax = tf.get_collection('softmax')[0]
+      sample = tf.get_collection('sample')[0]
+      log_prob = tf.get_collection('log_prob')[0]
+      with self.session() as sess:
+        sess.run(tf.global_variables_initializer())
+        input_values = np.random.rand(
+            4, 3, self.config.encoder_decoder.input_size)
+        softmax_value, sample_value, log_prob_value = sess.run(
+            [softmax, sample, log_prob],
+            {inputs: input_values, temperature: 0.5})
+
+    self.assertEqual((4,), sample_value.shape)
+    self.assertTrue(np.all(sample_value >= 0))
+    self.assertTrue(np.all(sample_value < 12))
+    self.assertAllClose(
+        np.log(softmax_value[np.arange(4), -1, sample_value]), log_prob_value,
+        rtol=1e-5)
+
+  def testGenerateGraphUnrolled(self):
+    self.config.hparams.batch_size = 4
+    self.config.hparams.attn_length = 3
+    num_steps = 5
+    with tf.Graph().as_default():
+      events_rnn_graph.get_build_graph_fn('generate', self.config)()
+      inputs = tf.get_collection('inputs')[0]
+      temperature = tf.get_collection('temperature')[0]
+      initial_state = tuple(tf.get_collection('initial_state'))
+      final_state = tf.get_collection('final_state')
+      softmax = tf.get_collection('softmax')[0]
+      num_unrolled_steps = tf.get_collection('num_unrolled_steps')[0]
+      samples = tf.get_collection('unrolled_samples')[0]
+      log_probs = tf.get_collection('unrolled_log_probs')[0]
+      unrolled_final_state = tf.get_collection('unrolled_final_state')
+      with self.session() as sess:
+        sess.run(tf.global_variables_initializer())
+        input_values = np.random.rand(4, 3, 12)
+        samples_value, log_probs_value, unrolled_final_state_value = sess.run(
+            [samples, log_probs, unrolled_final_state],
+            {inputs: input_values, temperature: 0.5,
+             num_unrolled_steps: num_steps})
+        self.assertEqual((4, num_steps), samples_value.shape)
+        self.assertEqual((4, num_steps), log_probs_value.shape)
+
+        # Feeding the sampled events back in one step at a time should give
+        # the same log-probabilities and final state.
+        state_value = sess.run(initial_state)
+        for step in range(num_steps):
+          state_value, softmax_value = sess.run(
+              [final_state, softmax],
+              {inputs: input_values, initial_state: tuple(state_value),
+               temperature: 0.5})
+          self.assertAllClose(
+              np.log(softmax_value[np.arange(4), -1, samples_value[:, step]]),
+              log_probs_value[:, step], rtol=1e-4, atol=1e-5)
+          input_values = np.eye(12)[samples_value[:, step:step + 1]]
+        self.assertAllClose(unrolled_final_state_value, state_value,
+                            rtol=1e-4, atol=1e-5)
+
   def testBuildGraphWithAttention(self):
     self.config.hparams.attn_length = 10
     with tf.Graph().as_default():
@@ -18,7 +18,7 @@ import collections
 import copy
 import functools
 
-from magenta.common import beam_search
+from magenta.common import batched_beam_search
 from magenta.common import state_util
 from magenta.contrib import training as contrib_training
 from magenta.models.shared import events_rnn_graph
@@ -34,10 +34,56 @@ ModelState = collections.namedtuple(
     'ModelState', ['inputs', 'rnn_state', 'control_events', 'control_state'])
 
 
+# Model state for all hypotheses of a batched beam search. The event sequences,
+# inputs, control sequences and control states are 1-D numpy object arrays
+# with one entry per hypothesis, and the RNN state is a nested structure of
+# numpy arrays whose first dimension indexes the hypotheses.
+BatchedModelState = collections.namedtuple(
+    'BatchedModelState',
+    ['events', 'inputs', 'rnn_state', 'control_events', 'control_state'])
+
+
 class EventSequenceRnnModelError(Exception):
   pass
 
 
+def _object_array(values):
+  """Returns a 1-D numpy object array holding the given Python objects."""
+  array = np.empty(len(values), dtype=object)
+  for i, value in enumerate(values):
+    array[i] = value
+  return array
+
+
+def _object_scalar(value):
+  """Wraps a Python object in a 0-D numpy object array."""
+  array = np.empty((), dtype=object)
+  array[()] = value
+  return array
+
+
+def _unshare(objects):
+  """Returns a list of the objects, copying any that appear more than once.
+
+  Branching in a batched beam search repeats references to the same mutable
+  objects, which must be copied before they are extended in place.
+
+  Args:
+    objects: A 1-D numpy object array.
+
+  Returns:
+    A list of the objects, in which no object appears twice.
+  """
+  seen = set()
+  result = []
+  for obj in objects:
+    if obj is not None and id(obj) in seen:
+      obj = copy.deepcopy(obj)
+    seen.add(id(obj))
+    result.append(obj)
+  return result
+
+
 def _extend_control_events_default(control_events, events, state):
   """Default function for extending control event sequence.
 
@@ -67,28 +113,61 @@ class EventSequenceRnnModel(model.BaseModel):
   at a later time.
   """
 
-  def __init__(self, config):
+  def __init__(self, config, sample_in_graph=None):
     """Initialize the EventSequenceRnnModel.
 
     Args:
       config: An EventSequenceRnnConfig containing the encoder/decoder and
         HParams to use.
+      sample_in_graph: If True and the generation graph contains sampling ops,
+        each generated event is sampled inside the graph and only its class
+        index and log-probability are fetched, rather than fetching the full
+        softmax and sampling in numpy. In-graph sampling does not use numpy's
+        random state, so it is not reproducible with `np.random.seed`. If None,
+        the `sample_in_graph` hparam of the config is used, which is False by
+        default.
     """
     super(EventSequenceRnnModel, self).__init__()
     self._config = config
+    self._sample_in_graph = sample_in_graph
+    self._collections_graph = None
+    self._collections = {}
 
   def _build_graph_for_generation(self):
     events_rnn_graph.get_build_graph_fn('generate', self._config)()
 
+  def _get_collection(self, name):
+    """Returns a collection from the session graph.
+
+    Collections are looked up once per graph and cached, so the per-step
+    generation methods don't repeatedly search the graph.
+
+    Args:
+      name: The name of the collection.
+
+    Returns:
+      The list of values in the collection, empty if the graph does not
+      contain it.
+    """
+    graph = self._session.graph
+    if graph is not self._collections_graph:
+      self._collections_graph = graph
+      self._collections = {}
+    if name not in self._collections:
+      self._collections[name] = graph.get_collection(name)
+    return self._collections[name]
+
   def _batch_size(self):
     """Extracts the batch size from the graph."""
-    return int(self._session.graph.get_collection('inputs')[0].shape[0])
+    return int(self._get_collection('inputs')[0].shape[0])
 
   def _generate_step_for_batch(self, event_sequences, inputs, initial_state,
                                temperature):
     """Extends a batch of event sequences by a single step each.
 
-    This method modifies the event sequences in place.
+    This method modifies the event sequences in place. When sampling in the
+    graph, a single `session.run` fetches only the final state and the sampled
+    class index and log-probability for each sequence.
 
     Args:
       event_sequences: A list of event sequences, each of which is a Python
@@ -111,11 +190,13 @@ class EventSequenceRnnModel(model.BaseModel):
     """
     assert len(event_sequences) == self._batch_size()
 
-    graph_inputs = self._session.graph.get_collection('inputs')[0]
-    graph_initial_state = self._session.graph.get_collection('initial_state')
-    graph_final_state = self._session.graph.get_collection('final_state')
-    graph_softmax = self._session.graph.get_collection('softmax')[0]
-    graph_temperature = self._session.graph.get_collection('temperature')
+    graph_inputs = self._get_collection('inputs')[0]
+    graph_initial_state = self._get_collection('initial_state')
+    graph_final_state = self._get_collection('final_state')
+    graph_softmax = self._get_collection('softmax')[0]
+    graph_temperature = self._get_collection('temperature')
+    graph_sample = self._get_collection('sample')
+    graph_log_prob = self._get_collection('log_prob')
 
     feed_dict = {graph_inputs: inputs,
                  tuple(graph_initial_state): initial_state}
@@ -123,6 +204,20 @@ class EventSequenceRnnModel(model.BaseModel):
     # placeholder exists in the graph.
     if graph_temperature:
       feed_dict[graph_temperature[0]] = temperature
+
+    # Graphs from older bundles don't contain the sampling ops. A full-length
+    # inputs batch also needs the softmax to evaluate the primer.
+    sample_in_graph = (
+        self._config.hparams.sample_in_graph if self._sample_in_graph is None
+        else self._sample_in_graph)
+    if sample_in_graph and graph_sample and len(inputs[0]) == 1:
+      final_state, sample, log_prob = self._session.run(
+          [graph_final_state, graph_sample[0], graph_log_prob[0]], feed_dict)
+      for events, class_index in zip(event_sequences, sample.tolist()):
+        events.append(self._config.encoder_decoder.class_index_to_event(
+            class_index, events))
+      return final_state, log_prob
+
     final_state, softmax = self._session.run(
         [graph_final_state, graph_softmax], feed_dict)
 
@@ -196,11 +291,6 @@ class EventSequenceRnnModel(model.BaseModel):
       logliks: A list containing the updated log-likelihood for each event
           sequence.
     """
-    # Split the sequences to extend into batches matching the model batch size.
-    batch_size = self._batch_size()
-    num_seqs = len(event_sequences)
-    num_batches = int(np.ceil(num_seqs / float(batch_size)))
-
     # Extract inputs and RNN states from the model states.
     inputs = [model_state.inputs for model_state in model_states]
     initial_states = [model_state.rnn_state for model_state in model_states]
@@ -211,30 +301,146 @@ class EventSequenceRnnModel(model.BaseModel):
     control_states = [
         model_state.control_state for model_state in model_states]
 
-    final_states = []
+    final_states, batch_loglik = self._generate_step_for_batches(
+        event_sequences, inputs, state_util.batch(initial_states), temperature)
+    final_states = state_util.unbatch(final_states, len(event_sequences))
     logliks = np.array(logliks, dtype=np.float32)
+    logliks += batch_loglik
+
+    next_inputs = self._next_inputs(
+        event_sequences, control_sequences, control_states,
+        extend_control_events_callback, modify_events_callback)
+
+    model_states = [ModelState(inputs=inputs, rnn_state=final_state,
+                               control_events=control_events,
+                               control_state=control_state)
+                    for inputs, final_state, control_events, control_state
+                    in zip(next_inputs, final_states,
+                           control_sequences, control_states)]
+
+    return event_sequences, model_states, logliks
+
+  def _generate_step_batched(self, history, states, scores, temperature,
+                             extend_control_events_callback=None,
+                             modify_events_callback=None):
+    """Extends all hypotheses of a batched beam search by a single step each.
+
+    This is the `generate_step_fn` for `batched_beam_search`. Unlike
+    `_generate_step`, RNN states stay batched between steps, and event and
+    control sequences are only copied when branching has made several
+    hypotheses share them.
+
+    Args:
+      history: The `BeamHistory` of the search. Unused, as the event sequence
+          objects needed by the encoder/decoder are kept in `states`.
+      states: A BatchedModelState for the current hypotheses.
+      scores: A 1-D numpy array containing the current log-likelihood of each
+          hypothesis.
+      temperature: The softmax temperature.
+      extend_control_events_callback: A function that extends the control
+          sequence, as in `_generate_step`, or None if not conditioning on
+          control sequences.
+      modify_events_callback: An optional callback for modifying the event list,
+          as in `_generate_step`.
+
+    Returns:
+      events: A 1-D numpy object array with the new event of each hypothesis.
+      states: The updated BatchedModelState.
+      scores: A 1-D numpy array containing the updated log-likelihoods.
+    """
+    del history
+    event_sequences = _unshare(states.events)
+    control_sequences = _unshare(states.control_events)
+    control_states = _unshare(states.control_state)
+
+    final_state, loglik = self._generate_step_for_batches(
+        event_sequences, list(states.inputs), states.rnn_state, temperature)
+    scores = np.array(scores, dtype=np.float32)
+    scores += loglik
+
+    next_inputs = self._next_inputs(
+        event_sequences, control_sequences, control_states,
+        extend_control_events_callback, modify_events_callback)
+
+    states = BatchedModelState(
+        events=_object_array(event_sequences),
+        inputs=_object_array(next_inputs),
+        rnn_state=final_state,
+        control_events=_object_array(control_sequences),
+        control_state=_object_array(control_states))
+    events = _object_array([events[-1] for events in event_sequences])
+    return events, states, scores
+
+  def _generate_step_for_batches(self, event_sequences, inputs, rnn_states,
+                                 temperature):
+    """Extends event sequences by a single step, one model batch at a time.
+
+    Args:
+      event_sequences: A list of event sequences, which are extended in place.
+      inputs: A list of model inputs for each event sequence.
+      rnn_states: A nested structure of numpy arrays holding the RNN state of
+          each event sequence along the first dimension.
+      temperature: The softmax temperature.
+
+    Returns:
+      final_states: A nested structure of numpy arrays holding the final RNN
+          state of each event sequence.
+      loglik: A 1-D numpy array with the log-likelihood of the generated step
+          (and of the inputs, for a full-length inputs batch) for each event
+          sequence.
+    """
+    # Split the sequences to extend into batches matching the model batch size.
+    batch_size = self._batch_size()
+    num_seqs = len(event_sequences)
+    num_batches = int(np.ceil(num_seqs / float(batch_size)))
+
+    final_states = []
+    loglik = np.zeros(num_seqs)
 
     # Add padding to fill the final batch.
     pad_amt = -len(event_sequences) % batch_size
     padded_event_sequences = event_sequences + [
         copy.deepcopy(event_sequences[-1]) for _ in range(pad_amt)]
     padded_inputs = inputs + [inputs[-1]] * pad_amt
-    padded_initial_states = initial_states + [initial_states[-1]] * pad_amt
 
     for b in range(num_batches):
       i, j = b * batch_size, (b + 1) * batch_size
-      pad_amt = max(0, j - num_seqs)
+      num_valid = min(j, num_seqs) - i
       # Generate a single step for one batch of event sequences.
       batch_final_state, batch_loglik = self._generate_step_for_batch(
           padded_event_sequences[i:j],
           padded_inputs[i:j],
-          state_util.batch(padded_initial_states[i:j], batch_size),
+          state_util.gather(rnn_states,
+                            np.minimum(np.arange(i, j), num_seqs - 1)),
           temperature)
-      final_states += state_util.unbatch(
-          batch_final_state, batch_size)[:j - i - pad_amt]
-      logliks[i:j - pad_amt] += batch_loglik[:j - i - pad_amt]
+      final_states.append(tf.nest.map_structure(
+          lambda x, n=num_valid: x[:n], batch_final_state))
+      loglik[i:i + num_valid] = batch_loglik[:num_valid]
 
-    # Construct inputs for next step.
+    final_states = tf.nest.map_structure(
+        lambda *x: np.concatenate(x), *final_states)
+    return final_states, loglik
+
+  def _next_inputs(self, event_sequences, control_sequences, control_states,
+                   extend_control_events_callback, modify_events_callback):
+    """Constructs the model inputs for the step after the latest events.
+
+    Args:
+      event_sequences: A list of event sequences.
+      control_sequences: A list of control sequences, one per event sequence.
+          These are extended in place by `extend_control_events_callback`.
+      control_states: A list of control states, one per event sequence. These
+          are replaced by the states returned by
+          `extend_control_events_callback`.
+      extend_control_events_callback: A function that extends the control
+          sequence, as in `_generate_step`, or None if not conditioning on
+          control sequences.
+      modify_events_callback: An optional callback for modifying the event list,
+          as in `_generate_step`.
+
+    Returns:
+      A list of model inputs, one per event sequence.
+    """
     if extend_control_events_callback is not None:
       # We are conditioning on control sequences.
       for idx in range(len(control_sequences)):
@@ -253,21 +459,101 @@ class EventSequenceRnnModel(model.BaseModel):
       modify_events_callback(
           self._config.encoder_decoder, event_sequences, next_inputs)
 
-    model_states = [ModelState(inputs=inputs, rnn_state=final_state,
-                               control_events=control_events,
-                               control_state=control_state)
-                    for inputs, final_state, control_events, control_state
-                    in zip(next_inputs, final_states,
-                           control_sequences, control_states)]
+    return next_inputs
 
-    return event_sequences, model_states, logliks
+  def _generate_unrolled(self, num_steps, event_sequence, model_state,
+                         temperature, steps_per_run,
+                         extend_control_events_callback=None):
+    """Extends an event sequence, generating several steps per session run.
+
+    Uses the unrolled generation loop in the graph, which samples each event
+    and feeds it back in as the next input without leaving the graph. Control
+    inputs are computed once per run and held fixed for all of its steps.
+
+    Args:
+      num_steps: The integer number of events to generate.
+      event_sequence: The event sequence to extend. This is modified in place.
+      model_state: A ModelState containing the inputs for the first step (which
+          may be a full-length inputs batch), the RNN state, and the control
+          sequence and state, if any.
+      temperature: The softmax temperature.
+      steps_per_run: The maximum integer number of steps to generate per
+          session run.
+      extend_control_events_callback: A function that extends the control
+          sequence, as in `_generate_step`, or None if not conditioning on
+          control sequences.
+
+    Returns:
+      The log-likelihood of the extended event sequence.
+    """
+    batch_size = self._batch_size()
+    encoder_decoder = self._config.encoder_decoder
+
+    graph_inputs = self._get_collection('inputs')[0]
+    graph_initial_state = tuple(self._get_collection('initial_state'))
+    graph_final_state = self._get_collection('unrolled_final_state')
+    graph_temperature = self._get_collection('temperature')[0]
+    graph_num_steps = self._get_collection('num_unrolled_steps')[0]
+    graph_control_inputs = self._get_collection('unrolled_control_inputs')
+    graph_samples = self._get_collection('unrolled_samples')[0]
+    graph_log_probs = self._get_collection('unrolled_log_probs')[0]
+    graph_softmax = self._get_collection('softmax')[0]
+
+    inputs = model_state.inputs
+    rnn_state = model_state.rnn_state
+    control_events = model_state.control_events
+    control_state = model_state.control_state
+    loglik = 0.0
+
+    while num_steps > 0:
+      run_steps = min(steps_per_run, num_steps)
+      # Every sequence in the batch is a copy of the same sequence.
+      feed_dict = {
+          graph_inputs: [inputs] * batch_size,
+          graph_initial_state: state_util.batch([rnn_state] * batch_size),
+          graph_temperature: temperature,
+          graph_num_steps: run_steps,
+      }
+      if graph_control_inputs:
+        # The control input is the beginning of the latest input vector.
+        control_input_size = (
+            encoder_decoder.input_size - encoder_decoder.num_classes)
+        feed_dict[graph_control_inputs[0]] = (
+            [inputs[-1][:control_input_size]] * batch_size)
+      fetches = [graph_final_state, graph_samples, graph_log_probs]
+      if len(inputs) > 1:
+        # Also evaluate the log-likelihood of the primer.
+        final_state, samples, log_probs, softmax = self._session.run(
+            fetches + [graph_softmax], feed_dict)
+        loglik += encoder_decoder.evaluate_log_likelihood(
+            [event_sequence], softmax[:1, :-1])[0]
+      else:
+        final_state, samples, log_probs = self._session.run(fetches, feed_dict)
+
+      for class_index in samples[0].tolist():
+        event_sequence.append(
+            encoder_decoder.class_index_to_event(class_index, event_sequence))
+      loglik += np.sum(log_probs[0])
+      rnn_state = state_util.unbatch(final_state)[0]
+      num_steps -= run_steps
+
+      # Construct inputs for the next run.
+      if extend_control_events_callback is not None:
+        control_state = extend_control_events_callback(
+            control_events, event_sequence, control_state)
+        inputs = encoder_decoder.get_inputs_batch(
+            [control_events], [event_sequence])[0]
+      else:
+        inputs = encoder_decoder.get_inputs_batch([event_sequence])[0]
+
+    return loglik
 
   def _generate_events(self, num_steps, primer_events, temperature=1.0,
                        beam_size=1, branch_factor=1, steps_per_iteration=1,
                        control_events=None, control_state=None,
                        extend_control_events_callback=(
                            _extend_control_events_default),
-                       modify_events_callback=None):
+                       modify_events_callback=None, steps_per_run=1):
     """Generate an event sequence from a primer sequence.
 
     Args:
@@ -302,6 +588,12 @@ class EventSequenceRnnModel(model.BaseModel):
           None, will be called with 3 arguments after every event: the current
           EventSequenceEncoderDecoder, a list of current EventSequences, and a
           list of current encoded event inputs.
+      steps_per_run: An integer, the number of steps to generate inside the
+          graph per session run. Values greater than 1 are only used without
+          beam search or `modify_events_callback`, and when the graph supports
+          unrolled generation. Control sequences are only extended between
+          runs, so changes in the control signal may take effect up to
+          `steps_per_run - 1` steps late.
 
     Returns:
       The generated event sequence (which begins with the provided primer).
@@ -351,7 +643,7 @@ class EventSequenceRnnModel(model.BaseModel):
       modify_events_callback(
           self._config.encoder_decoder, event_sequences, inputs)
 
-    graph_initial_state = self._session.graph.get_collection('initial_state')
+    graph_initial_state = self._get_collection('initial_state')
     initial_states = state_util.unbatch(self._session.run(graph_initial_state))
 
     # Beam search will maintain a state for each sequence consisting of the next
@@ -361,16 +653,40 @@ class EventSequenceRnnModel(model.BaseModel):
         inputs=inputs[0], rnn_state=initial_states[0],
         control_events=control_events, control_state=control_state)
 
+    if steps_per_run > 1:
+      if (beam_size == 1 and branch_factor == 1 and
+          modify_events_callback is None and
+          self._get_collection('unrolled_samples')):
+        loglik = self._generate_unrolled(
+            num_steps - len(primer_events), event_sequences[0],
+            initial_state, temperature, steps_per_run,
+            extend_control_events_callback=
+            extend_control_events_callback
+            if control_events is not None else None)
+        tf.logging.info('Unrolled generation yields sequence with '
+                        'log-likelihood: %f ', loglik)
+        return event_sequences[0]
+      tf.logging.warning(
+          'Unrolled generation is not supported with beam search, event '
+          'modification, or this graph; generating one step per run.')
+
     generate_step_fn = functools.partial(
-        self._generate_step,
+        self._generate_step_batched,
         temperature=temperature,
         extend_control_events_callback=
         extend_control_events_callback if control_events is not None else None,
         modify_events_callback=modify_events_callback)
 
-    events, _, loglik = beam_search(
-        initial_sequence=event_sequences[0],
-        initial_state=initial_state,
+    # The search only tracks the new events; the event sequence objects that
+    # the encoder/decoder extends are carried in the batched model state.
+    _, final_state, loglik = batched_beam_search(
+        initial_sequence=[],
+        initial_state=BatchedModelState(
+            events=_object_scalar(event_sequences[0]),
+            inputs=_object_scalar(initial_state.inputs),
+            rnn_state=initial_state.rnn_state,
+            control_events=_object_scalar(initial_state.control_events),
+            control_state=_object_scalar(initial_state.control_state)),
         generate_step_fn=generate_step_fn,
         num_steps=num_steps - len(primer_events),
         beam_size=beam_size,
@@ -380,7 +696,7 @@ class EventSequenceRnnModel(model.BaseModel):
     tf.logging.info('Beam search yields sequence with log-likelihood: %f ',
                     loglik)
 
-    return events
+    return final_state.events
 
   def _evaluate_batch_log_likelihood(self, event_sequences, inputs,
                                      initial_state):
@@ -399,10 +715,10 @@ class EventSequenceRnnModel(model.BaseModel):
       A Python list containing the log likelihood of each sequence in
       `event_sequences`.
     """
-    graph_inputs = self._session.graph.get_collection('inputs')[0]
-    graph_initial_state = self._session.graph.get_collection('initial_state')
-    graph_softmax = self._session.graph.get_collection('softmax')[0]
-    graph_temperature = self._session.graph.get_collection('temperature')
+    graph_inputs = self._get_collection('inputs')[0]
+    graph_initial_state = self._get_collection('initial_state')
+    graph_softmax = self._get_collection('softmax')[0]
+    graph_temperature = self._get_collection('temperature')
 
     feed_dict = {graph_inputs: inputs,
                  tuple(graph_initial_state): initial_state}
@@ -461,7 +777,7 @@ class EventSequenceRnnModel(model.BaseModel):
       inputs = self._config.encoder_decoder.get_inputs_batch(
           [events[:-1] for events in event_sequences], full_length=True)
 
-    graph_initial_state = self._session.graph.get_collection('initial_state')
+    graph_initial_state = self._get_collection('initial_state')
     initial_state = self._session.run(graph_initial_state)
     offset = 0
     for _ in range(num_full_batches):
@@ -520,7 +836,8 @@ class EventSequenceRnnConfig(object):
         'clip_norm': 3,
         'learning_rate': 0.001,
         'residual_connections': False,
-        'use_cudnn': False
+        'use_cudnn': False,
+        'sample_in_graph': False
     }
     hparams_dict.update(hparams.values())
 
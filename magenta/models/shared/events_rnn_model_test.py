@@ -0,0 +1,99 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for events_rnn_model."""
+
+import copy
+import functools
+
+from magenta.common import beam_search
+from magenta.common import state_util
+from magenta.contrib import training as contrib_training
+from magenta.models.shared import events_rnn_model
+import note_seq
+from note_seq import testing_lib
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+tf.disable_v2_behavior()
+
+# pylint:disable=protected-access
+
+
+class EventSequenceRnnModelTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.config = events_rnn_model.EventSequenceRnnConfig(
+        None,
+        note_seq.OneHotEventSequenceEncoderDecoder(
+            testing_lib.TrivialOneHotEncoding(12)),
+        contrib_training.HParams(
+            batch_size=4,
+            rnn_layer_sizes=[16, 16]))
+
+    self.model = events_rnn_model.EventSequenceRnnModel(self.config)
+    with tf.Graph().as_default():
+      tf.set_random_seed(0)
+      self.model._build_graph_for_generation()
+      self.model._session = tf.Session()
+      self.model._session.run(tf.global_variables_initializer())
+
+  def tearDown(self):
+    self.model.close()
+
+  def _unbatched_beam_search(self, num_steps, primer_events, beam_size,
+                             branch_factor, steps_per_iteration):
+    """Generates events the way the model did before batched beam search."""
+    model = self.model
+    inputs = self.config.encoder_decoder.get_inputs_batch(
+        [primer_events], full_length=True)
+    initial_states = state_util.unbatch(
+        model._session.run(model._get_collection('initial_state')))
+    initial_state = events_rnn_model.ModelState(
+        inputs=inputs[0], rnn_state=initial_states[0], control_events=None,
+        control_state=None)
+    events, _, _ = beam_search(
+        initial_sequence=copy.deepcopy(primer_events),
+        initial_state=initial_state,
+        generate_step_fn=functools.partial(
+            model._generate_step, temperature=1.0),
+        num_steps=num_steps - len(primer_events),
+        beam_size=beam_size,
+        branch_factor=branch_factor,
+        steps_per_iteration=steps_per_iteration)
+    return events
+
+  def testBeamSearchMatchesUnbatched(self):
+    # 3 beams with 2 branches each fill more than one model batch of 4.
+    for beam_size, branch_factor, steps_per_iteration in [
+        (1, 1, 1), (3, 2, 2), (2, 3, 1)]:
+      np.random.seed(0)
+      expected = self._unbatched_beam_search(
+          20, [0, 1, 2], beam_size, branch_factor, steps_per_iteration)
+      np.random.seed(0)
+      events = self.model._generate_events(
+          20, [0, 1, 2], beam_size=beam_size, branch_factor=branch_factor,
+          steps_per_iteration=steps_per_iteration)
+      self.assertEqual(20, len(events))
+      self.assertEqual(expected, events)
+
+  def testSamplingIsSeededByDefault(self):
+    np.random.seed(0)
+    expected = self.model._generate_events(20, [0, 1, 2])
+    np.random.seed(0)
+    self.assertEqual(expected, self.model._generate_events(20, [0, 1, 2]))
+
+
+if __name__ == '__main__':
+  tf.test.main()
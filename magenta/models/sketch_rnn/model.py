@@ -454,3 +454,119 @@ def sample(sess, model, seq_len=250, temperature=1.0, greedy_mode=False,
     prev_state = next_state
 
   return strokes, mixture_params
+
+
+def sample_batch(sess, model, seq_len=250, temperature=1.0, greedy_mode=False,
+                 z=None):
+  """Samples a batch of sequences from a pre-trained model.
+
+  Draws one sketch per row of the model's batch, with the same distribution as
+  `sample`, but runs a single `sess.run` per step for the whole batch and
+  samples the mixture components and pen states with vectorized numpy ops. A
+  sketch stops being sampled once it draws the end-of-sketch pen state, and
+  sampling ends when every sketch has.
+
+  Args:
+    sess: The TensorFlow session.
+    model: A Model built with `max_seq_len` set to 1. Its `batch_size` is the
+      number of sketches to sample.
+    seq_len: The maximum number of points in each sketch.
+    temperature: The sampling temperature.
+    greedy_mode: If True, picks the most likely point at each step.
+    z: Latent vectors to condition on, of shape `[batch_size, z_size]`, or
+      `[1, z_size]` to sample every sketch from the same vector. If None,
+      random vectors are used. Not used if the model is unconditional.
+
+  Returns:
+    strokes: A `[batch_size, seq_len, 5]` array of sketches in stroke-5
+      format. Points after the end of a sketch are end-of-sketch points.
+    lengths: A `[batch_size]` array of the number of points sampled for each
+      sketch, including its end-of-sketch point if it was reached.
+  """
+  batch_size = model.hps.batch_size
+
+  def adjust_temp(pdf, temp):
+    pdf = np.log(pdf) / temp
+    pdf -= pdf.max(axis=1, keepdims=True)
+    pdf = np.exp(pdf)
+    pdf /= pdf.sum(axis=1, keepdims=True)
+    return pdf
+
+  def get_pi_idx(pdf, temp=1.0, greedy=False):
+    """Samples an index from each row of a batch of pdfs."""
+    if greedy:
+      return np.argmax(pdf, axis=1)
+    pdf = adjust_temp(pdf, temp)
+    x = np.random.random_sample((pdf.shape[0], 1))
+    # The first index whose cumulative probability reaches `x`.
+    idx = (np.cumsum(pdf, axis=1) < x).sum(axis=1)
+    return np.minimum(idx, pdf.shape[1] - 1)
+
+  def sample_gaussian_2d(mu1, mu2, s1, s2, rho, temp=1.0, greedy=False):
+    if greedy:
+      return mu1, mu2
+    s1 = s1 * temp * temp
+    s2 = s2 * temp * temp
+    e1, e2 = np.random.randn(2, mu1.shape[0])
+    x1 = mu1 + s1 * e1
+    x2 = mu2 + s2 * (rho * e1 + np.sqrt(1 - rho * rho) * e2)
+    return x1, x2
+
+  prev_x = np.zeros((batch_size, 1, 5), dtype=np.float32)
+  prev_x[:, 0, 2] = 1  # initially, we want to see beginning of new stroke
+  if z is None:
+    z = np.random.randn(batch_size, model.hps.z_size)
+  else:
+    z = np.broadcast_to(z, (batch_size, model.hps.z_size))
+
+  if not model.hps.conditional:
+    prev_state = sess.run(model.initial_state)
+  else:
+    prev_state = sess.run(model.initial_state, feed_dict={model.batch_z: z})
+
+  strokes = np.zeros((batch_size, seq_len, 5), dtype=np.float32)
+  strokes[:, :, 4] = 1
+  lengths = np.full(batch_size, seq_len, dtype=np.int32)
+  active = np.ones(batch_size, dtype=bool)
+  rows = np.arange(batch_size)
+
+  for i in range(seq_len):
+    feed = {
+        model.input_x: prev_x,
+        model.sequence_lengths: np.ones(batch_size, dtype=np.int32),
+        model.initial_state: prev_state
+    }
+    if model.hps.conditional:
+      feed[model.batch_z] = z
+
+    params = sess.run([
+        model.pi, model.mu1, model.mu2, model.sigma1, model.sigma2, model.corr,
+        model.pen, model.final_state
+    ], feed)
+
+    [o_pi, o_mu1, o_mu2, o_sigma1, o_sigma2, o_corr, o_pen, next_state] = params
+
+    idx = get_pi_idx(o_pi, temperature, greedy_mode)
+    idx_eos = get_pi_idx(o_pen, temperature, greedy_mode)
+
+    next_x1, next_x2 = sample_gaussian_2d(
+        o_mu1[rows, idx], o_mu2[rows, idx], o_sigma1[rows, idx],
+        o_sigma2[rows, idx], o_corr[rows, idx], np.sqrt(temperature),
+        greedy_mode)
+
+    next_point = np.zeros((batch_size, 5), dtype=np.float32)
+    next_point[:, 0] = next_x1
+    next_point[:, 1] = next_x2
+    next_point[rows, 2 + idx_eos] = 1
+    strokes[active, i] = next_point[active]
+
+    ended = active & (idx_eos == 2)
+    lengths[ended] = i + 1
+    active &= ~ended
+    if not active.any():
+      break
+
+    prev_x = next_point[:, np.newaxis, :]
+    prev_state = next_state
+
+  return strokes, lengths
@@ -15,6 +15,8 @@
 """SketchRNN data loading and image manipulation utilities."""
 
 import random
+import struct
+import zipfile
 
 import numpy as np
 
@@ -185,6 +187,80 @@ def to_big_strokes(stroke, max_len=250):
   return result
 
 
+def _augment_packed_strokes(points, lengths, prob):
+  """Applies `augment_strokes` to each of a batch of packed sketches.
+
+  Args:
+    points: A `[num_points, 3]` array of the concatenated stroke-3 sketches.
+    lengths: The number of points of each sketch.
+    prob: The probability of dropping each droppable point.
+
+  Returns:
+    The augmented points and the new length of each sketch.
+  """
+  starts = np.zeros(len(points), dtype=bool)
+  starts[np.cumsum(lengths)[:-1]] = True
+  if len(points):
+    starts[0] = True
+  # `augment_strokes` restarts counting points at each pen lift, and after the
+  # point following it, since dropped points are only merged into points that
+  # do not lift the pen. Each sketch starts as if after a pen lift.
+  prev_pen = np.concatenate([[1], points[:-1, 2]])
+  prev_pen[starts] = 1
+  resets = (points[:, 2] == 1) | (prev_pen == 1)
+  last_reset = np.maximum.accumulate(
+      np.where(resets, np.arange(len(points)), 0))
+  count = np.arange(len(points)) - last_reset
+  drop = (count > 2) & (np.random.rand(len(points)) < prob)
+
+  # Add the offsets of dropped points to the last kept point.
+  keep = ~drop
+  group = np.cumsum(keep) - 1
+  result = points[keep].copy()
+  result[:, 0] = np.bincount(group, weights=points[:, 0], minlength=len(result))
+  result[:, 1] = np.bincount(group, weights=points[:, 1], minlength=len(result))
+  sketch = np.repeat(np.arange(len(lengths)), lengths)
+  new_lengths = np.bincount(sketch[keep], minlength=len(lengths))
+  return result, new_lengths
+
+
+def _load_npz_array(path, name, mmap_mode=None):
+  """Loads an array from an `.npz` file, memory-mapping it if possible.
+
+  Arrays can only be memory-mapped from files written by `np.savez`, which
+  does not compress them.
+
+  Args:
+    path: The path of the `.npz` file.
+    name: The name of the array in the file.
+    mmap_mode: The `np.memmap` mode to map the array with, or None to read it
+      into memory.
+
+  Returns:
+    The array.
+  """
+  with zipfile.ZipFile(path) as zf:
+    info = zf.getinfo(name + ".npy")
+  if mmap_mode is None or info.compress_type != zipfile.ZIP_STORED:
+    with np.load(path) as data:
+      return data[name]
+  with open(path, "rb") as f:
+    # Skip the local file header, whose name and extra field lengths may
+    # differ from those in the central directory.
+    f.seek(info.header_offset + 26)
+    name_length, extra_length = struct.unpack("<HH", f.read(4))
+    f.seek(name_length + extra_length, 1)
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+      header = np.lib.format.read_array_header_1_0(f)
+    else:
+      header = np.lib.format.read_array_header_2_0(f)
+    shape, fortran_order, dtype = header
+    offset = f.tell()
+  return np.memmap(path, dtype=dtype, mode=mmap_mode, shape=shape,
+                   order="F" if fortran_order else "C", offset=offset)
+
+
 def get_max_len(strokes):
   """Return the maximum length of an array of strokes."""
   max_len = 0
@@ -196,7 +272,12 @@ def get_max_len(strokes):
 
 
 class DataLoader(object):
-  """Class for loading data."""
+  """Class for loading data.
+
+  The sketches are packed in stroke-3 format into one contiguous
+  `[num_points, 3]` array, `stroke_buffer`, sorted by length. The points of
+  sketch `i` are `stroke_buffer[offsets[i]:offsets[i + 1]]`.
+  """
 
   def __init__(self,
                strokes,
@@ -215,39 +296,79 @@ class DataLoader(object):
     self.limit = limit
     self.augment_stroke_prob = augment_stroke_prob  # data augmentation method
     self.start_stroke_token = [0, 0, 1, 0, 0]  # S_0 in sketch-rnn paper
-    # sets self.strokes (list of ndarrays, one per sketch, in stroke-3 format,
+    # sets self.stroke_buffer and self.offsets (sketches in stroke-3 format,
     # sorted by size)
-    self.preprocess(strokes)
+    if strokes is not None:
+      self.preprocess(strokes)
+
+  @classmethod
+  def from_packed(cls, path, mmap_mode="r", **kwargs):
+    """Creates a DataLoader from sketches saved by `save_packed`.
+
+    Args:
+      path: The path of the `.npz` file.
+      mmap_mode: The `np.memmap` mode to map the sketches with, or None to read
+        them into memory. `normalize` copies read-only sketches into memory.
+      **kwargs: The other DataLoader arguments. The sketches are not clamped to
+        `limit` again, and `scale_factor` is the one they were saved with.
+
+    Returns:
+      The DataLoader.
+    """
+    loader = cls(None, **kwargs)
+    stroke_buffer = _load_npz_array(path, "stroke_buffer", mmap_mode)
+    offsets = _load_npz_array(path, "offsets")
+    loader.scale_factor = float(_load_npz_array(path, "scale_factor"))
+    lengths = np.diff(offsets)
+    if len(lengths) and lengths.max() > loader.max_seq_length:
+      # Drop the sketches that are too long.
+      keep = lengths <= loader.max_seq_length
+      stroke_buffer = stroke_buffer[np.repeat(keep, lengths)]
+      lengths = lengths[keep]
+    loader._set_packed(stroke_buffer, lengths)  # pylint: disable=protected-access
+    return loader
+
+  def save_packed(self, path):
+    """Saves the preprocessed sketches to an uncompressed `.npz` file."""
+    np.savez(path, stroke_buffer=self.stroke_buffer, offsets=self.offsets,
+             scale_factor=self.scale_factor)
+
+  def _set_packed(self, stroke_buffer, lengths):
+    self.stroke_buffer = stroke_buffer
+    self.seq_lengths = np.asarray(lengths, dtype=np.int64)
+    self.offsets = np.concatenate([[0], np.cumsum(self.seq_lengths)])
+    self.num_batches = int(len(self.seq_lengths) / self.batch_size)
+    self._strokes = None
+
+  @property
+  def strokes(self):
+    """A list of views of each sketch in `stroke_buffer`."""
+    if self._strokes is None:
+      self._strokes = np.split(self.stroke_buffer, self.offsets[1:-1])
+    return self._strokes
 
   def preprocess(self, strokes):
     """Remove entries from strokes having > max_seq_length points."""
-    raw_data = []
-    seq_len = []
-    count_data = 0
-
-    for i in range(len(strokes)):
-      data = strokes[i]
-      if len(data) <= (self.max_seq_length):
-        count_data += 1
-        # removes large gaps from the data
-        data = np.minimum(data, self.limit)
-        data = np.maximum(data, -self.limit)
-        data = np.array(data, dtype=np.float32)
-        data[:, 0:2] /= self.scale_factor
-        raw_data.append(data)
-        seq_len.append(len(data))
-    seq_len = np.array(seq_len)  # nstrokes for each sketch
-    idx = np.argsort(seq_len)
-    self.strokes = []
-    for i in range(len(seq_len)):
-      self.strokes.append(raw_data[idx[i]])
+    seq_len = np.array([len(data) for data in strokes], dtype=np.int64)
+    indices = np.flatnonzero(seq_len <= self.max_seq_length)
+    count_data = len(indices)
+    # nstrokes for each sketch, sorted by size
+    order = indices[np.argsort(seq_len[indices], kind="stable")]
+    if count_data:
+      stroke_buffer = np.concatenate(
+          [strokes[i] for i in order]).astype(np.float32)
+    else:
+      stroke_buffer = np.zeros((0, 3), dtype=np.float32)
+    # removes large gaps from the data
+    np.clip(stroke_buffer, -self.limit, self.limit, out=stroke_buffer)
+    stroke_buffer[:, 0:2] /= self.scale_factor
+    self._set_packed(stroke_buffer, seq_len[order])
     print("total images <= max_seq_len is %d" % count_data)
-    self.num_batches = int(count_data / self.batch_size)
 
   def random_sample(self):
     """Return a random sample, in stroke-3 format as used by draw_strokes."""
-    sample = np.copy(random.choice(self.strokes))
-    return sample
+    i = random.randrange(len(self.seq_lengths))
+    return np.array(self.stroke_buffer[self.offsets[i]:self.offsets[i + 1]])
 
   def random_scale(self, data):
     """Augment data by stretching x and y axis randomly [1-e, 1+e]."""
@@ -262,70 +383,114 @@ class DataLoader(object):
 
   def calculate_normalizing_scale_factor(self):
     """Calculate the normalizing factor explained in appendix of sketch-rnn."""
-    data = []
-    for i in range(len(self.strokes)):
-      if len(self.strokes[i]) > self.max_seq_length:
-        continue
-      for j in range(len(self.strokes[i])):
-        data.append(self.strokes[i][j, 0])
-        data.append(self.strokes[i][j, 1])
-    data = np.array(data)
-    return np.std(data)
+    keep = self.seq_lengths <= self.max_seq_length
+    if keep.all():
+      data = self.stroke_buffer[:, 0:2]
+    else:
+      data = self.stroke_buffer[np.repeat(keep, self.seq_lengths), 0:2]
+    return np.std(data, dtype=np.float64)
 
   def normalize(self, scale_factor=None):
     """Normalize entire dataset (delta_x, delta_y) by the scaling factor."""
     if scale_factor is None:
       scale_factor = self.calculate_normalizing_scale_factor()
     self.scale_factor = scale_factor
-    for i in range(len(self.strokes)):
-      self.strokes[i][:, 0:2] /= self.scale_factor
+    if not self.stroke_buffer.flags.writeable:
+      self._set_packed(np.array(self.stroke_buffer), self.seq_lengths)
+    self.stroke_buffer[:, 0:2] /= self.scale_factor
 
-  def _get_batch_from_indices(self, indices):
+  def _get_batch_from_indices(self, indices, max_len=None):
     """Given a list of indices, return the potentially augmented batch."""
-    x_batch = []
-    seq_len = []
-    for idx in range(len(indices)):
-      i = indices[idx]
-      data = self.random_scale(self.strokes[i])
-      data_copy = np.copy(data)
-      if self.augment_stroke_prob > 0:
-        data_copy = augment_strokes(data_copy, self.augment_stroke_prob)
-      x_batch.append(data_copy)
-      length = len(data_copy)
-      seq_len.append(length)
-    seq_len = np.array(seq_len, dtype=int)
+    indices = np.asarray(indices)
+    seq_len = self.seq_lengths[indices]
+    batch_offsets = np.cumsum(seq_len) - seq_len
+    # The index in `stroke_buffer` of each point of the batch.
+    point_indices = np.arange(seq_len.sum()) + np.repeat(
+        self.offsets[indices] - batch_offsets, seq_len)
+    data = self.stroke_buffer[point_indices]
+    x_scale_factor = (np.random.random(len(indices)) -
+                      0.5) * 2 * self.random_scale_factor + 1.0
+    y_scale_factor = (np.random.random(len(indices)) -
+                      0.5) * 2 * self.random_scale_factor + 1.0
+    data[:, 0] *= np.repeat(x_scale_factor, seq_len)
+    data[:, 1] *= np.repeat(y_scale_factor, seq_len)
+    if self.augment_stroke_prob > 0:
+      data, seq_len = _augment_packed_strokes(
+          data, seq_len, self.augment_stroke_prob)
+    seq_len = seq_len.astype(int)
+    x_batch = np.split(data, np.cumsum(seq_len)[:-1])
+    if max_len is None:
+      max_len = self.max_seq_length
+    elif max_len == "batch":
+      max_len = int(seq_len.max())
     # We return three things: stroke-3 format, stroke-5 format, list of seq_len.
-    return x_batch, self.pad_batch(x_batch, self.max_seq_length), seq_len
+    return x_batch, self._pad_packed(data, seq_len, max_len), seq_len
 
   def random_batch(self):
     """Return a randomised portion of the training data."""
-    idx = np.random.permutation(
-        list(range(0, len(self.strokes))))[0:self.batch_size]
+    idx = np.random.permutation(len(self.seq_lengths))[0:self.batch_size]
     return self._get_batch_from_indices(idx)
 
-  def get_batch(self, idx):
-    """Get the idx'th batch from the dataset."""
+  def get_batch(self, idx, trim_padding=False):
+    """Get the idx'th batch from the dataset.
+
+    Since sketches are sorted by length, each batch holds sketches of similar
+    lengths.
+
+    Args:
+      idx: The index of the batch.
+      trim_padding: If True, pads the batch to its longest sketch rather than
+        to `max_seq_length`, for models that accept batches of any length.
+
+    Returns:
+      The batch in stroke-3 format, in padded stroke-5 format, and the length
+      of each sketch.
+    """
     assert idx >= 0, "idx must be non negative"
     assert idx < self.num_batches, "idx must be less than the number of batches"
     start_idx = idx * self.batch_size
-    indices = list(range(start_idx, start_idx + self.batch_size))
-    return self._get_batch_from_indices(indices)
+    indices = np.arange(start_idx, start_idx + self.batch_size)
+    return self._get_batch_from_indices(
+        indices, max_len="batch" if trim_padding else None)
+
+  def bucketed_batches(self, shuffle=True, trim_padding=False):
+    """Yields every batch of the dataset, each of sketches of similar lengths.
+
+    Args:
+      shuffle: If True, yields the batches in a random order.
+      trim_padding: If True, pads each batch to its longest sketch rather than
+        to `max_seq_length`.
+
+    Yields:
+      The batches, as returned by `get_batch`.
+    """
+    order = np.arange(self.num_batches)
+    if shuffle:
+      np.random.shuffle(order)
+    for idx in order:
+      yield self.get_batch(idx, trim_padding)
 
   def pad_batch(self, batch, max_len):
     """Pad the batch to be stroke-5 bigger format as described in paper."""
+    seq_len = np.array([len(data) for data in batch], dtype=int)
+    data = np.concatenate(batch) if len(batch) else np.zeros((0, 3))
+    return self._pad_packed(data, seq_len, max_len)
+
+  def _pad_packed(self, data, seq_len, max_len):
+    """Pads packed stroke-3 sketches to a stroke-5 batch."""
+    assert len(seq_len) == self.batch_size
+    assert not len(seq_len) or seq_len.max() <= max_len
     result = np.zeros((self.batch_size, max_len + 1, 5), dtype=float)
-    assert len(batch) == self.batch_size
-    for i in range(self.batch_size):
-      l = len(batch[i])
-      assert l <= max_len
-      result[i, 0:l, 0:2] = batch[i][:, 0:2]
-      result[i, 0:l, 3] = batch[i][:, 2]
-      result[i, 0:l, 2] = 1 - result[i, 0:l, 3]
-      result[i, l:, 4] = 1
-      # put in the first token, as described in sketch-rnn methodology
-      result[i, 1:, :] = result[i, :-1, :]
-      result[i, 0, :] = 0
-      result[i, 0, 2] = self.start_stroke_token[2]  # setting S_0 from paper.
-      result[i, 0, 3] = self.start_stroke_token[3]
-      result[i, 0, 4] = self.start_stroke_token[4]
+    rows = np.repeat(np.arange(self.batch_size), seq_len)
+    # put in the first token, as described in sketch-rnn methodology, so each
+    # sketch starts at position 1.
+    cols = 1 + np.arange(len(data)) - np.repeat(
+        np.cumsum(seq_len) - seq_len, seq_len)
+    result[rows, cols, 0:2] = data[:, 0:2]
+    result[rows, cols, 3] = data[:, 2]
+    result[rows, cols, 2] = 1 - data[:, 2]
+    result[:, 1:, 4] = np.arange(max_len) >= seq_len[:, np.newaxis]
+    result[:, 0, 2] = self.start_stroke_token[2]  # setting S_0 from paper.
+    result[:, 0, 3] = self.start_stroke_token[3]
+    result[:, 0, 4] = self.start_stroke_token[4]
     return result
@@ -34,9 +34,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
 import itertools
 
 from magenta.pipelines import pipeline
+from magenta.pipelines import statistics
 import six
 
 
@@ -199,9 +201,23 @@ class DAGPipeline(pipeline.Pipeline):
   for details.
 
   Use DAGPipeline to compose multiple smaller pipelines together.
+
+  By default each unit is run on all of its inputs before the next unit in
+  topological order is run, so every intermediate output is held in memory at
+  once. In streaming mode, items are instead pushed through the DAG depth-first
+  as soon as they are produced, so peak memory is bounded by the depth of the
+  DAG rather than its fan-out. Only units that take a dictionary input need
+  all of their inputs at once; those inputs are buffered. Streaming mode
+  produces the same outputs in the same order, and the same merged statistics.
+
+  Every output of every unit is normally checked against the unit's
+  `output_type`. Once a DAG is known to be well behaved, `validate_first_n`
+  limits this to the first few inputs of each unit, after which outputs are
+  only concatenated.
   """
 
-  def __init__(self, dag, pipeline_name='DAGPipeline'):
+  def __init__(self, dag, pipeline_name='DAGPipeline', streaming=False,
+               validate_first_n=None):
     """Constructs a DAGPipeline.
 
     A DAG (direct acyclic graph) is given which fully specifies what the
@@ -212,6 +228,13 @@ class DAGPipeline(pipeline.Pipeline):
          `Pipeline`, `PipelineKey`, `DagInput`. `dag` defines a directed acyclic
          graph.
       pipeline_name: String name of this Pipeline object.
+      streaming: If True, `transform` and `transform_iter` push items through
+          the DAG depth-first instead of running one unit at a time.
+      validate_first_n: If None, the outputs for every input of every unit are
+          validated against the unit's `output_type`. Otherwise, only the
+          outputs for the first `validate_first_n` inputs of each unit are
+          validated, across all calls to `transform`, and a
+          `<unit name>_type_checked_inputs` Counter records how many were.
 
     Raises:
       InvalidDAGError: If each key value pair in the `dag` dictionary is
@@ -382,6 +405,15 @@ class DAGPipeline(pipeline.Pipeline):
     call_list.reverse()
     assert call_list[0] == self.input
 
+    self.streaming = streaming
+    self.validate_first_n = validate_first_n
+    self._num_validated = collections.defaultdict(int)
+    self._consumers = self._get_consumers()
+    self._join_units = [
+        unit for unit in call_list[1:]
+        if isinstance(unit, pipeline.Pipeline) and
+        isinstance(self.dag[unit], dict)]
+
   def _expand_dag_shorthands(self, dag):
     """Expand DAG shorthand.
 
@@ -487,6 +519,12 @@ class DAGPipeline(pipeline.Pipeline):
       depend on implementation. Each output name corresponds to an output
       collection. See get_output_names method.
     """
+    if self.streaming:
+      outputs = dict((output.name, []) for output in self.outputs)
+      for name, output in self.transform_iter(input_object):
+        outputs[name].append(output)
+      return outputs
+
     def stats_accumulator(unit, unit_inputs, cumulative_stats):
       for single_input in unit_inputs:
         results_ = unit.transform(single_input)
@@ -510,12 +548,117 @@ class DAGPipeline(pipeline.Pipeline):
 
         unjoined_outputs = list(
             stats_accumulator(unit, unit_inputs, stats))
-        unit_outputs = self._join_lists_or_dicts(unjoined_outputs, unit)
+        unit_outputs = self._join_outputs(unjoined_outputs, unit, stats)
       results[unit] = unit_outputs
 
     self._set_stats(stats)
     return dict((output.name, results[output]) for output in self.outputs)
 
+  def transform_iter(self, input_object):
+    """Runs the DAG on the given input, yielding outputs as they are produced.
+
+    In streaming mode, each output is yielded as soon as it reaches a
+    `DagOutput`, and Statistics are set once the generator is exhausted.
+    Otherwise this falls back to running `transform`.
+
+    Args:
+      input_object: Any object. The required type depends on implementation.
+
+    Yields:
+      (name, output) tuples, where `name` is the name of a `DagOutput`.
+    """
+    if not self.streaming:
+      for name_and_output in super(DAGPipeline, self).transform_iter(
+          input_object):
+        yield name_and_output
+      return
+
+    stats = []
+    join_inputs = dict(
+        (unit, dict((name, []) for name in self.dag[unit]))
+        for unit in self._join_units)
+    for name_and_output in self._push(
+        self.input, None, [input_object], stats, join_inputs):
+      yield name_and_output
+
+    # Units with dictionary inputs run once everything upstream of them has
+    # finished. `_join_units` is in topological order, so by the time a unit
+    # is reached all of its buffered inputs are complete.
+    for unit in self._join_units:
+      unit_inputs = join_inputs.pop(unit)
+      names = list(unit_inputs.keys())
+      for values in itertools.product(*[unit_inputs[name] for name in names]):
+        for name_and_output in self._run_unit(
+            unit, dict(zip(names, values)), stats, join_inputs):
+          yield name_and_output
+
+    self._set_stats(stats)
+
+  def _get_consumers(self):
+    """Maps each DAG output location to the destinations it feeds.
+
+    Returns:
+      A dictionary mapping (unit, key) tuples to lists of (destination, name)
+      tuples. `key` is the PipelineKey key, or None if the whole output of
+      `unit` is used. `name` is the name of the destination's dictionary input
+      the output is fed to, or None if the destination takes a single input.
+    """
+    consumers = collections.defaultdict(list)
+    for destination in self.call_list[1:]:
+      dependency = self.dag[destination]
+      if isinstance(dependency, dict):
+        named_subordinates = dependency.items()
+      else:
+        named_subordinates = [(None, dependency)]
+      for name, subordinate in named_subordinates:
+        if isinstance(subordinate, pipeline.PipelineKey):
+          location = (subordinate.unit, subordinate.key)
+        else:
+          location = (subordinate, None)
+        consumers[location].append((destination, name))
+    return consumers
+
+  def _push(self, unit, key, items, stats, join_inputs):
+    """Feeds outputs of `unit` to everything that consumes them, depth-first.
+
+    Args:
+      unit: The `Pipeline` or `DagInput` that produced `items`.
+      key: The output key of `unit` that produced `items`, or None.
+      items: A list of objects output by `unit`.
+      stats: A list which Statistics from all run units are appended to.
+      join_inputs: A dictionary mapping units with dictionary inputs to
+          dictionaries of buffered input lists.
+
+    Yields:
+      (name, output) tuples for every output that reaches a `DagOutput`.
+    """
+    consumers = self._consumers[(unit, key)]
+    for item in items:
+      for destination, name in consumers:
+        if isinstance(destination, DagOutput):
+          yield destination.name, item
+        elif name is not None:
+          join_inputs[destination][name].append(item)
+        else:
+          for name_and_output in self._run_unit(
+              destination, item, stats, join_inputs):
+            yield name_and_output
+
+  def _run_unit(self, unit, unit_input, stats, join_inputs):
+    """Runs `unit` on a single input and pushes its outputs downstream."""
+    unit_outputs = unit.transform(unit_input)
+    stats.extend(unit.get_stats())
+    unit_outputs = self._join_outputs([unit_outputs], unit, stats)
+    if isinstance(unit_outputs, dict):
+      for key, items in unit_outputs.items():
+        for name_and_output in self._push(
+            unit, key, items, stats, join_inputs):
+          yield name_and_output
+    else:
+      for name_and_output in self._push(
+          unit, None, unit_outputs, stats, join_inputs):
+        yield name_and_output
+
   def _get_outputs_as_signature(self, dependency, outputs):
     """Returns a list or dict which matches the type signature of dependency.
 
@@ -574,7 +717,31 @@ class DAGPipeline(pipeline.Pipeline):
     else:
       return previous_outputs
 
-  def _join_lists_or_dicts(self, outputs, unit):
+  def _join_outputs(self, outputs, unit, stats):
+    """Joins the outputs of `unit`, validating them if still required.
+
+    Args:
+      outputs: A list of lists, or list of dicts which map string names to
+          lists, as returned by `unit.transform`.
+      unit: The Pipeline that produced `outputs`.
+      stats: A list which a Counter of validated inputs is appended to when
+          `validate_first_n` is set.
+
+    Returns:
+      The joined outputs. See `_join_lists_or_dicts`.
+    """
+    if self.validate_first_n is None:
+      return self._join_lists_or_dicts(outputs, unit)
+    num_to_validate = min(
+        len(outputs),
+        max(0, self.validate_first_n - self._num_validated[unit]))
+    self._num_validated[unit] += num_to_validate
+    if num_to_validate:
+      stats.append(statistics.Counter(
+          unit.name + '_type_checked_inputs', num_to_validate))
+    return self._join_lists_or_dicts(outputs, unit, num_to_validate)
+
+  def _join_lists_or_dicts(self, outputs, unit, num_to_validate=None):
     """Joins many lists or dicts of outputs into a single list or dict.
 
     This function also validates that the outputs are correct for the given
@@ -592,6 +759,9 @@ class DAGPipeline(pipeline.Pipeline):
           lists.
       unit: A Pipeline which every output in `outputs` will be validated
           against. `unit` must produce the outputs it says it will produce.
+      num_to_validate: If given, only the first `num_to_validate` items in
+          `outputs` are validated. The rest are assumed to be correct and are
+          only concated.
 
     Returns:
       If `outputs` is a list of lists, a single list of outputs.
@@ -604,37 +774,56 @@ class DAGPipeline(pipeline.Pipeline):
     """
     if not outputs:
       return []
+    if num_to_validate is None:
+      num_to_validate = len(outputs)
+    for output in outputs[:num_to_validate]:
+      self._validate_transform_output(output, unit)
     if isinstance(unit.output_type, dict):
       concated = dict((key, []) for key in unit.output_type.keys())
       for d in outputs:
-        if not isinstance(d, dict):
-          raise InvalidTransformOutputError(
-              'Expected dictionary output for %s with output type %s but '
-              'instead got type %s' % (unit, unit.output_type, type(d)))
-        if set(d.keys()) != set(unit.output_type.keys()):
-          raise InvalidTransformOutputError(
-              'Got dictionary output with incorrect keys for %s. Got %s. '
-              'Expected %s' % (unit, d.keys(), unit.output_type.keys()))
         for k, val in d.items():
-          if not isinstance(val, list):
-            raise InvalidTransformOutputError(
-                'DagOutput from %s for key %s is not a list.' % (unit, k))
-          if not _all_are_type(val, unit.output_type[k]):
-            raise InvalidTransformOutputError(
-                'Some outputs from %s for key %s are not of expected type %s. '
-                'Got types %s' % (unit, k, unit.output_type[k],
-                                  [type(inst) for inst in val]))
           concated[k] += val
     else:
       concated = []
       for l in outputs:
-        if not isinstance(l, list):
-          raise InvalidTransformOutputError(
-              'Expected list output for %s with outpu type %s but instead got '
-              'type %s' % (unit, unit.output_type, type(l)))
-        if not _all_are_type(l, unit.output_type):
-          raise InvalidTransformOutputError(
-              'Some outputs from %s are not of expected type %s. Got types %s'
-              % (unit, unit.output_type, [type(inst) for inst in l]))
         concated += l
     return concated
+
+  def _validate_transform_output(self, output, unit):
+    """Checks that a single `unit.transform` output matches its output_type.
+
+    Args:
+      output: A list, or a dict mapping string names to lists.
+      unit: The Pipeline which produced `output`.
+
+    Raises:
+      InvalidTransformOutputError: If `output` does not match the type
+      signature given by `unit.output_type`.
+    """
+    if isinstance(unit.output_type, dict):
+      if not isinstance(output, dict):
+        raise InvalidTransformOutputError(
+            'Expected dictionary output for %s with output type %s but '
+            'instead got type %s' % (unit, unit.output_type, type(output)))
+      if set(output.keys()) != set(unit.output_type.keys()):
+        raise InvalidTransformOutputError(
+            'Got dictionary output with incorrect keys for %s. Got %s. '
+            'Expected %s' % (unit, output.keys(), unit.output_type.keys()))
+      for k, val in output.items():
+        if not isinstance(val, list):
+          raise InvalidTransformOutputError(
+              'DagOutput from %s for key %s is not a list.' % (unit, k))
+        if not _all_are_type(val, unit.output_type[k]):
+          raise InvalidTransformOutputError(
+              'Some outputs from %s for key %s are not of expected type %s. '
+              'Got types %s' % (unit, k, unit.output_type[k],
+                                [type(inst) for inst in val]))
+    else:
+      if not isinstance(output, list):
+        raise InvalidTransformOutputError(
+            'Expected list output for %s with outpu type %s but instead got '
+            'type %s' % (unit, unit.output_type, type(output)))
+      if not _all_are_type(output, unit.output_type):
+        raise InvalidTransformOutputError(
+            'Some outputs from %s are not of expected type %s. Got types %s'
+            % (unit, unit.output_type, [type(inst) for inst in output]))
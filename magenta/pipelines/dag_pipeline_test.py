@@ -453,6 +453,57 @@ class DAGPipelineTest(absltest.TestCase):
         else:
           self.assertEqual(stat.count, 1)
 
+  def testStreamingMatchesBatch(self):
+
+    class UnitQ(pipeline.Pipeline):
+
+      def __init__(self):
+        pipeline.Pipeline.__init__(self, Type0, {'t1': Type1, 't2': Type2})
+
+      def transform(self, input_object):
+        self._set_stats([statistics.Counter('output_count', input_object.z)])
+        t1 = [Type1(x=input_object.x + i, y=input_object.y + i)
+              for i in range(input_object.z)]
+        t2 = [Type2(z=input_object.z + i) for i in range(2)]
+        return {'t1': t1, 't2': t2}
+
+    class UnitR(pipeline.Pipeline):
+
+      def __init__(self):
+        pipeline.Pipeline.__init__(self, Type1, Type1)
+
+      def transform(self, input_object):
+        self._set_stats([statistics.Counter('input_count', 1)])
+        return [input_object, Type1(x=input_object.y, y=input_object.x)]
+
+    def make_dag_pipeline(streaming):
+      q, r, b, c = UnitQ(), UnitR(), UnitB(), UnitC()
+      dag = {q: dag_pipeline.DagInput(Type0),
+             r: q['t1'],
+             b: r,
+             c: {'A_data': q['t2'], 'B_data': b},
+             dag_pipeline.DagOutput('r'): r,
+             dag_pipeline.DagOutput('regular'): c['regular_data'],
+             dag_pipeline.DagOutput('special'): c['special_data']}
+      return dag_pipeline.DAGPipeline(dag, streaming=streaming)
+
+    batch_pipe = make_dag_pipeline(streaming=False)
+    streaming_pipe = make_dag_pipeline(streaming=True)
+    for x, y, z in [(-3, 0, 8), (1, 2, 3), (5, -5, 0)]:
+      batch_outputs = batch_pipe.transform(Type0(x, y, z))
+      streaming_outputs = streaming_pipe.transform(Type0(x, y, z))
+      self.assertEqual(batch_outputs, streaming_outputs)
+      self.assertEqual(
+          sorted(str(stat) for stat in statistics.merge_statistics(
+              batch_pipe.get_stats())),
+          sorted(str(stat) for stat in statistics.merge_statistics(
+              streaming_pipe.get_stats())))
+
+    # `transform_iter` yields each output as soon as it reaches a DagOutput.
+    outputs = streaming_pipe.transform_iter(Type0(1, 2, 3))
+    self.assertEqual(next(outputs), ('r', Type1(1, 2)))
+    self.assertEqual(next(outputs), ('r', Type1(2, 1)))
+
   def testInvalidDAGError(self):
     class UnitQ(pipeline.Pipeline):
 
@@ -847,6 +898,63 @@ class DAGPipelineTest(absltest.TestCase):
       with self.assertRaises(dag_pipeline.InvalidTransformOutputError):
         dag_pipe_obj.transform(Type0(1, 2, 3))
 
+  def testValidateFirstN(self):
+
+    class UnitQ(pipeline.Pipeline):
+
+      def __init__(self):
+        pipeline.Pipeline.__init__(self, Type0, Type1)
+
+      def transform(self, input_object):
+        return [Type1(x=input_object.x + i, y=input_object.y + i)
+                for i in range(input_object.z)]
+
+    class UnitR(pipeline.Pipeline):
+
+      def __init__(self):
+        pipeline.Pipeline.__init__(self, Type1, Type1)
+
+      def transform(self, input_object):
+        if input_object.x < 0:
+          return [Type2(input_object.x)]
+        return [input_object]
+
+    for streaming in [False, True]:
+      q, r = UnitQ(), UnitR()
+      dag = {q: dag_pipeline.DagInput(q.input_type),
+             r: q,
+             dag_pipeline.DagOutput('output'): r}
+      dag_pipe_obj = dag_pipeline.DAGPipeline(
+          dag, 'DAGPipelineName', streaming=streaming, validate_first_n=3)
+
+      self.assertEqual(dag_pipe_obj.transform(Type0(1, 2, 2)),
+                       {'output': [Type1(1, 2), Type1(2, 3)]})
+      self.assertEqual(
+          sorted((stat.name, stat.count) for stat in
+                 statistics.merge_statistics(dag_pipe_obj.get_stats())),
+          [('DAGPipelineName_UnitQ_type_checked_inputs', 1),
+           ('DAGPipelineName_UnitR_type_checked_inputs', 2)])
+
+      # Each unit's outputs are only validated for its first 3 inputs. This
+      # call uses up UnitR's third validated input, so the invalid Type2 output
+      # of its input in the next call is not validated and passes through.
+      self.assertEqual(dag_pipe_obj.transform(Type0(0, 0, 2)),
+                       {'output': [Type1(0, 0), Type1(1, 1)]})
+      self.assertEqual(dag_pipe_obj.transform(Type0(-1, 0, 1)),
+                       {'output': [Type2(-1)]})
+      self.assertEqual(
+          [(stat.name, stat.count) for stat in dag_pipe_obj.get_stats()],
+          [('DAGPipelineName_UnitQ_type_checked_inputs', 1)])
+
+      q, r = UnitQ(), UnitR()
+      dag = {q: dag_pipeline.DagInput(q.input_type),
+             r: q,
+             dag_pipeline.DagOutput('output'): r}
+      dag_pipe_obj = dag_pipeline.DAGPipeline(
+          dag, streaming=streaming, validate_first_n=3)
+      with self.assertRaises(dag_pipeline.InvalidTransformOutputError):
+        dag_pipe_obj.transform(Type0(-1, 0, 1))
+
   def testInvalidStatisticsError(self):
     class UnitQ(pipeline.Pipeline):
 
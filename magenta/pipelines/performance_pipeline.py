@@ -155,7 +155,9 @@ def get_pipeline(config, min_events, max_events, eval_ratio):
     dag[encoder_pipeline] = perf_extractor
     dag[dag_pipeline.DagOutput(mode + '_performances')] = encoder_pipeline
 
-  return dag_pipeline.DAGPipeline(dag)
+  # Splitting and transposition fan each input out into many performances, so
+  # stream them through the DAG rather than materializing every stage.
+  return dag_pipeline.DAGPipeline(dag, streaming=True)
 
 
 def extract_performances(
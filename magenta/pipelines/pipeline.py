@@ -20,7 +20,10 @@ from __future__ import print_function
 
 import abc
 import inspect
+import multiprocessing
 import os.path
+import queue
+import traceback
 
 from magenta.pipelines import statistics
 import six
@@ -221,6 +224,26 @@ class Pipeline(object):
     """
     pass
 
+  def transform_iter(self, input_object):
+    """Runs the pipeline on the given input, yielding outputs one at a time.
+
+    Subclasses that can produce outputs incrementally may override this to
+    avoid holding every output in memory. The default implementation calls
+    `transform`. `get_stats` is valid once the generator is exhausted.
+
+    Args:
+      input_object: An object or dictionary mapping names to objects.
+          The object types must match `input_type`.
+
+    Yields:
+      (name, output) tuples, where `name` is a key of `output_type_as_dict`.
+    """
+    outputs = _guarantee_dict(self.transform(input_object),
+                              list(self.output_type_as_dict.keys())[0])
+    for name, output_list in outputs.items():
+      for output in output_list:
+        yield name, output
+
   def _set_stats(self, stats):
     """Overwrites the current Statistics returned by `get_stats`.
 
@@ -311,6 +334,85 @@ def tf_record_iterator(tfrecord_file, proto):
     yield proto.FromString(raw_bytes)
 
 
+def _assert_serializable_output_types(pipeline):
+  """Checks that every output type of `pipeline` can be written to a TFRecord.
+
+  Args:
+    pipeline: A Pipeline instance.
+
+  Raises:
+    ValueError: If any of `pipeline`'s output types do not have a
+        SerializeToString method.
+  """
+  if isinstance(pipeline.output_type, dict):
+    for name, type_ in pipeline.output_type.items():
+      if not hasattr(type_, 'SerializeToString'):
+        raise ValueError(
+            'Pipeline output "%s" does not have method SerializeToString. '
+            'Output type = %s' % (name, pipeline.output_type))
+  else:
+    if not hasattr(pipeline.output_type, 'SerializeToString'):
+      raise ValueError(
+          'Pipeline output type %s does not have method SerializeToString.'
+          % pipeline.output_type)
+
+
+def _get_output_paths(output_dir, output_names, output_file_base=None,
+                      shard=None, num_shards=None):
+  """Returns a dictionary mapping dataset names to TFRecord paths.
+
+  Args:
+    output_dir: Directory the datasets are written to.
+    output_names: Iterable of dataset names.
+    output_file_base: An optional string prefix for all datasets. The prefix
+        will be followed by an underscore.
+    shard: If given, the index of the shard whose paths are returned. Sharded
+        paths have the form `<name>-<shard>-of-<num_shards>.tfrecord`.
+    num_shards: Total number of shards. Required if `shard` is given.
+
+  Returns:
+    A dictionary mapping each name in `output_names` to its output path.
+  """
+  output_paths = {}
+  for name in output_names:
+    base = name if output_file_base is None else '%s_%s' % (
+        output_file_base, name)
+    if shard is not None:
+      base = '%s-%05d-of-%05d' % (base, shard, num_shards)
+    output_paths[name] = os.path.join(output_dir, base + '.tfrecord')
+  return output_paths
+
+
+def _transform_and_write(pipeline, input_iterator, writers, log_progress=True):
+  """Runs `pipeline` on every input and writes the outputs to `writers`.
+
+  Args:
+    pipeline: A Pipeline instance.
+    input_iterator: Iterates over the input data.
+    writers: A dictionary mapping dataset names to objects with a `write`
+        method that accepts serialized outputs.
+    log_progress: If True, totals and statistics are logged every 500 inputs.
+
+  Returns:
+    A tuple (total_inputs, total_outputs, stats) where `stats` is a list of
+    merged `Statistic` objects.
+  """
+  total_inputs = 0
+  total_outputs = 0
+  stats = statistics.StatisticsAccumulator()
+  for input_ in input_iterator:
+    total_inputs += 1
+    for name, output in pipeline.transform_iter(input_):
+      writers[name].write(output.SerializeToString())
+      total_outputs += 1
+    stats.add(pipeline.get_stats())
+    if log_progress and total_inputs % 500 == 0:
+      tf.logging.info('Processed %d inputs so far. Produced %d outputs.',
+                      total_inputs, total_outputs)
+      statistics.log_statistics_list(stats.get_stats(), tf.logging.info)
+  return total_inputs, total_outputs, stats.get_stats()
+
+
 def run_pipeline_serial(pipeline,
                         input_iterator,
                         output_dir,
@@ -340,53 +442,248 @@ def run_pipeline_serial(pipeline,
     ValueError: If any of `pipeline`'s output types do not have a
         SerializeToString method.
   """
-  if isinstance(pipeline.output_type, dict):
-    for name, type_ in pipeline.output_type.items():
-      if not hasattr(type_, 'SerializeToString'):
-        raise ValueError(
-            'Pipeline output "%s" does not have method SerializeToString. '
-            'Output type = %s' % (name, pipeline.output_type))
-  else:
-    if not hasattr(pipeline.output_type, 'SerializeToString'):
-      raise ValueError(
-          'Pipeline output type %s does not have method SerializeToString.'
-          % pipeline.output_type)
+  _assert_serializable_output_types(pipeline)
 
   if not tf.gfile.Exists(output_dir):
     tf.gfile.MakeDirs(output_dir)
 
-  output_names = pipeline.output_type_as_dict.keys()
+  output_paths = _get_output_paths(
+      output_dir, pipeline.output_type_as_dict.keys(), output_file_base)
+  writers = dict((name, tf.python_io.TFRecordWriter(path))
+                 for name, path in output_paths.items())
 
-  if output_file_base is None:
-    output_paths = [os.path.join(output_dir, name + '.tfrecord')
-                    for name in output_names]
-  else:
-    output_paths = [os.path.join(output_dir,
-                                 '%s_%s.tfrecord' % (output_file_base, name))
-                    for name in output_names]
+  total_inputs, total_outputs, stats = _transform_and_write(
+      pipeline, input_iterator, writers)
+  for writer in writers.values():
+    writer.close()
+  tf.logging.info('\n\nCompleted.\n')
+  tf.logging.info('Processed %d inputs total. Produced %d outputs.',
+                  total_inputs, total_outputs)
+  statistics.log_statistics_list(stats, tf.logging.info)
 
-  writers = dict((name, tf.python_io.TFRecordWriter(path))
-                 for name, path in zip(output_names, output_paths))
 
+def _queue_iterator(input_queue):
+  """Yields items from chunks taken off `input_queue` until a None sentinel."""
+  while True:
+    chunk = input_queue.get()
+    if chunk is None:
+      return
+    for input_ in chunk:
+      yield input_
+
+
+def _run_pipeline_worker(pipeline, shard, output_paths, input_queue,
+                         result_queue):
+  """Worker process body for `run_pipeline_parallel`.
+
+  Consumes chunks of inputs from `input_queue`, writes outputs to this worker's
+  own shard files, and puts a single
+  (shard, total_inputs, total_outputs, stats, error) tuple on `result_queue`
+  once the None sentinel is received.
+
+  Args:
+    pipeline: A Pipeline instance.
+    shard: Integer index of this worker's shard.
+    output_paths: Dictionary mapping dataset names to this shard's paths.
+    input_queue: A multiprocessing queue of input chunks.
+    result_queue: A multiprocessing queue for the worker's results.
+  """
   total_inputs = 0
   total_outputs = 0
   stats = []
+  error = None
+  inputs = _queue_iterator(input_queue)
+  try:
+    writers = dict((name, tf.python_io.TFRecordWriter(path))
+                   for name, path in output_paths.items())
+    total_inputs, total_outputs, stats = _transform_and_write(
+        pipeline, inputs, writers, log_progress=False)
+    for writer in writers.values():
+      writer.close()
+  except Exception:  # pylint:disable=broad-except
+    error = traceback.format_exc()
+    # Keep draining so the producer never blocks on a full queue.
+    for _ in inputs:
+      pass
+  result_queue.put((shard, total_inputs, total_outputs, stats, error))
+
+
+# How often run_pipeline_parallel checks that its workers are still alive while
+# it waits on them.
+_WORKER_POLL_SECS = 1.0
+
+
+def _terminate_workers(workers, message):
+  """Terminates all worker processes and raises a RuntimeError."""
+  for worker in workers:
+    if worker.is_alive():
+      worker.terminate()
+  for worker in workers:
+    worker.join()
+  raise RuntimeError(message)
+
+
+def _put_to_workers(input_queue, item, workers):
+  """Puts an item on the input queue, failing if a worker has crashed."""
+  while True:
+    try:
+      input_queue.put(item, timeout=_WORKER_POLL_SECS)
+      return
+    except queue.Full:
+      for shard, worker in enumerate(workers):
+        if worker.exitcode:
+          _terminate_workers(
+              workers, 'Worker %d exited with code %d.' %
+              (shard, worker.exitcode))
+
+
+def _get_worker_results(result_queue, workers):
+  """Collects one result from each worker.
+
+  A worker that exits without reporting a result, e.g. because it was killed or
+  could not pickle its result, makes all other workers be terminated.
+
+  Args:
+    result_queue: The multiprocessing queue of worker results.
+    workers: The list of worker processes, indexed by shard.
+
+  Returns:
+    A list of the (shard, total_inputs, total_outputs, stats, error) tuples
+    reported by the workers.
+
+  Raises:
+    RuntimeError: If a worker exits without reporting a result.
+  """
+  results = {}
+  # Workers found dead without a result at the previous poll. A worker flushes
+  # its result before it exits, so give it one more poll to arrive.
+  missing = set()
+  while len(results) < len(workers):
+    try:
+      result = result_queue.get(timeout=_WORKER_POLL_SECS)
+      results[result[0]] = result
+      continue
+    except queue.Empty:
+      pass
+    dead = set(shard for shard, worker in enumerate(workers)
+               if shard not in results and not worker.is_alive())
+    for shard in sorted(dead & missing):
+      _terminate_workers(
+          workers, 'Worker %d exited with code %s without reporting results.' %
+          (shard, workers[shard].exitcode))
+    missing = dead
+  return [results[shard] for shard in range(len(workers))]
+
+
+def run_pipeline_parallel(pipeline,
+                          input_iterator,
+                          output_dir,
+                          num_workers=None,
+                          output_file_base=None,
+                          chunk_size=16):
+  """Runs a pipeline on a data source in parallel and writes to a directory.
+
+  Inputs are distributed across `num_workers` processes in chunks of
+  `chunk_size`. Each worker runs its own copy of `pipeline` and writes its own
+  shard of each dataset, named `<name>-<shard>-of-<num_workers>.tfrecord`, so
+  datasets can be read back with a glob such as `<name>-*.tfrecord`. Worker
+  statistics are merged together before they are logged.
+
+  When `num_workers` is 1 the pipeline runs in the calling process and the
+  output is identical to `run_pipeline_serial`, including the unsharded file
+  names.
+
+  The output type or types given by `pipeline.output_type` must be protocol
+  buffers or objects that have a SerializeToString method, and `pipeline`
+  must be picklable when `num_workers` is greater than 1.
+
+  Args:
+    pipeline: A Pipeline instance. `pipeline.output_type` must be a protocol
+        buffer or a dictionary mapping names to protocol buffers.
+    input_iterator: Iterates over the input data. Items returned by it are fed
+        directly into the pipeline's `transform` method and must be picklable.
+    output_dir: Path to directory where datasets will be written. If the
+        directory does not exist, it will be created.
+    num_workers: Number of worker processes. If None, the number of CPUs is
+        used.
+    output_file_base: An optional string prefix for all datasets output by this
+        run. The prefix will also be followed by an underscore.
+    chunk_size: Number of inputs sent to a worker at a time.
+
+  Raises:
+    ValueError: If any of `pipeline`'s output types do not have a
+        SerializeToString method, or if `num_workers` or `chunk_size` is not
+        positive.
+    RuntimeError: If any worker process fails. A worker that crashes or
+        exits without reporting its results makes the remaining workers be
+        terminated.
+  """
+  if num_workers is None:
+    num_workers = multiprocessing.cpu_count()
+  if num_workers < 1:
+    raise ValueError('num_workers must be positive, got %d' % num_workers)
+  if chunk_size < 1:
+    raise ValueError('chunk_size must be positive, got %d' % chunk_size)
+  if num_workers == 1:
+    run_pipeline_serial(pipeline, input_iterator, output_dir, output_file_base)
+    return
+
+  _assert_serializable_output_types(pipeline)
+
+  if not tf.gfile.Exists(output_dir):
+    tf.gfile.MakeDirs(output_dir)
+
+  output_names = list(pipeline.output_type_as_dict.keys())
+  input_queue = multiprocessing.Queue(maxsize=2 * num_workers)
+  result_queue = multiprocessing.Queue()
+  workers = []
+  for shard in range(num_workers):
+    output_paths = _get_output_paths(
+        output_dir, output_names, output_file_base, shard, num_workers)
+    worker = multiprocessing.Process(
+        target=_run_pipeline_worker,
+        args=(pipeline, shard, output_paths, input_queue, result_queue))
+    worker.daemon = True
+    worker.start()
+    workers.append(worker)
+
+  total_chunks = 0
+  chunk = []
   for input_ in input_iterator:
-    total_inputs += 1
-    for name, outputs in _guarantee_dict(pipeline.transform(input_),
-                                         list(output_names)[0]).items():
-      for output in outputs:  # pylint:disable=not-an-iterable
-        writers[name].write(output.SerializeToString())
-      total_outputs += len(outputs)
-    stats = statistics.merge_statistics(stats + pipeline.get_stats())
-    if total_inputs % 500 == 0:
-      tf.logging.info('Processed %d inputs so far. Produced %d outputs.',
-                      total_inputs, total_outputs)
-      statistics.log_statistics_list(stats, tf.logging.info)
+    chunk.append(input_)
+    if len(chunk) == chunk_size:
+      _put_to_workers(input_queue, chunk, workers)
+      chunk = []
+      total_chunks += 1
+      if total_chunks % 100 == 0:
+        tf.logging.info('Dispatched %d inputs so far.',
+                        total_chunks * chunk_size)
+  if chunk:
+    _put_to_workers(input_queue, chunk, workers)
+  for _ in workers:
+    _put_to_workers(input_queue, None, workers)
+
+  total_inputs = 0
+  total_outputs = 0
+  stats = statistics.StatisticsAccumulator()
+  errors = []
+  for shard, num_inputs, num_outputs, worker_stats, error in (
+      _get_worker_results(result_queue, workers)):
+    if error is not None:
+      errors.append('Worker %d failed:\n%s' % (shard, error))
+    total_inputs += num_inputs
+    total_outputs += num_outputs
+    stats.add(worker_stats)
+  for worker in workers:
+    worker.join()
+  if errors:
+    raise RuntimeError('\n'.join(errors))
+
   tf.logging.info('\n\nCompleted.\n')
-  tf.logging.info('Processed %d inputs total. Produced %d outputs.',
-                  total_inputs, total_outputs)
-  statistics.log_statistics_list(stats, tf.logging.info)
+  tf.logging.info('Processed %d inputs total with %d workers. '
+                  'Produced %d outputs.',
+                  total_inputs, num_workers, total_outputs)
+  statistics.log_statistics_list(stats.get_stats(), tf.logging.info)
 
 
 def load_pipeline(pipeline, input_iterator):
@@ -408,21 +705,19 @@ def load_pipeline(pipeline, input_iterator):
   aggregated_outputs = dict((name, []) for name in pipeline.output_type_as_dict)
   total_inputs = 0
   total_outputs = 0
-  stats = []
+  stats = statistics.StatisticsAccumulator()
   for input_object in input_iterator:
     total_inputs += 1
-    outputs = _guarantee_dict(pipeline.transform(input_object),
-                              list(aggregated_outputs.keys())[0])
-    for name, output_list in outputs.items():
-      aggregated_outputs[name].extend(output_list)
-      total_outputs += len(output_list)
-    stats = statistics.merge_statistics(stats + pipeline.get_stats())
+    for name, output in pipeline.transform_iter(input_object):
+      aggregated_outputs[name].append(output)
+      total_outputs += 1
+    stats.add(pipeline.get_stats())
     if total_inputs % 500 == 0:
       tf.logging.info('Processed %d inputs so far. Produced %d outputs.',
                       total_inputs, total_outputs)
-      statistics.log_statistics_list(stats, tf.logging.info)
+      statistics.log_statistics_list(stats.get_stats(), tf.logging.info)
   tf.logging.info('\n\nCompleted.\n')
   tf.logging.info('Processed %d inputs total. Produced %d outputs.',
                   total_inputs, total_outputs)
-  statistics.log_statistics_list(stats, tf.logging.info)
+  statistics.log_statistics_list(stats.get_stats(), tf.logging.info)
   return aggregated_outputs
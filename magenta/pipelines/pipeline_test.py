@@ -41,6 +41,15 @@ class MockPipeline(pipeline.Pipeline):
         'dataset_2': [MockStringProto(input_object + '_C')]}
 
 
+class CrashingPipeline(MockPipeline):
+
+  def transform(self, input_object):
+    if input_object == 'crash':
+      # Exit without reporting results, as if killed.
+      os._exit(1)  # pylint:disable=protected-access
+    return super(CrashingPipeline, self).transform(input_object)
+
+
 class PipelineTest(absltest.TestCase):
 
   def testFileIteratorRecursive(self):
@@ -123,6 +132,55 @@ class PipelineTest(absltest.TestCase):
         set(('serialized:%s_C' % s).encode('utf-8') for s in strings),
         set(dataset_2_reader))
 
+  def testRunPipelineParallel(self):
+    strings = ['abcdefg', 'helloworld!', 'qwerty', 'asdf', 'zxcv']
+    root_dir = self.create_tempdir().full_path
+    pipeline.run_pipeline_parallel(
+        MockPipeline(), iter(strings), root_dir, num_workers=2, chunk_size=2)
+
+    dataset_1_paths = tf.gfile.Glob(
+        os.path.join(root_dir, 'dataset_1-*-of-00002.tfrecord'))
+    dataset_2_paths = tf.gfile.Glob(
+        os.path.join(root_dir, 'dataset_2-*-of-00002.tfrecord'))
+    self.assertLen(dataset_1_paths, 2)
+    self.assertLen(dataset_2_paths, 2)
+
+    dataset_1_records = [record for path in dataset_1_paths
+                         for record in tf.python_io.tf_record_iterator(path)]
+    self.assertCountEqual(
+        [('serialized:%s_A' % s).encode('utf-8') for s in strings] +
+        [('serialized:%s_B' % s).encode('utf-8') for s in strings],
+        dataset_1_records)
+
+    dataset_2_records = [record for path in dataset_2_paths
+                         for record in tf.python_io.tf_record_iterator(path)]
+    self.assertCountEqual(
+        [('serialized:%s_C' % s).encode('utf-8') for s in strings],
+        dataset_2_records)
+
+  def testRunPipelineParallelWorkerCrash(self):
+    strings = ['abcdefg', 'crash', 'qwerty', 'asdf']
+    root_dir = self.create_tempdir().full_path
+    with self.assertRaisesRegex(RuntimeError, 'exited with code'):
+      pipeline.run_pipeline_parallel(
+          CrashingPipeline(), iter(strings), root_dir, num_workers=2,
+          chunk_size=1)
+
+  def testRunPipelineParallelSingleWorkerMatchesSerial(self):
+    strings = ['abcdefg', 'helloworld!', 'qwerty']
+    serial_dir = self.create_tempdir().full_path
+    parallel_dir = self.create_tempdir().full_path
+    pipeline.run_pipeline_serial(MockPipeline(), iter(strings), serial_dir)
+    pipeline.run_pipeline_parallel(
+        MockPipeline(), iter(strings), parallel_dir, num_workers=1)
+
+    for name in ['dataset_1.tfrecord', 'dataset_2.tfrecord']:
+      with tf.gfile.GFile(os.path.join(serial_dir, name), 'rb') as f:
+        serial_bytes = f.read()
+      with tf.gfile.GFile(os.path.join(parallel_dir, name), 'rb') as f:
+        parallel_bytes = f.read()
+      self.assertEqual(serial_bytes, parallel_bytes)
+
   def testPipelineIterator(self):
     strings = ['abcdefg', 'helloworld!', 'qwerty']
     result = pipeline.load_pipeline(MockPipeline(), iter(strings))
@@ -125,6 +125,50 @@ def merge_statistics(stats_list):
   return list(name_map.values())
 
 
+class StatisticsAccumulator(object):
+  """Incrementally merges batches of Statistics, keyed by name.
+
+  `merge_statistics` rebuilds the merged list from scratch each time it is
+  called, so calling it once per pipeline input costs time proportional to the
+  number of distinct statistics seen so far. `StatisticsAccumulator` instead
+  keeps one mutable `Statistic` per name and merges each new batch into those
+  in place.
+
+  The first `Statistic` seen for a name is copied, so the accumulator never
+  mutates objects it was given.
+  """
+
+  def __init__(self, stats_list=None):
+    """Constructs a `StatisticsAccumulator`.
+
+    Args:
+      stats_list: An optional list of `Statistic` objects to start with.
+    """
+    self._stats = {}
+    if stats_list is not None:
+      self.add(stats_list)
+
+  def add(self, stats_list):
+    """Merges the given Statistics into the accumulated Statistics.
+
+    Args:
+      stats_list: An iterable of `Statistic` objects.
+    """
+    for stat in stats_list:
+      merged = self._stats.get(stat.name)
+      if merged is None:
+        self._stats[stat.name] = stat.copy()
+      else:
+        merged.merge_from(stat)
+
+  def get_stats(self):
+    """Returns a list of the accumulated Statistics, one per name."""
+    return list(self._stats.values())
+
+  def __len__(self):
+    return len(self._stats)
+
+
 def log_statistics_list(stats_list, logger_fn=tf.logging.info):
   """Calls the given logger function on each `Statistic` in the list.
 
@@ -269,4 +313,6 @@ class Histogram(Statistic):
          if self.verbose_pretty_print or self.counters[lower]])
 
   def copy(self):
-    return copy.copy(self)
+    histogram_copy = copy.copy(self)
+    histogram_copy.counters = dict(self.counters)
+    return histogram_copy
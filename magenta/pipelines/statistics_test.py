@@ -88,6 +88,40 @@ class StatisticsTest(absltest.TestCase):
                      {float('-inf'): 6, 1: 1, 2: 13, 10: 3})
     self.assertEqual(histo_copy.name, 'name_123')
 
+  def testHistogramCopyIsIndependent(self):
+    histo = statistics.Histogram('name_123', [1, 2])
+    histo_copy = histo.copy()
+    histo_copy.increment(1)
+    self.assertEqual(histo.counters, {float('-inf'): 0, 1: 0, 2: 0})
+    self.assertEqual(histo_copy.counters, {float('-inf'): 0, 1: 1, 2: 0})
+
+  def testStatisticsAccumulator(self):
+    counter_1 = statistics.Counter('counter', 3)
+    histo_1 = statistics.Histogram('histo', [1, 2])
+    histo_1.increment(1)
+    accumulator = statistics.StatisticsAccumulator([counter_1, histo_1])
+
+    counter_2 = statistics.Counter('counter', 4)
+    histo_2 = statistics.Histogram('histo', [1, 2])
+    histo_2.increment(2, 5)
+    other_counter = statistics.Counter('other', 1)
+    accumulator.add([counter_2, histo_2, other_counter])
+    accumulator.add([statistics.Counter('counter', 1)])
+
+    self.assertLen(accumulator, 3)
+    merged = dict((stat.name, stat) for stat in accumulator.get_stats())
+    self.assertEqual(merged['counter'].count, 8)
+    self.assertEqual(merged['histo'].counters,
+                     {float('-inf'): 0, 1: 1, 2: 5})
+    self.assertEqual(merged['other'].count, 1)
+
+    # The Statistics given to the accumulator are not modified.
+    self.assertEqual(counter_1.count, 3)
+    self.assertEqual(histo_1.counters, {float('-inf'): 0, 1: 1, 2: 0})
+
+    with self.assertRaises(statistics.MergeStatisticsError):
+      accumulator.add([statistics.Histogram('counter', [1])])
+
   def testMergeDifferentNames(self):
     counter_1 = statistics.Counter('counter_1')
     counter_2 = statistics.Counter('counter_2')
@@ -21,14 +21,23 @@ Example usage:
     --input_dir=/path/to/input/dir \
     --output_file=/path/to/tfrecord/file \
     --log=INFO
+
+Large corpora can be converted in parallel by setting --num_workers. Files are
+then read by a pool of threads and parsed by a pool of processes.
 """
 
+import collections
+from concurrent import futures
 import hashlib
 import os
+import time
 
+from magenta.pipelines import statistics
+from magenta.scripts import note_sequence_cache
 from note_seq import abc_parser
 from note_seq import midi_io
 from note_seq import musicxml_reader
+from note_seq.protobuf import music_pb2
 import tensorflow.compat.v1 as tf
 
 FLAGS = tf.app.flags.FLAGS
@@ -40,6 +49,29 @@ tf.app.flags.DEFINE_string('output_file', None,
                            'if it already exists.')
 tf.app.flags.DEFINE_bool('recursive', False,
                          'Whether or not to recurse into subdirectories.')
+tf.app.flags.DEFINE_integer('num_workers', 1,
+                            'Number of processes used to parse files. If '
+                            'greater than 1, files are read and parsed in '
+                            'parallel.')
+tf.app.flags.DEFINE_integer('num_read_threads', 8,
+                            'Number of threads used to read files when '
+                            '--num_workers is greater than 1.')
+tf.app.flags.DEFINE_integer('max_in_flight', 256,
+                            'Maximum number of files being read or parsed at '
+                            'once when --num_workers is greater than 1.')
+tf.app.flags.DEFINE_bool('ordered', False,
+                         'When --num_workers is greater than 1, whether to '
+                         'write sequences in the same order as a serial '
+                         'conversion. Otherwise they are written as soon as '
+                         'they are parsed.')
+tf.app.flags.DEFINE_string('cache_dir', None,
+                           'Optional directory for a cache of converted '
+                           'sequences keyed by file contents. Files whose '
+                           'contents have not changed since a previous run '
+                           'are not parsed again.')
+tf.app.flags.DEFINE_integer('cache_max_size_mb', 0,
+                            'If positive, least recently used cache entries '
+                            'are evicted once the cache grows past this size.')
 tf.app.flags.DEFINE_string('log', 'INFO',
                            'The threshold for what messages will be logged '
                            'DEBUG, INFO, WARN, ERROR, or FATAL.')
@@ -64,7 +96,7 @@ def generate_note_sequence_id(filename, collection_name, source_type):
       source_type.lower(), collection_name, filename_fingerprint.hexdigest())
 
 
-def convert_files(root_dir, sub_dir, writer, recursive=False):
+def convert_files(root_dir, sub_dir, writer, recursive=False, cache=None):
   """Converts files.
 
   Args:
@@ -74,6 +106,8 @@ def convert_files(root_dir, sub_dir, writer, recursive=False):
     writer: A TFRecord writer
     recursive: A boolean specifying whether or not recursively convert files
         contained in subdirectories of the specified directory.
+    cache: An optional `NoteSequenceCache` used to skip files that have
+        already been converted.
 
   Returns:
     A map from the resulting Futures to the file paths being converted.
@@ -87,8 +121,17 @@ def convert_files(root_dir, sub_dir, writer, recursive=False):
     tf.logging.log_every_n(tf.logging.INFO, '%d files converted.',
                            1000, written_count)
     full_file_path = os.path.join(dir_to_convert, file_in_dir)
-    if (full_file_path.lower().endswith('.mid') or
-        full_file_path.lower().endswith('.midi')):
+    if cache is not None and get_source_type(full_file_path):
+      try:
+        serialized_sequences = _convert_file_with_cache(
+            cache, root_dir, sub_dir, full_file_path)
+      except Exception as exc:  # pylint: disable=broad-except
+        tf.logging.fatal('%r generated an exception: %s', full_file_path, exc)
+        continue
+      for serialized_sequence in serialized_sequences:
+        writer.write(serialized_sequence)
+    elif (full_file_path.lower().endswith('.mid') or
+          full_file_path.lower().endswith('.midi')):
       try:
         sequence = convert_midi(root_dir, sub_dir, full_file_path)
       except Exception as exc:  # pylint: disable=broad-except
@@ -122,10 +165,10 @@ def convert_files(root_dir, sub_dir, writer, recursive=False):
             'Unable to find a converter for file %s', full_file_path)
 
   for recurse_sub_dir in recurse_sub_dirs:
-    convert_files(root_dir, recurse_sub_dir, writer, recursive)
+    convert_files(root_dir, recurse_sub_dir, writer, recursive, cache)
 
 
-def convert_midi(root_dir, sub_dir, full_file_path):
+def convert_midi(root_dir, sub_dir, full_file_path, midi_data=None):
   """Converts a midi file to a sequence proto.
 
   Args:
@@ -133,13 +176,16 @@ def convert_midi(root_dir, sub_dir, full_file_path):
         converted.
     sub_dir: The directory being converted currently.
     full_file_path: the full path to the file to convert.
+    midi_data: The contents of the file, if already read. If None, the file is
+        read from `full_file_path`.
 
   Returns:
     Either a NoteSequence proto or None if the file could not be converted.
   """
+  if midi_data is None:
+    midi_data = tf.gfile.GFile(full_file_path, 'rb').read()
   try:
-    sequence = midi_io.midi_to_sequence_proto(
-        tf.gfile.GFile(full_file_path, 'rb').read())
+    sequence = midi_io.midi_to_sequence_proto(midi_data)
   except midi_io.MIDIConversionError as e:
     tf.logging.warning(
         'Could not parse MIDI file %s. It will be skipped. Error was: %s',
@@ -180,7 +226,7 @@ def convert_musicxml(root_dir, sub_dir, full_file_path):
   return sequence
 
 
-def convert_abc(root_dir, sub_dir, full_file_path):
+def convert_abc(root_dir, sub_dir, full_file_path, abc_data=None):
   """Converts an abc file to a sequence proto.
 
   Args:
@@ -188,13 +234,16 @@ def convert_abc(root_dir, sub_dir, full_file_path):
         converted.
     sub_dir: The directory being converted currently.
     full_file_path: the full path to the file to convert.
+    abc_data: The contents of the file, if already read. If None, the file is
+        read from `full_file_path`.
 
   Returns:
     Either a NoteSequence proto or None if the file could not be converted.
   """
+  if abc_data is None:
+    abc_data = tf.gfile.GFile(full_file_path, 'rb').read()
   try:
-    tunes, exceptions = abc_parser.parse_abc_tunebook(
-        tf.gfile.GFile(full_file_path, 'rb').read())
+    tunes, exceptions = abc_parser.parse_abc_tunebook(abc_data)
   except abc_parser.ABCParseError as e:
     tf.logging.warning(
         'Could not parse ABC file %s. It will be skipped. Error was: %s',
@@ -217,7 +266,289 @@ def convert_abc(root_dir, sub_dir, full_file_path):
   return sequences
 
 
-def convert_directory(root_dir, output_file, recursive=False):
+def get_source_type(full_file_path):
+  """Returns the source type of a file based on its extension.
+
+  Args:
+    full_file_path: The path to the file.
+
+  Returns:
+    One of 'midi', 'musicxml', or 'abc', or None if there is no converter for
+    the file.
+  """
+  lower_path = full_file_path.lower()
+  if lower_path.endswith('.mid') or lower_path.endswith('.midi'):
+    return 'midi'
+  if lower_path.endswith('.xml') or lower_path.endswith('.mxl'):
+    return 'musicxml'
+  if lower_path.endswith('.abc'):
+    return 'abc'
+  return None
+
+
+def list_files(root_dir, sub_dir='', recursive=False):
+  """Lists convertible files in the same order `convert_files` visits them.
+
+  Args:
+    root_dir: A string specifying a root directory.
+    sub_dir: A string specifying a path to a directory under `root_dir` in which
+        to list contents.
+    recursive: A boolean specifying whether or not to recurse into
+        subdirectories of the specified directory.
+
+  Yields:
+    (sub_dir, full_file_path) tuples for every file that has a converter.
+  """
+  dir_to_convert = os.path.join(root_dir, sub_dir)
+  recurse_sub_dirs = []
+  for file_in_dir in tf.gfile.ListDirectory(dir_to_convert):
+    full_file_path = os.path.join(dir_to_convert, file_in_dir)
+    if get_source_type(full_file_path):
+      yield sub_dir, full_file_path
+    elif recursive and tf.gfile.IsDirectory(full_file_path):
+      recurse_sub_dirs.append(os.path.join(sub_dir, file_in_dir))
+    else:
+      tf.logging.warning(
+          'Unable to find a converter for file %s', full_file_path)
+
+  for recurse_sub_dir in recurse_sub_dirs:
+    for sub_dir_and_path in list_files(root_dir, recurse_sub_dir, recursive):
+      yield sub_dir_and_path
+
+
+def _read_file(full_file_path):
+  """Reads a file to be converted."""
+  with tf.gfile.GFile(full_file_path, 'rb') as f:
+    return f.read()
+
+
+def _set_sequence_metadata(serialized_sequences, root_dir, sub_dir,
+                           full_file_path):
+  """Sets the collection name, filename, and id of cached sequences.
+
+  Cache entries are keyed by file contents, so a cached sequence may have been
+  converted from an identical file at a different path.
+
+  Args:
+    serialized_sequences: A list of serialized NoteSequences.
+    root_dir: A string specifying the root directory for the files being
+        converted.
+    sub_dir: The directory containing the file.
+    full_file_path: The full path to the file.
+
+  Returns:
+    A list of serialized NoteSequences with updated metadata.
+  """
+  source_type = get_source_type(full_file_path)
+  updated_sequences = []
+  for serialized_sequence in serialized_sequences:
+    sequence = music_pb2.NoteSequence.FromString(serialized_sequence)
+    sequence.collection_name = os.path.basename(root_dir)
+    sequence.filename = os.path.join(sub_dir, os.path.basename(full_file_path))
+    id_filename = sequence.filename
+    if source_type == 'abc':
+      # ABC tunes are keyed by their reference number within the tunebook.
+      id_filename = '{}_{}'.format(sequence.filename, sequence.reference_number)
+    sequence.id = generate_note_sequence_id(
+        id_filename, sequence.collection_name, source_type)
+    updated_sequences.append(sequence.SerializeToString())
+  return updated_sequences
+
+
+def _convert_file_with_cache(cache, root_dir, sub_dir, full_file_path):
+  """Converts a single file, using `cache` to skip unchanged files.
+
+  Args:
+    cache: A `NoteSequenceCache`.
+    root_dir: A string specifying the root directory for the files being
+        converted.
+    sub_dir: The directory containing the file.
+    full_file_path: The full path to the file.
+
+  Returns:
+    A list of serialized NoteSequences.
+  """
+  data = _read_file(full_file_path)
+  key = cache.key(get_source_type(full_file_path), data)
+  serialized_sequences = cache.get(key)
+  if serialized_sequences is not None:
+    return _set_sequence_metadata(
+        serialized_sequences, root_dir, sub_dir, full_file_path)
+  _, serialized_sequences, _ = _convert_file_data(
+      root_dir, sub_dir, full_file_path, data)
+  cache.put(key, serialized_sequences)
+  return serialized_sequences
+
+
+def _convert_file_data(root_dir, sub_dir, full_file_path, data):
+  """Converts the contents of a single file. Runs in a worker process.
+
+  Args:
+    root_dir: A string specifying the root directory for the files being
+        converted.
+    sub_dir: The directory containing the file.
+    full_file_path: The full path to the file.
+    data: The contents of the file. Ignored for MusicXML files, which the
+        MusicXML reader loads from `full_file_path` so that compressed .mxl
+        files are handled.
+
+  Returns:
+    A tuple (source_type, serialized_sequences, parse_seconds).
+  """
+  start_time = time.time()
+  source_type = get_source_type(full_file_path)
+  if source_type == 'midi':
+    sequences = [convert_midi(root_dir, sub_dir, full_file_path, data)]
+  elif source_type == 'musicxml':
+    sequences = [convert_musicxml(root_dir, sub_dir, full_file_path)]
+  else:
+    sequences = convert_abc(root_dir, sub_dir, full_file_path, data) or []
+  serialized_sequences = [sequence.SerializeToString()
+                          for sequence in sequences if sequence]
+  return source_type, serialized_sequences, time.time() - start_time
+
+
+def _submit_conversion(read_pool, parse_pool, root_dir, sub_dir,
+                       full_file_path, cache=None):
+  """Reads a file on `read_pool` and then parses it on `parse_pool`.
+
+  If `cache` has an entry for the file contents, the file is not parsed.
+
+  Returns:
+    A Future for a (source_type, serialized_sequences, parse_seconds,
+    num_bytes, cache_key, cache_hit) tuple. `cache_key` is None if no cache
+    is used.
+  """
+  result = futures.Future()
+
+  def on_parsed(parse_future, num_bytes, cache_key):
+    try:
+      result.set_result(parse_future.result() + (num_bytes, cache_key, False))
+    except Exception as exc:  # pylint: disable=broad-except
+      result.set_exception(exc)
+
+  def on_read(read_future):
+    try:
+      data = read_future.result()
+      source_type = get_source_type(full_file_path)
+      cache_key = None
+      if cache is not None:
+        cache_key = cache.key(source_type, data)
+        serialized_sequences = cache.get(cache_key)
+        if serialized_sequences is not None:
+          result.set_result((
+              source_type,
+              _set_sequence_metadata(
+                  serialized_sequences, root_dir, sub_dir, full_file_path),
+              0.0, len(data), cache_key, True))
+          return
+      parse_pool.submit(
+          _convert_file_data, root_dir, sub_dir, full_file_path, data
+      ).add_done_callback(lambda f: on_parsed(f, len(data), cache_key))
+    except Exception as exc:  # pylint: disable=broad-except
+      result.set_exception(exc)
+
+  read_pool.submit(_read_file, full_file_path).add_done_callback(on_read)
+  return result
+
+
+def convert_files_parallel(root_dir, writer, recursive=False, num_workers=None,
+                           num_read_threads=8, max_in_flight=256,
+                           ordered=False, cache=None):
+  """Converts files using a pool of reader threads and parser processes.
+
+  Files are read on `num_read_threads` threads and parsed on `num_workers`
+  processes. At most `max_in_flight` files are being read or parsed at any
+  time, which bounds memory use on large corpora.
+
+  Args:
+    root_dir: A string specifying a root directory.
+    writer: A TFRecord writer.
+    recursive: A boolean specifying whether or not recursively convert files
+        contained in subdirectories of the specified directory.
+    num_workers: Number of parser processes. If None, the number of CPUs is
+        used.
+    num_read_threads: Number of reader threads.
+    max_in_flight: Maximum number of files being read or parsed at once.
+    ordered: If True, sequences are written in the same order as
+        `convert_files` would write them. Otherwise they are written as soon
+        as they are parsed.
+    cache: An optional `NoteSequenceCache` used to skip files that have
+        already been converted.
+
+  Returns:
+    A list of `Statistic` objects with per-format file, sequence, byte, and
+    parse time counts, plus cache hit and miss counts if `cache` is given.
+  """
+  stats = statistics.StatisticsAccumulator()
+  counts = collections.defaultdict(int)
+  start_time = time.time()
+
+  def write_result(full_file_path, result_future):
+    try:
+      (source_type, serialized_sequences, parse_seconds, num_bytes, cache_key,
+       cache_hit) = result_future.result()
+    except Exception as exc:  # pylint: disable=broad-except
+      tf.logging.fatal('%r generated an exception: %s', full_file_path, exc)
+      stats.add([statistics.Counter(
+          '%s_files_failed' % get_source_type(full_file_path), 1)])
+      return
+    if cache_key is not None and not cache_hit:
+      cache.put(cache_key, serialized_sequences)
+    for serialized_sequence in serialized_sequences:
+      writer.write(serialized_sequence)
+    stats.add([
+        statistics.Counter('%s_files_converted' % source_type,
+                           1 if serialized_sequences else 0),
+        statistics.Counter('%s_files_failed' % source_type,
+                           0 if serialized_sequences else 1),
+        statistics.Counter('%s_sequences_written' % source_type,
+                           len(serialized_sequences)),
+        statistics.Counter('%s_bytes_read' % source_type, num_bytes),
+        statistics.Counter('%s_parse_milliseconds' % source_type,
+                           int(parse_seconds * 1000)),
+    ])
+    counts['files'] += 1
+    tf.logging.log_every_n(tf.logging.INFO, '%d files converted.',
+                           1000, counts['files'])
+
+  with futures.ThreadPoolExecutor(num_read_threads) as read_pool, \
+      futures.ProcessPoolExecutor(num_workers) as parse_pool:
+    in_flight = collections.OrderedDict()
+
+    def wait_for_one():
+      if ordered:
+        result_future = next(iter(in_flight))
+      else:
+        done, _ = futures.wait(
+            list(in_flight.keys()), return_when=futures.FIRST_COMPLETED)
+        result_future = next(iter(done))
+      write_result(in_flight.pop(result_future), result_future)
+
+    for sub_dir, full_file_path in list_files(root_dir, '', recursive):
+      if len(in_flight) >= max_in_flight:
+        wait_for_one()
+      result_future = _submit_conversion(
+          read_pool, parse_pool, root_dir, sub_dir, full_file_path, cache)
+      in_flight[result_future] = full_file_path
+    while in_flight:
+      wait_for_one()
+
+  elapsed_seconds = time.time() - start_time
+  if cache is not None:
+    stats.add(cache.get_stats())
+  merged_stats = stats.get_stats()
+  statistics.log_statistics_list(merged_stats, tf.logging.info)
+  for stat in sorted(merged_stats, key=lambda s: s.name):
+    if stat.name.endswith('_files_converted'):
+      tf.logging.info('%s: %.1f files/sec', stat.name,
+                      stat.count / max(elapsed_seconds, 1e-9))
+  return merged_stats
+
+
+def convert_directory(root_dir, output_file, recursive=False, num_workers=1,
+                      num_read_threads=8, max_in_flight=256, ordered=False,
+                      cache_dir=None, cache_max_size_bytes=None):
   """Converts files to NoteSequences and writes to `output_file`.
 
   Input files found in `root_dir` are converted to NoteSequence protos with the
@@ -230,9 +561,32 @@ def convert_directory(root_dir, output_file, recursive=False):
     output_file: Path to TFRecord file to write results to.
     recursive: A boolean specifying whether or not recursively convert files
         contained in subdirectories of the specified directory.
+    num_workers: Number of processes used to parse files. If greater than 1,
+        files are converted with `convert_files_parallel`.
+    num_read_threads: Number of threads used to read files when converting in
+        parallel.
+    max_in_flight: Maximum number of files being read or parsed at once when
+        converting in parallel.
+    ordered: When converting in parallel, whether to write sequences in the
+        same order as a serial conversion.
+    cache_dir: Optional directory for a `NoteSequenceCache`. Files whose
+        contents were converted by a previous run are not parsed again.
+    cache_max_size_bytes: Optional size limit for the cache.
   """
+  cache = None
+  if cache_dir:
+    cache = note_sequence_cache.NoteSequenceCache(
+        cache_dir, max_size_bytes=cache_max_size_bytes)
   with tf.io.TFRecordWriter(output_file) as writer:
-    convert_files(root_dir, '', writer, recursive)
+    if num_workers > 1:
+      convert_files_parallel(
+          root_dir, writer, recursive, num_workers=num_workers,
+          num_read_threads=num_read_threads, max_in_flight=max_in_flight,
+          ordered=ordered, cache=cache)
+    else:
+      convert_files(root_dir, '', writer, recursive, cache)
+      if cache is not None:
+        statistics.log_statistics_list(cache.get_stats(), tf.logging.info)
 
 
 def main(unused_argv):
@@ -252,7 +606,15 @@ def main(unused_argv):
   if output_dir:
     tf.gfile.MakeDirs(output_dir)
 
-  convert_directory(input_dir, output_file, FLAGS.recursive)
+  convert_directory(input_dir, output_file, FLAGS.recursive,
+                    num_workers=FLAGS.num_workers,
+                    num_read_threads=FLAGS.num_read_threads,
+                    max_in_flight=FLAGS.max_in_flight,
+                    ordered=FLAGS.ordered,
+                    cache_dir=FLAGS.cache_dir,
+                    cache_max_size_bytes=(
+                        FLAGS.cache_max_size_mb * 1024 * 1024
+                        if FLAGS.cache_max_size_mb > 0 else None))
 
 
 def console_entry_point():
@@ -104,6 +104,51 @@ class ConvertMidiDirToSequencesTest(tf.test.TestCase):
     self.runTest('sub_1/sub', recursive=True)
     self.runTest('sub_2', recursive=True)
 
+  def testConvertMidiDirToSequences_Parallel(self):
+    with tempfile.NamedTemporaryFile(
+        prefix='ConvertMidiDirToSequencesTest') as serial_file:
+      convert_dir_to_note_sequences.convert_directory(
+          self.root_dir, serial_file.name, recursive=True)
+      serial_sequences = list(
+          tf.python_io.tf_record_iterator(serial_file.name))
+
+    for ordered in [True, False]:
+      with tempfile.NamedTemporaryFile(
+          prefix='ConvertMidiDirToSequencesTest') as parallel_file:
+        convert_dir_to_note_sequences.convert_directory(
+            self.root_dir, parallel_file.name, recursive=True, num_workers=2,
+            num_read_threads=2, max_in_flight=3, ordered=ordered)
+        parallel_sequences = list(
+            tf.python_io.tf_record_iterator(parallel_file.name))
+      if ordered:
+        self.assertEqual(serial_sequences, parallel_sequences)
+      else:
+        self.assertCountEqual(serial_sequences, parallel_sequences)
+
+  def testConvertMidiDirToSequences_Cache(self):
+    cache_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    for num_workers in [1, 2, 1]:
+      with tempfile.NamedTemporaryFile(
+          prefix='ConvertMidiDirToSequencesTest') as uncached_file:
+        convert_dir_to_note_sequences.convert_directory(
+            self.root_dir, uncached_file.name, recursive=True)
+        uncached_sequences = list(
+            tf.python_io.tf_record_iterator(uncached_file.name))
+      with tempfile.NamedTemporaryFile(
+          prefix='ConvertMidiDirToSequencesTest') as cached_file:
+        convert_dir_to_note_sequences.convert_directory(
+            self.root_dir, cached_file.name, recursive=True,
+            num_workers=num_workers, ordered=True, cache_dir=cache_dir)
+        cached_sequences = list(
+            tf.python_io.tf_record_iterator(cached_file.name))
+      self.assertEqual(uncached_sequences, cached_sequences)
+
+    # Every test file has the same contents, so they share one cache entry.
+    cache_entries = [
+        filename for _, _, filenames in os.walk(cache_dir)
+        for filename in filenames]
+    self.assertLen(cache_entries, 1)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,192 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""On-disk cache of converted NoteSequences keyed by file content."""
+
+import hashlib
+import os
+import threading
+import uuid
+
+from magenta import version as magenta_version
+from magenta.pipelines import statistics
+import note_seq
+import tensorflow.compat.v1 as tf
+
+# Entries are evicted down to this fraction of the size limit, so that a full
+# cache is not rescanned on every insertion.
+_EVICTION_TARGET_FRACTION = 0.9
+
+
+def default_converter_version():
+  """Returns a string identifying the code that converts files to sequences."""
+  return 'magenta-%s/note_seq-%s' % (
+      magenta_version.__version__,
+      getattr(note_seq, '__version__', 'unknown'))
+
+
+class NoteSequenceCache(object):
+  """Caches serialized NoteSequences converted from music files.
+
+  Entries are keyed by a hash of the file contents, the source type, and the
+  converter version, so a file is only converted again if its contents change
+  or the conversion code is upgraded. Each entry is stored as a TFRecord file
+  of serialized NoteSequences. Files that could not be converted are cached as
+  empty entries so they are skipped too.
+
+  Cached sequences still carry the collection name, filename, and id of the
+  file they were first converted from; callers are expected to overwrite those.
+
+  If `max_size_bytes` is given, the least recently used entries are evicted
+  whenever the cache grows past it. The cache directory must be on a local
+  filesystem.
+
+  `get` and `put` are safe to call from multiple threads.
+  """
+
+  def __init__(self, cache_dir, max_size_bytes=None, converter_version=None):
+    """Constructs a `NoteSequenceCache`.
+
+    Args:
+      cache_dir: Directory to store cache entries in. Created if missing.
+      max_size_bytes: Optional limit on the total size of the cache.
+      converter_version: String that identifies the conversion code. Entries
+          written with a different version are never returned. Defaults to
+          `default_converter_version()`.
+    """
+    self._cache_dir = cache_dir
+    self._max_size_bytes = max_size_bytes
+    self._converter_version = (
+        converter_version if converter_version is not None
+        else default_converter_version())
+    self._lock = threading.Lock()
+    self._hits = statistics.Counter('cache_hits')
+    self._misses = statistics.Counter('cache_misses')
+    self._evictions = statistics.Counter('cache_evictions')
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+    self._size_bytes = sum(size for _, _, size in self._list_entries())
+
+  @property
+  def size_bytes(self):
+    """The total size of all entries in the cache."""
+    return self._size_bytes
+
+  def key(self, source_type, data):
+    """Returns the cache key for a file.
+
+    Args:
+      source_type: The source type of the file, e.g. 'midi'.
+      data: The raw bytes of the file.
+
+    Returns:
+      A hex digest string.
+    """
+    key_hash = hashlib.sha256()
+    key_hash.update(self._converter_version.encode('utf-8'))
+    key_hash.update(b'\0')
+    key_hash.update(source_type.encode('utf-8'))
+    key_hash.update(b'\0')
+    key_hash.update(data)
+    return key_hash.hexdigest()
+
+  def _entry_path(self, key):
+    return os.path.join(self._cache_dir, key[:2], key + '.tfrecord')
+
+  def get(self, key):
+    """Returns the cached serialized NoteSequences for `key`, or None.
+
+    Args:
+      key: A key returned by `key`.
+
+    Returns:
+      A list of serialized NoteSequences, which is empty if the file could not
+      be converted, or None if there is no entry for `key`.
+    """
+    path = self._entry_path(key)
+    try:
+      serialized_sequences = list(tf.python_io.tf_record_iterator(path))
+      # Mark the entry as recently used for eviction.
+      os.utime(path, None)
+    except (IOError, OSError, tf.errors.NotFoundError):
+      with self._lock:
+        self._misses.increment()
+      return None
+    with self._lock:
+      self._hits.increment()
+    return serialized_sequences
+
+  def put(self, key, serialized_sequences):
+    """Stores serialized NoteSequences under `key`.
+
+    Args:
+      key: A key returned by `key`.
+      serialized_sequences: A list of serialized NoteSequences. May be empty.
+    """
+    path = self._entry_path(key)
+    entry_dir = os.path.dirname(path)
+    if not os.path.isdir(entry_dir):
+      try:
+        os.makedirs(entry_dir)
+      except OSError:
+        if not os.path.isdir(entry_dir):
+          raise
+    # Write to a temporary file first so readers never see partial entries.
+    temp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+    with tf.io.TFRecordWriter(temp_path) as writer:
+      for serialized_sequence in serialized_sequences:
+        writer.write(serialized_sequence)
+    entry_size = os.path.getsize(temp_path)
+    previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+    os.rename(temp_path, path)
+    with self._lock:
+      self._size_bytes += entry_size - previous_size
+      if (self._max_size_bytes is not None and
+          self._size_bytes > self._max_size_bytes):
+        self._evict()
+
+  def _list_entries(self):
+    """Returns a list of (path, mtime, size) for every cache entry."""
+    entries = []
+    for dir_path, _, filenames in os.walk(self._cache_dir):
+      for filename in filenames:
+        if not filename.endswith('.tfrecord'):
+          continue
+        path = os.path.join(dir_path, filename)
+        try:
+          stat = os.stat(path)
+        except OSError:
+          continue
+        entries.append((path, stat.st_mtime, stat.st_size))
+    return entries
+
+  def _evict(self):
+    """Removes least recently used entries until under the size limit."""
+    target_size = self._max_size_bytes * _EVICTION_TARGET_FRACTION
+    entries = self._list_entries()
+    self._size_bytes = sum(size for _, _, size in entries)
+    for path, _, size in sorted(entries, key=lambda e: e[1]):
+      if self._size_bytes <= target_size:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      self._size_bytes -= size
+      self._evictions.increment()
+
+  def get_stats(self):
+    """Returns hit, miss, and eviction Counters for this cache."""
+    with self._lock:
+      return [self._hits.copy(), self._misses.copy(), self._evictions.copy()]
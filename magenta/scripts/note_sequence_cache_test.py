@@ -0,0 +1,94 @@
+# Copyright 2024 The Magenta Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for note_sequence_cache."""
+
+import os
+import time
+
+from absl.testing import absltest
+from magenta.scripts import note_sequence_cache
+
+
+class NoteSequenceCacheTest(absltest.TestCase):
+
+  def _counts(self, cache):
+    return dict((stat.name, stat.count) for stat in cache.get_stats())
+
+  def testGetAndPut(self):
+    cache = note_sequence_cache.NoteSequenceCache(
+        self.create_tempdir().full_path)
+    key = cache.key('midi', b'midi data')
+    self.assertIsNone(cache.get(key))
+
+    cache.put(key, [b'sequence 1', b'sequence 2'])
+    self.assertEqual([b'sequence 1', b'sequence 2'], cache.get(key))
+
+    empty_key = cache.key('midi', b'bad midi data')
+    cache.put(empty_key, [])
+    self.assertEqual([], cache.get(empty_key))
+
+    self.assertEqual(
+        {'cache_hits': 2, 'cache_misses': 1, 'cache_evictions': 0},
+        self._counts(cache))
+
+  def testKeyDependsOnContentsTypeAndVersion(self):
+    cache_dir = self.create_tempdir().full_path
+    cache_1 = note_sequence_cache.NoteSequenceCache(cache_dir, None, 'v1')
+    cache_2 = note_sequence_cache.NoteSequenceCache(cache_dir, None, 'v2')
+    self.assertEqual(cache_1.key('midi', b'data'), cache_1.key('midi', b'data'))
+    self.assertNotEqual(
+        cache_1.key('midi', b'data'), cache_1.key('midi', b'other data'))
+    self.assertNotEqual(
+        cache_1.key('midi', b'data'), cache_1.key('abc', b'data'))
+    self.assertNotEqual(
+        cache_1.key('midi', b'data'), cache_2.key('midi', b'data'))
+
+    cache_1.put(cache_1.key('midi', b'data'), [b'sequence'])
+    self.assertIsNone(cache_2.get(cache_2.key('midi', b'data')))
+
+  def testSizeIsRestoredFromDisk(self):
+    cache_dir = self.create_tempdir().full_path
+    cache = note_sequence_cache.NoteSequenceCache(cache_dir)
+    cache.put(cache.key('midi', b'data'), [b'x' * 100])
+    self.assertGreater(cache.size_bytes, 100)
+    self.assertEqual(
+        cache.size_bytes,
+        note_sequence_cache.NoteSequenceCache(cache_dir).size_bytes)
+
+  def testEviction(self):
+    cache_dir = self.create_tempdir().full_path
+    cache = note_sequence_cache.NoteSequenceCache(cache_dir)
+    keys = [cache.key('midi', str(i).encode('utf-8')) for i in range(3)]
+    cache.put(keys[0], [b'x' * 1000])
+    entry_size = cache.size_bytes
+
+    cache = note_sequence_cache.NoteSequenceCache(
+        cache_dir, max_size_bytes=int(entry_size * 2.5))
+    cache.put(keys[1], [b'x' * 1000])
+    # Make sure the first entry is the most recently used one.
+    os.utime(os.path.join(cache_dir, keys[1][:2], keys[1] + '.tfrecord'),
+             (time.time() - 100, time.time() - 100))
+    self.assertIsNotNone(cache.get(keys[0]))
+
+    cache.put(keys[2], [b'x' * 1000])
+    self.assertLessEqual(cache.size_bytes, entry_size * 2.5)
+    self.assertIsNone(cache.get(keys[1]))
+    self.assertIsNotNone(cache.get(keys[0]))
+    self.assertIsNotNone(cache.get(keys[2]))
+    self.assertEqual(1, self._counts(cache)['cache_evictions'])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -37,7 +37,6 @@ REQUIRED_PACKAGES = [
     'numpy == 1.22.0',
     'Pillow == 10.3.0',
     'pretty_midi == 0.2.9',
-    'pygtrie == 2.5.0',
     'python-rtmidi == 1.1.2',
     'scikit-image == 0.19.3',
     'scipy == 1.7.3',